@@ -70,6 +70,8 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'repocache.middleware.IdentityMapMiddleware',
+    'core.middleware.PermissionResolverMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'rollbar.contrib.django.middleware.RollbarNotifierMiddleware',
@@ -210,9 +212,41 @@ SOCIAL_AUTH_PIPELINE = (
 BASE_URL = os.environ.get('WEBLAB_BASE_URL', 'http://127.0.0.1:8000')
 
 REPO_BASE = BASE_DIR / 'data/repositories'
+
+# Maximum number of files that pooled entity repositories may keep open between them.
+# If None, a quarter of the process's open file limit is used.
+REPO_POOL_MAX_OPEN_FILES = None
 EXPERIMENT_BASE = BASE_DIR / 'data/experiments'
 DATASETS_BASE = BASE_DIR / 'data/datasets'
 
+# Built COMBINE archives of entity versions are cached here. Least recently used archives
+# are removed once their total size exceeds ARCHIVE_CACHE_MAX_SIZE bytes; 0 disables the cache.
+ARCHIVE_CACHE_BASE = BASE_DIR / 'data/archive_cache'
+ARCHIVE_CACHE_MAX_SIZE = 2 * 1024 ** 3
+
+# Number of threads with which to compress the files in a COMBINE archive of an entity version.
+# If None, files are compressed one at a time.
+ARCHIVE_COMPRESSION_WORKERS = 4
+
+# Limits on receiving experiment results archives from the back-end (see experiments.uploadhandler):
+# the maximum archive size in bytes, the disk space in bytes that must remain free after receiving
+# an archive, and the number of archives each server process may receive at once.
+CALLBACK_UPLOAD_MAX_SIZE = 2 * 1024 ** 3
+CALLBACK_UPLOAD_MIN_FREE_SPACE = 1024 ** 3
+CALLBACK_MAX_CONCURRENT_UPLOADS = 4
+
+# Default and maximum numbers of points in each series of downsampled plot data
+DOWNSAMPLE_DEFAULT_POINTS = 1000
+DOWNSAMPLE_MAX_POINTS = 10000
+
+# Name of the Django cache (see CACHES) in which entity versions and commit details are shared
+# between requests, and the number of seconds for which they may be kept there. Commit metadata
+# never changes, so by default it is kept until evicted by the cache; the visibility, tags etc.
+# of versions are also forgotten whenever they are changed.
+REPOCACHE_CACHE = 'default'
+REPOCACHE_VERSION_METADATA_TIMEOUT = None
+REPOCACHE_VERSION_STATE_TIMEOUT = 600
+
 # URL of Chaste backend
 CHASTE_URL = os.environ.get('CHASTE_URL', 'http://localhost:5000/chaste')
 
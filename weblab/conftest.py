@@ -7,11 +7,13 @@ from unittest.mock import PropertyMock, patch
 import pytest
 from django.contrib.auth.models import AnonymousUser, Permission
 from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.db.models.functions import Now
 
 from accounts.models import User
 from core import recipes
+from core.combine import archive_index_cache
 from datasets.models import Dataset
 from entities.models import Entity
 from fitting.models import FittingResult
@@ -64,6 +66,7 @@ class Helpers:
             timestamp=date or Now(),
             visibility=visibility,
         )
+        entity.repocache.update_summary()
         return version
 
     # Used to ensure each test commit has a different timestamp
@@ -149,6 +152,24 @@ def fake_dataset_path(settings, tmpdir):
     return settings.DATASETS_BASE
 
 
+@pytest.fixture(autouse=True)
+def fake_archive_cache_path(settings, tmpdir):
+    settings.ARCHIVE_CACHE_BASE = Path(str(tmpdir)) / 'archive_cache'
+    return settings.ARCHIVE_CACHE_BASE
+
+
+@pytest.fixture(autouse=True)
+def clear_archive_index_cache():
+    yield
+    archive_index_cache.clear()
+
+
+@pytest.fixture(autouse=True)
+def clear_django_cache():
+    yield
+    cache.clear()
+
+
 @pytest.fixture
 def model_with_version():
     model = recipes.model.make()
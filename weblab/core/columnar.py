@@ -0,0 +1,198 @@
+"""Compact binary storage for numeric CSV data, so that columns can be served without parsing text.
+
+A column file holds a table of float64 values column by column, which makes any one column a
+contiguous run of bytes. Its layout is:
+
+- the 8 bytes ``MAGIC``;
+- a little-endian uint32 giving the length of the JSON header that follows;
+- the UTF-8 JSON header, an object with keys ``rows`` (the number of rows) and ``columns``
+  (the column names, or null if the CSV had no header row), padded with spaces so the data
+  starts at a multiple of 8 bytes;
+- each column in turn as ``rows`` little-endian float64 values. Missing values are NaN.
+"""
+
+import csv
+import io
+import json
+import math
+import os
+import struct
+import sys
+import tempfile
+from array import array
+
+
+MAGIC = b'WLCOLS01'
+
+_HEADER_LENGTH = struct.Struct('<I')
+
+# Size of the chunks in which column data is read
+CHUNK_SIZE = 64 * 1024
+
+
+def _is_number(value):
+    try:
+        float(value)
+    except ValueError:
+        return False
+    return True
+
+
+def parse_csv(lines):
+    """
+    Parse numeric CSV data into columns
+
+    As in the plotting code, the first row is taken to be column names if its first value is not
+    a number but the second row's is. Empty values, and values missing from short rows, are NaN.
+
+    :param lines: iterable of lines of CSV text
+    :return: (names, columns) tuple, where names is a list of column names (or None) and
+        columns is a list of `array('d')` objects, all of the same length
+    :raise: `ValueError` if the data are not all numeric
+    """
+    names = None
+    columns = []
+    num_rows = 0
+    rows = csv.reader(lines)
+    for row in rows:
+        if not row:
+            continue  # Blank line
+        if num_rows == 0 and names is None and row and not _is_number(row[0]):
+            names = row
+            continue
+        if len(row) > len(columns):
+            columns.extend(array('d', [math.nan]) * num_rows for _ in range(len(row) - len(columns)))
+        for column, value in zip(columns, row):
+            column.append(float(value) if value.strip() else math.nan)
+        for column in columns[len(row):]:
+            column.append(math.nan)
+        num_rows += 1
+    if names is not None:
+        if num_rows == 0:
+            raise ValueError('No numeric data')
+        columns.extend(array('d', [math.nan]) * num_rows for _ in range(len(names) - len(columns)))
+        names.extend('' for _ in range(len(columns) - len(names)))
+    return names, columns
+
+
+def _header_bytes(names, num_rows):
+    header = json.dumps({'rows': num_rows, 'columns': names}).encode()
+    header_size = len(MAGIC) + _HEADER_LENGTH.size + len(header)
+    header += b' ' * (-header_size % 8)
+    return MAGIC + _HEADER_LENGTH.pack(len(header)) + header
+
+
+def _column_bytes(column):
+    if sys.byteorder != 'little':
+        column = array('d', column)
+        column.byteswap()
+    return column.tobytes()
+
+
+def write_columns(path, names, columns):
+    """
+    Atomically write a column file
+
+    :param path: `Path` of the file to write
+    :param names: list of column names, or None
+    :param columns: list of `array('d')` columns of equal length
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=str(path.parent), suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as output:
+            output.write(_header_bytes(names, len(columns[0]) if columns else 0))
+            for column in columns:
+                output.write(_column_bytes(column))
+        os.replace(temp_path, str(path))
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+def convert_csv(source, path):
+    """
+    Convert a numeric CSV file to a column file
+
+    :param source: binary file-like object containing the CSV data
+    :param path: `Path` of the column file to write
+    :raise: `ValueError` if the CSV file is not entirely numeric
+    """
+    try:
+        names, columns = parse_csv(io.TextIOWrapper(source, encoding='utf-8', newline=''))
+    except (UnicodeDecodeError, csv.Error) as e:
+        raise ValueError(str(e)) from e
+    if not columns:
+        raise ValueError('No data')
+    write_columns(path, names, columns)
+
+
+class ColumnFile:
+    """
+    Read a column file
+    """
+    def __init__(self, path):
+        """
+        :param path: path of the column file
+        :raise: `ValueError` if the file is not a column file
+        """
+        self.path = str(path)
+        with open(self.path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError('Not a column file')
+            (header_length,) = _HEADER_LENGTH.unpack(f.read(_HEADER_LENGTH.size))
+            header = json.loads(f.read(header_length).decode())
+        self.rows = header['rows']
+        self.names = header['columns']
+        self.data_offset = len(MAGIC) + _HEADER_LENGTH.size + header_length
+        self.num_columns = (os.path.getsize(self.path) - self.data_offset) // (8 * self.rows or 1)
+
+    def read_column(self, index):
+        """
+        :param index: index of the column
+        :return: `array('d')` of the column's values
+        """
+        column = array('d')
+        column.frombytes(b''.join(self.iter_bytes([index])))
+        if sys.byteorder != 'little':
+            column.byteswap()
+        return column
+
+    def subset_size(self, indices):
+        """
+        :param indices: indices of the columns to include
+        :return: size in bytes of the column file given by `iter_bytes`
+        """
+        names = None if self.names is None else [self.names[i] for i in indices]
+        return len(_header_bytes(names, self.rows)) + 8 * self.rows * len(indices)
+
+    def iter_bytes(self, indices, *, with_header=False):
+        """
+        Read the data for some of the columns
+
+        :param indices: indices of the columns to read, in the order wanted
+        :param with_header: whether to start with a header, so that the result is itself a
+            column file holding just these columns
+        :return: iterable of bytes chunks
+        :raise: `IndexError` if a column does not exist
+        """
+        for index in indices:
+            if not 0 <= index < self.num_columns:
+                raise IndexError('No column %d' % index)
+        return self._iter_bytes(indices, with_header)
+
+    def _iter_bytes(self, indices, with_header):
+        if with_header:
+            names = None if self.names is None else [self.names[i] for i in indices]
+            yield _header_bytes(names, self.rows)
+        column_size = 8 * self.rows
+        with open(self.path, 'rb') as f:
+            for index in indices:
+                f.seek(self.data_offset + index * column_size)
+                remaining = column_size
+                while remaining > 0:
+                    data = f.read(min(CHUNK_SIZE, remaining))
+                    if not data:
+                        raise ValueError('Column file is truncated')
+                    remaining -= len(data)
+                    yield data
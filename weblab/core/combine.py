@@ -1,9 +1,23 @@
 import mimetypes
+import os
+import struct
+import threading
 import xml.etree.ElementTree as ET
 import zipfile
-from io import BytesIO
+import zlib
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from io import (
+    SEEK_CUR,
+    SEEK_END,
+    SEEK_SET,
+    BytesIO,
+    RawIOBase,
+)
 from pathlib import Path
 
+from .filetypes import get_file_type
+
 
 COMBINE_NS = 'http://identifiers.org/combine.specifications/'
 MANIFEST_NS = '%somex-manifest' % COMBINE_NS
@@ -170,12 +184,17 @@ class ArchiveReader:
     """
     Read in a COMBINE archive
     """
+
+    # Size of the chunks in which `verify` reads files
+    VERIFY_CHUNK_SIZE = 64 * 1024
+
     def __init__(self, archive):
         """
         Create an archive reader
 
         @param archive - filename or file-like object of archive
         """
+        self._archive = archive
         self._zip_archive = zipfile.ZipFile(archive)
 
     @property
@@ -186,25 +205,318 @@ class ArchiveReader:
         :return: iterable of ArchiveFile objects, augmented with size information
         """
         with self._zip_archive as archive:
-            reader = ManifestReader()
-            reader.read(archive.open(MANIFEST_FILENAME))
-            files = reader.files
-            for f in files:
-                f.size = archive.getinfo(f.name).file_size
-            return files
+            return self._read_files(archive)
+
+    @staticmethod
+    def _read_files(archive):
+        reader = ManifestReader()
+        reader.read(archive.open(MANIFEST_FILENAME))
+        files = reader.files
+        for f in files:
+            f.size = archive.getinfo(f.name).file_size
+        return files
+
+    def verify(self):
+        """
+        Check that the archive is intact, reading every file in it once
+
+        The CRC of each file is checked, and there must be a manifest which only lists files
+        present in the archive.
+
+        :return: list of `ArchiveFile` objects listed in the manifest, with size information
+        :raise: `zipfile.BadZipFile` if the archive is invalid
+        """
+        with self._zip_archive as archive:
+            for info in archive.infolist():
+                try:
+                    with archive.open(info) as member:
+                        # zipfile checks the CRC once the end of the file is read
+                        while member.read(self.VERIFY_CHUNK_SIZE):
+                            pass
+                except (EOFError, NotImplementedError, RuntimeError, zlib.error) as e:
+                    raise zipfile.BadZipFile('Cannot read %s: %s' % (info.filename, e)) from e
+            try:
+                return self._read_files(archive)
+            except KeyError as e:
+                if MANIFEST_FILENAME not in archive.NameToInfo:
+                    raise zipfile.BadZipFile('Archive has no %s' % MANIFEST_FILENAME) from e
+                raise zipfile.BadZipFile('Manifest lists a file not in the archive: %s' % e) from e
+            except ET.ParseError as e:
+                raise zipfile.BadZipFile('Invalid manifest: %s' % e) from e
 
     def open_file(self, name):
         with self._zip_archive as archive:
             return archive.open(name)
 
+    def get_size(self, name):
+        """
+        Get the uncompressed size of a file in the archive
+
+        :param name: name of the file within the archive
+        :return: size in bytes
+        :raise: `KeyError` if there is no such file
+        """
+        return self._zip_archive.getinfo(name).file_size
+
+    def open_member(self, name):
+        """
+        Open a file in the archive for streaming, without reading it all into memory
+
+        Files stored uncompressed in an archive on disk are read straight from their position in
+        the archive file, so seeking within them is cheap. Other files are decompressed
+        incrementally as they are read.
+
+        :param name: name of the file within the archive
+        :return: seekable binary file-like object, which should be closed after use
+        :raise: `KeyError` if there is no such file
+        """
+        info = self._zip_archive.getinfo(name)
+        if (info.compress_type != zipfile.ZIP_STORED or info.flag_bits & 0x1 or
+                not isinstance(self._archive, (str, os.PathLike))):
+            # Compressed, encrypted, or not in a file we can reopen
+            return self._zip_archive.open(info)
+
+        fileobj = open(self._archive, 'rb', buffering=0)
+        try:
+            fileobj.seek(info.header_offset)
+            header = struct.unpack(zipfile.structFileHeader, fileobj.read(zipfile.sizeFileHeader))
+            if header[0] != zipfile.stringFileHeader:
+                raise zipfile.BadZipFile('Bad local file header for %s' % name)
+            # The local header ends with the lengths of the file name and extra field
+            offset = info.header_offset + zipfile.sizeFileHeader + header[-2] + header[-1]
+        except Exception:
+            fileobj.close()
+            raise
+        return _StoredMember(fileobj, offset, info.file_size)
+
+
+class _StoredMember(RawIOBase):
+    """
+    Read-only view of the bytes of an uncompressed file within an archive file
+    """
+    def __init__(self, fileobj, offset, size):
+        """
+        :param fileobj: unbuffered binary file object for the archive, which is closed with this
+        :param offset: position of the member's data within the archive
+        :param size: size of the member in bytes
+        """
+        self._file = fileobj
+        self._offset = offset
+        self._size = size
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, pos, whence=SEEK_SET):
+        if whence == SEEK_CUR:
+            pos += self._pos
+        elif whence == SEEK_END:
+            pos += self._size
+        elif whence != SEEK_SET:
+            raise ValueError('Invalid whence (%r)' % whence)
+        if pos < 0:
+            raise ValueError('Negative seek position %d' % pos)
+        self._pos = pos
+        return pos
+
+    def readinto(self, buffer):
+        length = min(len(buffer), self._size - self._pos)
+        if length <= 0:
+            return 0
+        self._file.seek(self._offset + self._pos)
+        read = self._file.readinto(memoryview(buffer)[:length])
+        self._pos += read
+        return read
+
+    def close(self):
+        if not self.closed:
+            self._file.close()
+        super().close()
+
+
+class ArchiveIndexCache:
+    """
+    Process-wide cache of the files listed in COMBINE archives on disk
+
+    Reading an archive's file list means opening the zip and parsing its manifest, so the
+    result is kept for the most recently used `MAX_ENTRIES` archives. An entry is only used
+    while the archive's inode, modification time and size are unchanged, so archives that are
+    replaced or rewritten are read again.
+    """
+
+    MAX_ENTRIES = 256
+
+    def __init__(self):
+        self._entries = OrderedDict()  # path -> (stat key, files)
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def get_files(self, path):
+        """
+        List the files in an archive
+
+        :param path: path of the archive
+        :return: list of `ArchiveFile` objects, with size information.
+            The objects are shared, so must not be modified.
+        :raise: `FileNotFoundError` if the archive does not exist
+        """
+        path = str(path)
+        st = os.stat(path)
+        key = (st.st_ino, st.st_mtime_ns, st.st_size)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry[0] == key:
+                self._entries.move_to_end(path)
+                self.hits += 1
+                return list(entry[1])
+            self.misses += 1
+
+        files = ArchiveReader(path).files
+        with self._lock:
+            self._entries[path] = (key, files)
+            self._entries.move_to_end(path)
+            while len(self._entries) > self.MAX_ENTRIES:
+                self._entries.popitem(last=False)
+        return list(files)
+
+    def discard(self, path):
+        """
+        Forget the files in an archive, e.g. when it is deleted
+
+        :param path: path of the archive
+        """
+        with self._lock:
+            self._entries.pop(str(path), None)
+
+    def clear(self):
+        """
+        Forget all archives
+        """
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+archive_index_cache = ArchiveIndexCache()
+
+
+# Zip general purpose flag, and signature, for a data descriptor following a member's data
+_ZIP_USE_DATA_DESCRIPTOR = 0x08
+_ZIP_DATA_DESCRIPTOR_SIGNATURE = 0x08074b50
+
+
+class _StreamSink:
+    """
+    Write-only, unseekable file-like object for streaming a zip file as it is written
+
+    As it can't seek, `zipfile` writes each member's sizes and CRC in a data descriptor after
+    its data, so everything written can be taken away with `take` and sent on at once.
+    """
+    def __init__(self):
+        self._buffer = BytesIO()
+        self._offset = 0  # Position in the archive of the start of our buffer
+
+    def write(self, data):
+        return self._buffer.write(data)
+
+    def tell(self):
+        return self._offset + self._buffer.tell()
+
+    def flush(self):
+        pass
+
+    def take(self):
+        """
+        Remove and return all the data written so far
+
+        :return: bytes written since the last call
+        """
+        data = self._buffer.getvalue()
+        self._offset += len(data)
+        self._buffer = BytesIO()
+        return data
+
 
 class ArchiveWriter:
     """
     Write a COMBINE archive
+
+    Each file is deflated unless `core.filetypes.get_file_type` says its contents are already
+    compressed, in which case it is stored as is. Files are read and compressed in chunks, so
+    only a little of each is held in memory at once.
+
+    Files may instead be deflated in parallel by a pool of threads (zlib releases the GIL).
+    Each such file is then read whole and compressed by a worker, and the members are written
+    in order as the workers finish. The archive is the same whichever way it is written.
     """
-    def __init__(self):
-        self._memfile = BytesIO()
-        self._zip_archive = zipfile.ZipFile(self._memfile, 'w', zipfile.ZIP_DEFLATED)
+
+    # File types whose contents are already compressed, so would gain nothing from deflating
+    COMPRESSED_FILE_TYPES = {'COMBINE archive', 'HDF5', 'PNG'}
+
+    # Size in bytes of the chunks in which file contents are read
+    CHUNK_SIZE = 64 * 1024
+
+    # Size in bytes above which files are not deflated by worker threads, but streamed as usual,
+    # so that they needn't be held in memory
+    PARALLEL_MAX_SIZE = 16 * 1024 * 1024
+
+    def __init__(self, workers=None):
+        """
+        :param workers: number of threads with which to deflate files,
+            or None to deflate them one at a time as they are streamed
+        """
+        self.workers = workers
+
+    @classmethod
+    def compress_type(cls, filename):
+        """
+        Choose how to compress a file in an archive
+
+        :param filename: name of the file
+        :return: `zipfile.ZIP_STORED` or `zipfile.ZIP_DEFLATED`
+        """
+        if get_file_type(filename) in cls.COMPRESSED_FILE_TYPES:
+            return zipfile.ZIP_STORED
+        return zipfile.ZIP_DEFLATED
+
+    @staticmethod
+    def _content_size(contents):
+        """
+        :param contents: bytes or binary file-like object
+        :return: number of bytes of contents left to read, or None if not known without reading them
+        """
+        if isinstance(contents, bytes):
+            return len(contents)
+        if getattr(contents, 'seekable', lambda: False)():
+            position = contents.tell()
+            size = contents.seek(0, SEEK_END) - position
+            contents.seek(position)
+            return size
+        return None
+
+    @classmethod
+    def _iter_chunks(cls, contents):
+        """
+        :param contents: str, bytes or binary file-like object
+        :return: iterable of bytes chunks of the contents
+        """
+        if isinstance(contents, str):
+            contents = contents.encode('utf-8')
+        if isinstance(contents, bytes):
+            yield contents
+            return
+        for chunk in iter(lambda: contents.read(cls.CHUNK_SIZE), b''):
+            yield chunk
 
     def write(self, file_data):
         """
@@ -218,11 +530,140 @@ class ArchiveWriter:
             date_time (a datetime.datetime instance) is the file modification time to store
         @return BytesIO object to which archive data has been written
         """
-        for filename, contents, date_time in file_data:
-            info = zipfile.ZipInfo(filename, date_time.timetuple())
-            if not isinstance(contents, (str, bytes)):
-                contents = contents.read()
-            self._zip_archive.writestr(info, contents)
-        self._zip_archive.close()
-        self._memfile.seek(0)
-        return self._memfile
+        memfile = BytesIO()
+        for chunk in self.stream(file_data, self.workers):
+            memfile.write(chunk)
+        memfile.seek(0)
+        return memfile
+
+    @classmethod
+    def stream(cls, file_data, workers=None):
+        """
+        Write files to a combine archive, yielding the archive data as it is produced
+
+        Only a chunk of one file is held in memory at a time (or, with workers, a few more
+        files than there are workers), and the output is byte-for-byte the same as that from
+        `write`. The files are not read until the result is iterated over.
+        Files whose size can't be found without reading them (i.e. unseekable streams) are given
+        ZIP64 headers, in case they are too large for the ordinary ones.
+
+        @param file_data iterable of (filename, contents, date_time) tuples, as for `write`
+        @param workers number of threads with which to deflate files, or None
+        @return iterable of bytes chunks which together make up the archive
+        """
+        sink = _StreamSink()
+        with zipfile.ZipFile(sink, 'w') as zip_archive:
+            for info, contents, deflated in cls._iter_members(file_data, workers):
+                if deflated is None:
+                    yield from cls._stream_member(zip_archive, sink, info, contents)
+                else:
+                    cls._add_deflated_member(zip_archive, sink, info, *deflated)
+                    yield sink.take()
+        yield sink.take()  # Central directory
+
+    @classmethod
+    def _iter_members(cls, file_data, workers):
+        """
+        Prepare the members of an archive, deflating suitable files in worker threads if requested
+
+        Files are read in the calling thread, as their file-like objects need not be
+        thread-safe. With workers, at most twice as many files as there are workers are in
+        flight at once.
+
+        @param file_data iterable of (filename, contents, date_time) tuples, as for `write`
+        @param workers number of threads to deflate with, or None
+        @return iterable of (`zipfile.ZipInfo`, contents, deflated) tuples, in the order given,
+            where deflated is the result of `_deflate` for a file deflated by a worker, or else
+            None, and contents is then the bytes or file-like object to stream
+        """
+        members = (
+            (zipfile.ZipInfo(filename, date_time.timetuple()),
+             contents.encode('utf-8') if isinstance(contents, str) else contents)
+            for filename, contents, date_time in file_data
+        )
+        if not workers or workers <= 1:
+            for info, contents in members:
+                info.compress_type = cls.compress_type(info.filename)
+                yield info, contents, None
+            return
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = deque()
+            for info, contents in members:
+                info.compress_type = cls.compress_type(info.filename)
+                size = cls._content_size(contents)
+                if (info.compress_type == zipfile.ZIP_DEFLATED and
+                        size is not None and size <= cls.PARALLEL_MAX_SIZE):
+                    if not isinstance(contents, bytes):
+                        contents = contents.read()
+                    pending.append((info, None, executor.submit(cls._deflate, contents)))
+                else:
+                    pending.append((info, contents, None))
+                if len(pending) >= 2 * workers:
+                    info, contents, future = pending.popleft()
+                    yield info, contents, future and future.result()
+            while pending:
+                info, contents, future = pending.popleft()
+                yield info, contents, future and future.result()
+
+    @classmethod
+    def _stream_member(cls, zip_archive, sink, info, contents):
+        """
+        Write a file to an archive in chunks, yielding the archive data as it is produced
+
+        :param zip_archive: `zipfile.ZipFile` open for writing to `sink`
+        :param sink: the archive's `_StreamSink`
+        :param info: `zipfile.ZipInfo` for the file
+        :param contents: bytes or binary file-like object
+        """
+        # zipfile needs to know up front whether a member may need ZIP64 extensions
+        size = cls._content_size(contents)
+        if size is not None:
+            info.file_size = size
+        with zip_archive.open(info, 'w', force_zip64=size is None) as member:
+            for chunk in cls._iter_chunks(contents):
+                member.write(chunk)
+                data = sink.take()
+                if data:
+                    yield data
+        yield sink.take()
+
+    @staticmethod
+    def _deflate(data):
+        """
+        Deflate a file's contents as `zipfile` would
+
+        This is self-contained so it can be run in a worker thread.
+
+        :param data: bytes to compress
+        :return: (size, CRC, compressed data) tuple
+        """
+        compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+        return len(data), zlib.crc32(data), compressor.compress(data) + compressor.flush()
+
+    @staticmethod
+    def _add_deflated_member(zip_archive, sink, info, size, crc, compressed):
+        """
+        Append a member deflated by `_deflate` to an archive, exactly as `zipfile` would write it
+
+        :param zip_archive: `zipfile.ZipFile` open for writing to `sink`
+        :param sink: the archive's `_StreamSink`
+        :param info: `zipfile.ZipInfo` for the file
+        """
+        info.file_size = size
+        info.compress_size = len(compressed)
+        info.CRC = crc
+        # As the sink can't seek, the sizes and CRC follow the data in a data descriptor
+        info.flag_bits = _ZIP_USE_DATA_DESCRIPTOR
+        if not info.external_attr:
+            info.external_attr = 0o600 << 16
+        zip64 = size * 1.05 > zipfile.ZIP64_LIMIT
+        info.header_offset = sink.tell()
+        sink.write(info.FileHeader(zip64))
+        sink.write(compressed)
+        sink.write(struct.pack('<LLQQ' if zip64 else '<LLLL', _ZIP_DATA_DESCRIPTOR_SIGNATURE,
+                               crc, info.compress_size, size))
+        zip_archive.filelist.append(info)
+        zip_archive.NameToInfo[info.filename] = info
+        # Where ZipFile writes the central directory on closing
+        zip_archive.start_dir = sink.tell()
@@ -0,0 +1,135 @@
+import re
+
+from django.http import HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils.http import parse_etags, quote_etag
+
+
+# Size of the chunks in which file downloads are streamed
+CHUNK_SIZE = 64 * 1024
+
+# Cache lifetime for content that can never change, e.g. files identified by full commit SHA
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+# Cache lifetime in shared caches for content that can't change but whose visibility can
+SHARED_MAX_AGE = 5 * 60
+
+_RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range(header, size):
+    """
+    Parse an HTTP Range header for a file of a given size
+
+    Only single byte ranges are supported; other forms (e.g. multiple ranges) are ignored,
+    which means the whole file should be sent, as the HTTP spec allows.
+
+    :param header: value of the Range header, or None
+    :param size: size of the file in bytes
+    :return: (start, end) tuple giving the inclusive range of bytes to send,
+        or None to send the whole file
+    :raise: `RangeNotSatisfiable` if the range lies outside the file
+    """
+    match = _RANGE_RE.match((header or '').strip())
+    if not match or match.groups() == ('', ''):
+        return None
+    start, end = match.groups()
+    if not start:
+        # Suffix range: the last `end` bytes
+        length = int(end)
+        if length == 0 or size == 0:
+            raise RangeNotSatisfiable
+        return max(size - length, 0), size - 1
+    start = int(start)
+    if end and int(end) < start:
+        return None  # Syntactically invalid, so ignored
+    if start >= size:
+        raise RangeNotSatisfiable
+    end = min(int(end), size - 1) if end else size - 1
+    return start, end
+
+
+def _iter_file(open_file, start, length, chunk_size):
+    # The file is only opened once the response starts being sent
+    fileobj = open_file()
+    try:
+        if start:
+            if fileobj.seekable():
+                fileobj.seek(start)
+            else:
+                while start > 0:
+                    skipped = len(fileobj.read(min(chunk_size, start)))
+                    if not skipped:
+                        return
+                    start -= skipped
+        while length > 0:
+            data = fileobj.read(min(chunk_size, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+    finally:
+        fileobj.close()
+
+
+def ranged_file_response(request, open_file, size, content_type, *,
+                         etag=None, cache_control=None, chunk_size=CHUNK_SIZE):
+    """
+    Stream a file in response to a request, honouring conditional and Range headers
+
+    If the client already has the version identified by `etag` (via If-None-Match), a 304
+    response is given without opening the file. A single byte range may be requested with a
+    Range header (subject to any If-Range header matching `etag`), giving a 206 response, or
+    416 if the range is unsatisfiable. Otherwise the whole file is streamed.
+
+    :param request: the `HttpRequest`
+    :param open_file: callable returning a binary file-like object for the file, called when the
+        response content is first iterated. The file need not be seekable, and is closed once
+        the response has been sent.
+    :param size: size of the file in bytes
+    :param content_type: content type for the response
+    :param etag: strong entity tag (unquoted) identifying the file contents, if known
+    :param cache_control: value for the Cache-Control header, if any
+    :param chunk_size: size of the chunks in which to stream the file
+    :return: `HttpResponse` or `StreamingHttpResponse`
+    """
+    headers = {'Accept-Ranges': 'bytes'}
+    if etag is not None:
+        headers['ETag'] = quote_etag(etag)
+    if cache_control is not None:
+        headers['Cache-Control'] = cache_control
+
+    if etag is not None and 'HTTP_IF_NONE_MATCH' in request.META:
+        client_etags = parse_etags(request.META['HTTP_IF_NONE_MATCH'])
+        if '*' in client_etags or headers['ETag'] in client_etags:
+            response = HttpResponseNotModified()
+            for header, value in headers.items():
+                response[header] = value
+            return response
+
+    byte_range = None
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if if_range is None or (etag is not None and if_range == headers['ETag']):
+        try:
+            byte_range = parse_range(request.META.get('HTTP_RANGE'), size)
+        except RangeNotSatisfiable:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = 'bytes */%d' % size
+            return response
+
+    if byte_range is None:
+        start, length = 0, size
+        response = StreamingHttpResponse(content_type=content_type)
+    else:
+        start, end = byte_range
+        length = end - start + 1
+        response = StreamingHttpResponse(content_type=content_type, status=206)
+        response['Content-Range'] = 'bytes %d-%d/%d' % (start, end, size)
+    response.streaming_content = _iter_file(open_file, start, length, chunk_size)
+    response['Content-Length'] = length
+    for header, value in headers.items():
+        response[header] = value
+    return response
@@ -0,0 +1,120 @@
+"""Reduce plot series to a number of points that a browser can draw, keeping their visible shape.
+
+Two methods are provided, both of which keep the first and last points of a series:
+
+- `lttb` (Largest-Triangle-Three-Buckets) picks, from each of a number of equal-sized buckets of
+  points, the one forming the largest triangle with the point picked from the previous bucket and
+  the average of the next bucket. It gives the closest visual match for a given number of points.
+- `m4` divides the x range into equal-width pixel columns, and keeps the first, last, lowest and
+  highest points in each. Every extreme of the series is kept, at the cost of up to 4 points per
+  column.
+
+Series are sequences of floats such as `array('d')`, and x values are assumed to be increasing.
+"""
+
+import math
+
+
+def lttb(x, y, threshold):
+    """
+    Downsample a series with the Largest-Triangle-Three-Buckets algorithm
+
+    :param x: sequence of x values
+    :param y: sequence of y values, the same length as `x`
+    :param threshold: maximum number of points to keep
+    :return: list of the indices of the points kept, in order
+    """
+    n = len(x)
+    if threshold >= n:
+        return list(range(n))
+    if threshold < 3:
+        raise ValueError('At least 3 points must be kept')
+
+    every = (n - 2) / (threshold - 2)
+    indices = [0]
+    a = 0
+    for i in range(threshold - 2):
+        # Average of the next bucket (the last point, for the final bucket)
+        avg_start = int((i + 1) * every) + 1
+        avg_end = min(int((i + 2) * every) + 1, n)
+        avg_length = avg_end - avg_start
+        avg_x = sum(x[avg_start:avg_end]) / avg_length
+        avg_y = sum(y[avg_start:avg_end]) / avg_length
+
+        # The point in this bucket making the largest triangle with a and the average
+        ax, ay = x[a], y[a]
+        dx, dy = avg_x - ax, avg_y - ay
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        best_area = -1
+        for j in range(start, end):
+            area = abs(dx * (y[j] - ay) - dy * (x[j] - ax))
+            if area > best_area:
+                best_area = area
+                a = j
+        indices.append(a)
+    indices.append(n - 1)
+    return indices
+
+
+def m4(x, y, threshold):
+    """
+    Downsample a series by keeping the first, last, minimum and maximum points in each pixel column
+
+    :param x: sequence of increasing x values
+    :param y: sequence of y values, the same length as `x`
+    :param threshold: maximum number of points to keep; the x range is split into a quarter this
+        many columns
+    :return: list of the indices of the points kept, in order
+    """
+    n = len(x)
+    width = threshold // 4
+    if threshold >= n:
+        return list(range(n))
+    if width < 1:
+        raise ValueError('At least 4 points must be kept')
+
+    x0 = x[0]
+    scale = width / ((x[-1] - x0) or 1)
+    indices = set()
+    column = first = low = high = None
+    for i in range(n):
+        c = min(int((x[i] - x0) * scale), width - 1)
+        if c != column:
+            if column is not None:
+                indices.update((first, low, high, i - 1))
+            column = c
+            first = low = high = i
+        elif y[i] < y[low]:
+            low = i
+        elif y[i] > y[high]:
+            high = i
+    indices.update((first, low, high, n - 1))
+    return sorted(indices)
+
+
+METHODS = {
+    'lttb': lttb,
+    'm4': m4,
+}
+
+
+def downsample(x, y, threshold, method='lttb'):
+    """
+    Downsample a series, leaving out points where either value is missing (NaN) or infinite
+
+    :param x: sequence of x values
+    :param y: sequence of y values, the same length as `x`
+    :param threshold: maximum number of points to return
+    :param method: name of the method to use, one of `METHODS`
+    :return: (xs, ys) tuple of lists of the points kept
+    :raise: `ValueError` if the method is unknown or `threshold` is too small for it
+    """
+    if method not in METHODS:
+        raise ValueError('Unknown downsampling method %s' % method)
+    if not all(math.isfinite(v) for v in x) or not all(math.isfinite(v) for v in y):
+        points = [(xv, yv) for xv, yv in zip(x, y) if math.isfinite(xv) and math.isfinite(yv)]
+        x = [p[0] for p in points]
+        y = [p[1] for p in points]
+    indices = METHODS[method](x, y, threshold)
+    return [x[i] for i in indices], [y[i] for i in indices]
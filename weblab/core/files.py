@@ -0,0 +1,38 @@
+"""
+Helpers for writing files that are later moved into place
+"""
+import os
+import tempfile
+
+
+def _get_umask():
+    # The umask can only be read by setting it, so this is done once, before any threads start
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+UMASK = _get_umask()
+
+# Permissions given to newly created files
+DEFAULT_FILE_MODE = 0o666 & ~UMASK
+
+
+def mkstemp(**kwargs):
+    """
+    Create a temporary file with the permissions of an ordinarily created file
+
+    `tempfile.mkstemp` makes files readable only by their owner, which would carry over to
+    wherever they are moved, e.g. out of reach of a web server running as another user.
+
+    :param kwargs: as for `tempfile.mkstemp`
+    :return: (file descriptor, path) tuple, as from `tempfile.mkstemp`
+    """
+    fd, path = tempfile.mkstemp(**kwargs)
+    try:
+        os.fchmod(fd, DEFAULT_FILE_MODE)
+    except BaseException:
+        os.close(fd)
+        os.unlink(path)
+        raise
+    return fd, path
@@ -0,0 +1,21 @@
+import logging
+
+from . import permissions
+
+
+logger = logging.getLogger(__name__)
+
+
+class PermissionResolverMiddleware:
+    """
+    Use a new `PermissionResolver` for each request, logging how well it did at debug level
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with permissions.activate() as resolver:
+            response = self.get_response(request)
+        logger.debug('%s %s: permission resolver had %d hits and %d misses',
+                     request.method, request.path, resolver.hits, resolver.misses)
+        return response
@@ -6,7 +6,8 @@ from django.urls import reverse
 from guardian.shortcuts import assign_perm, get_users_with_perms, remove_perm
 
 from . import visibility
-from .combine import ArchiveReader
+from .combine import ArchiveReader, archive_index_cache
+from .permissions import permissions_changed
 from .visibility import HELP_TEXT as VIS_HELP_TEXT
 
 
@@ -61,9 +62,11 @@ class UserCreatedModelMixin(models.Model):
 
     def add_collaborator(self, user):
         assign_perm(self.permission_str, user, self)
+        permissions_changed()
 
     def remove_collaborator(self, user):
         remove_perm(self.permission_str, user, self)
+        permissions_changed()
 
     @property
     def collaborators(self):
@@ -134,20 +137,25 @@ class FileCollectionMixin:
 
     @property
     def files(self):
-        """The list of files (``core.combine.ArchiveFile`` instances) contained in this archive."""
-        if self.archive_path.exists():
-            return ArchiveReader(str(self.archive_path)).files
-        else:
+        """The list of files (``core.combine.ArchiveFile`` instances) contained in this archive.
+
+        The file list is cached for each archive by ``core.combine.archive_index_cache``, so the
+        ``ArchiveFile`` objects must not be modified.
+        """
+        try:
+            return archive_index_cache.get_files(self.archive_path)
+        except FileNotFoundError:
             return []
 
     @property
     def master_file(self):
         """Get the master file, or the first file if there is only one
         """
-        if len(self.files) == 1:
-            return self.files[0]
+        files = self.files
+        if len(files) == 1:
+            return files[0]
         else:
-            return next((f for f in self.files if f.is_master), None)
+            return next((f for f in files if f.is_master), None)
 
     def mkdir(self):
         """Create the folder for the backing archive (and parents if needed)."""
@@ -157,6 +165,26 @@ class FileCollectionMixin:
         """Open the given file in the archive for reading."""
         return ArchiveReader(str(self.archive_path)).open_file(name)
 
+    def get_file_size(self, name):
+        """Get the size in bytes of the given file in the archive.
+
+        Files listed in the manifest are found in the cached file list without opening the archive.
+
+        :raise KeyError: if the file is not in the archive
+        :raise FileNotFoundError: if there is no archive
+        """
+        for file_ in self.files:
+            if file_.name == name:
+                return file_.size
+        return ArchiveReader(str(self.archive_path)).get_size(name)
+
+    def open_file_stream(self, name):
+        """Open the given file in the archive for streaming, without reading it all into memory.
+
+        See ``core.combine.ArchiveReader.open_member``.
+        """
+        return ArchiveReader(str(self.archive_path)).open_member(name)
+
     def get_file_json(self, file_, ns, url_args):
         """Get information about a file in JSON format for use by Javascript code.
 
@@ -0,0 +1,102 @@
+"""
+Per-request memoisation of the objects that have been shared with users
+
+Finding the objects a user has been given a permission on (by django-guardian) takes a query,
+which many views would otherwise repeat, e.g. once for each kind of entity they list. While a
+`PermissionResolver` is active (see `core.middleware`), each such set is fetched at most once.
+"""
+import contextlib
+import contextvars
+
+from guardian.shortcuts import get_objects_for_user
+
+
+_current = contextvars.ContextVar('permission_resolver', default=None)
+
+
+def _fetch_shared_pks(user, perm):
+    return frozenset(get_objects_for_user(user, perm, with_superuser=False).values_list('pk', flat=True))
+
+
+class PermissionResolver:
+    """
+    Sets of objects shared with users, already fetched in the current request
+    """
+    def __init__(self):
+        self._shared = {}  # (user pk, permission) -> primary keys of objects
+        self.hits = 0
+        self.misses = 0
+
+    def shared_pks(self, user, perm):
+        """
+        Get the objects a user has been given a permission on
+
+        :param user: authenticated `User` object
+        :param perm: permission name, e.g. 'entities.edit_entity'
+        :return: frozenset of the objects' primary keys
+        """
+        key = (user.pk, perm)
+        pks = self._shared.get(key)
+        if pks is None:
+            self.misses += 1
+            pks = self._shared[key] = _fetch_shared_pks(user, perm)
+        else:
+            self.hits += 1
+        return pks
+
+    def clear(self):
+        """
+        Forget everything fetched so far, after permissions have changed
+        """
+        self._shared.clear()
+
+
+def current():
+    """
+    :return: the active `PermissionResolver`, or None if there isn't one
+    """
+    return _current.get()
+
+
+@contextlib.contextmanager
+def activate():
+    """
+    Context manager making a new `PermissionResolver` active within its block
+
+    :return: the new `PermissionResolver`
+    """
+    resolver = PermissionResolver()
+    token = _current.set(resolver)
+    try:
+        yield resolver
+    finally:
+        _current.reset(token)
+
+
+def shared_pks(user, perm):
+    """
+    Get the objects a user has been given a permission on, using the active resolver if any
+
+    Permissions held only by virtue of being a superuser don't count.
+
+    :param user: `User` object, possibly anonymous
+    :param perm: permission name, e.g. 'entities.edit_entity'
+    :return: frozenset of the objects' primary keys (empty for anonymous users)
+    """
+    if not user.is_authenticated:
+        return frozenset()
+    resolver = current()
+    if resolver is not None:
+        return resolver.shared_pks(user, perm)
+    return _fetch_shared_pks(user, perm)
+
+
+def permissions_changed():
+    """
+    Make the active resolver, if any, forget what it has fetched
+
+    This should be called whenever object permissions are granted or revoked.
+    """
+    resolver = current()
+    if resolver is not None:
+        resolver.clear()
@@ -3,6 +3,15 @@ from model_bakery.recipe import Recipe, foreign_key, seq
 from repocache.models import ProtocolIoputs
 
 
+class CachedVersionRecipe(Recipe):
+    """Recipe for cached versions, which updates their entities' summaries as ``add_version`` does"""
+    def make(self, **attrs):
+        made = super().make(**attrs)
+        for version in made if isinstance(made, list) else [made]:
+            version.entity.update_summary()
+        return made
+
+
 user = Recipe('accounts.User', institution='UCL', full_name=seq('test user '))
 
 model = Recipe(
@@ -30,15 +39,15 @@ protocol_file = Recipe('EntityFile', entity=foreign_key(protocol))
 analysis_task = Recipe('AnalysisTask', entity=foreign_key(protocol))
 
 cached_model = Recipe('CachedModel', entity=foreign_key(model))
-cached_model_version = Recipe('CachedModelVersion', entity=foreign_key(cached_model))
+cached_model_version = CachedVersionRecipe('CachedModelVersion', entity=foreign_key(cached_model))
 cached_model_tag = Recipe('CachedModelTag', entity=foreign_key(cached_model))
 
 cached_protocol = Recipe('CachedProtocol', entity=foreign_key(protocol))
-cached_protocol_version = Recipe('CachedProtocolVersion', entity=foreign_key(cached_protocol))
+cached_protocol_version = CachedVersionRecipe('CachedProtocolVersion', entity=foreign_key(cached_protocol))
 cached_protocol_tag = Recipe('CachedProtocolTag', entity=foreign_key(cached_protocol))
 
 cached_fittingspec = Recipe('CachedFittingSpec', entity=foreign_key(fittingspec))
-cached_fittingspec_version = Recipe('CachedFittingSpecVersion', entity=foreign_key(cached_fittingspec))
+cached_fittingspec_version = CachedVersionRecipe('CachedFittingSpecVersion', entity=foreign_key(cached_fittingspec))
 cached_fittingspec_tag = Recipe('CachedFittingSpecTag', entity=foreign_key(cached_fittingspec))
 
 experiment = Recipe(
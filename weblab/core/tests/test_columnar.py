@@ -0,0 +1,95 @@
+import io
+import math
+import struct
+from array import array
+from pathlib import Path
+
+import pytest
+
+from core.columnar import (
+    MAGIC,
+    ColumnFile,
+    convert_csv,
+    parse_csv,
+)
+
+
+def test_parse_csv_with_header():
+    names, columns = parse_csv(['t,V,I\n', '0,1.5,-2\n', '\n', '1,2.5e3,\n', '2,3\n'])
+
+    assert names == ['t', 'V', 'I']
+    assert [list(c) for c in columns[:2]] == [[0, 1, 2], [1.5, 2500, 3]]
+    assert columns[2][0] == -2
+    assert math.isnan(columns[2][1]) and math.isnan(columns[2][2])
+
+
+def test_parse_csv_without_header():
+    names, columns = parse_csv(['1,2\n', '3,4,5\n'])
+
+    assert names is None
+    assert [len(c) for c in columns] == [2, 2, 2]
+    assert list(columns[1]) == [2, 4]
+    assert math.isnan(columns[2][0])
+
+
+@pytest.mark.parametrize('lines', [
+    ['name,value\n', 'a,1\n'],
+    ['1,2\n', 'x,3\n'],
+    ['t,V\n'],
+])
+def test_parse_non_numeric_csv(lines):
+    with pytest.raises(ValueError):
+        parse_csv(lines)
+
+
+class TestColumnFile:
+    @pytest.fixture
+    def column_path(self, tmpdir):
+        path = Path(str(tmpdir)) / 'columns' / 'data.cols'
+        convert_csv(io.BytesIO(b'time,a,b\n0,1,2\n1,3,4\n2,5,6\n'), path)
+        return path
+
+    def test_layout(self, column_path):
+        data = column_path.read_bytes()
+        assert data.startswith(MAGIC)
+        (header_length,) = struct.unpack('<I', data[8:12])
+        assert (12 + header_length) % 8 == 0
+        assert data[12 + header_length:] == struct.pack('<9d', 0, 1, 2, 1, 3, 5, 2, 4, 6)
+
+    def test_read(self, column_path):
+        column_file = ColumnFile(column_path)
+
+        assert column_file.names == ['time', 'a', 'b']
+        assert column_file.rows == 3
+        assert column_file.num_columns == 3
+        assert column_file.read_column(2) == array('d', [2, 4, 6])
+
+    def test_subset(self, column_path, tmpdir):
+        column_file = ColumnFile(column_path)
+        subset = b''.join(column_file.iter_bytes([2, 0], with_header=True))
+        assert len(subset) == column_file.subset_size([2, 0])
+
+        subset_path = Path(str(tmpdir)) / 'subset.cols'
+        subset_path.write_bytes(subset)
+        subset_file = ColumnFile(subset_path)
+        assert subset_file.names == ['b', 'time']
+        assert subset_file.read_column(0) == array('d', [2, 4, 6])
+        assert subset_file.read_column(1) == array('d', [0, 1, 2])
+
+    def test_missing_column(self, column_path):
+        with pytest.raises(IndexError):
+            ColumnFile(column_path).iter_bytes([3])
+
+    def test_not_a_column_file(self, tmpdir):
+        path = tmpdir.join('data.csv')
+        path.write('1,2\n')
+        with pytest.raises(ValueError):
+            ColumnFile(str(path))
+
+    def test_convert_non_numeric_csv(self, tmpdir):
+        path = Path(str(tmpdir)) / 'data.cols'
+        with pytest.raises(ValueError):
+            convert_csv(io.BytesIO(b'\xff\xfe1,2\n'), path)
+        with pytest.raises(ValueError):
+            convert_csv(io.BytesIO(b''), path)
+        assert not path.exists()
@@ -1,11 +1,13 @@
 import datetime
 import io
+import os
 import xml.etree.ElementTree as ET
 import zipfile
 
 import pytest
 
 from core.combine import (
+    ArchiveIndexCache,
     ArchiveReader,
     ArchiveWriter,
     ManifestReader,
@@ -134,6 +136,115 @@ class TestArchiveReader:
         reader = ArchiveReader(zipped_archive)
         assert reader.open_file('main.txt').read() == b'main file'
 
+    @pytest.mark.parametrize('compression', [zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED])
+    def test_open_member(self, tmpdir, compression):
+        path = str(tmpdir.join('archive.zip'))
+        contents = bytes(range(256)) * 100
+        with zipfile.ZipFile(path, 'w', compression) as archive:
+            archive.writestr('first.bin', b'first')
+            archive.writestr('second.bin', contents)
+        reader = ArchiveReader(path)
+
+        assert reader.get_size('second.bin') == len(contents)
+        with reader.open_member('second.bin') as member:
+            assert member.seekable()
+            assert member.read(10) == contents[:10]
+            member.seek(1000)
+            assert member.read(5) == contents[1000:1005]
+            assert member.read() == contents[1005:]
+            assert member.read() == b''
+        with reader.open_member('first.bin') as member:
+            assert member.read() == b'first'
+        with pytest.raises(KeyError):
+            reader.open_member('missing.bin')
+
+    def test_verify(self, zipped_archive):
+        files = ArchiveReader(zipped_archive).verify()
+
+        assert [(f.name, f.size, f.is_master) for f in files] == [('main.txt', 9, True), ('test.txt', 10, False)]
+
+    def test_verify_checks_crcs(self, zipped_archive):
+        data = zipped_archive.getvalue().replace(b'other file', b'OTHER FILE')
+
+        with pytest.raises(zipfile.BadZipFile, match='test.txt'):
+            ArchiveReader(io.BytesIO(data)).verify()
+
+    def test_verify_checks_manifest(self, manifest):
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, 'w') as output_zip:
+            output_zip.writestr('main.txt', 'main file')
+        with pytest.raises(zipfile.BadZipFile, match='no manifest.xml'):
+            ArchiveReader(archive).verify()
+
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, 'w') as output_zip:
+            output_zip.writestr('manifest.xml', manifest)
+            output_zip.writestr('main.txt', 'main file')
+        with pytest.raises(zipfile.BadZipFile, match='test.txt'):
+            ArchiveReader(archive).verify()
+
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, 'w') as output_zip:
+            output_zip.writestr('manifest.xml', '<omexManifest')
+        with pytest.raises(zipfile.BadZipFile, match='Invalid manifest'):
+            ArchiveReader(archive).verify()
+
+    def test_open_member_of_file_object(self, zipped_archive):
+        with ArchiveReader(zipped_archive).open_member('test.txt') as member:
+            assert member.read() == b'other file'
+
+
+class TestArchiveIndexCache:
+    @pytest.fixture
+    def archive_path(self, tmpdir, zipped_archive):
+        path = str(tmpdir.join('archive.zip'))
+        with open(path, 'wb') as f:
+            f.write(zipped_archive.getvalue())
+        return path
+
+    def test_caches_files(self, archive_path):
+        cache = ArchiveIndexCache()
+        files = cache.get_files(archive_path)
+        assert [(f.name, f.size) for f in files] == [('main.txt', 9), ('test.txt', 10)]
+
+        assert cache.get_files(archive_path)[0] is files[0]
+        assert (cache.hits, cache.misses) == (1, 1)
+
+    def test_rereads_changed_archive(self, archive_path, manifest):
+        cache = ArchiveIndexCache()
+        cache.get_files(archive_path)
+
+        new_path = archive_path + '.new'
+        with zipfile.ZipFile(new_path, 'w') as new_zip:
+            new_zip.writestr('manifest.xml', manifest.replace('test.txt', 'new.txt'))
+            new_zip.writestr('main.txt', 'main file')
+            new_zip.writestr('new.txt', 'new file')
+        os.replace(new_path, archive_path)
+
+        assert [f.name for f in cache.get_files(archive_path)] == ['main.txt', 'new.txt']
+        assert cache.misses == 2
+
+    def test_evicts_least_recently_used(self, tmpdir, archive_path):
+        cache = ArchiveIndexCache()
+        cache.MAX_ENTRIES = 2
+        paths = [archive_path]
+        for name in 'bc':
+            paths.append(str(tmpdir.join(name + '.zip')))
+            with open(archive_path, 'rb') as src, open(paths[-1], 'wb') as dest:
+                dest.write(src.read())
+
+        cache.get_files(paths[0])
+        cache.get_files(paths[1])
+        cache.get_files(paths[0])
+        cache.get_files(paths[2])
+        assert len(cache) == 2
+        cache.get_files(paths[0])
+        assert cache.hits == 2
+
+    def test_missing_archive(self, tmpdir):
+        with pytest.raises(FileNotFoundError):
+            ArchiveIndexCache().get_files(str(tmpdir.join('missing.zip')))
+
 
 class TestWriteArchive:
     def test_writes_archive(self):
@@ -144,3 +255,116 @@ class TestWriteArchive:
 
         assert zf.namelist() == [file_info[0]]
         assert zf.open(file_info[0]).read() == file_info[1]
+
+    def test_streams_identical_archive(self):
+        mtime = datetime.datetime(2020, 1, 2, 3, 4, 5)
+        file_data = [
+            ('manifest.xml', '<omexManifest />', mtime),
+            ('main.txt', io.BytesIO(b'main file' * 1000), mtime),
+            ('sub/test.txt', b'other file', mtime),
+        ]
+        expected = ArchiveWriter().write(list(file_data)).read()
+        file_data[1][1].seek(0)
+
+        chunks = list(ArchiveWriter.stream(file_data))
+        assert b''.join(chunks) == expected
+        zf = zipfile.ZipFile(io.BytesIO(expected))
+        assert zf.testzip() is None
+        assert zf.namelist() == [name for name, _, _ in file_data]
+
+    def test_stream_reads_files_lazily(self):
+        def file_data():
+            yield ('test.txt', b'file contents', datetime.datetime.utcnow())
+            raise AssertionError('Read too far')
+
+        assert next(iter(ArchiveWriter.stream(file_data())))
+
+    def test_compression_depends_on_file_type(self):
+        mtime = datetime.datetime(2020, 1, 2, 3, 4, 5)
+        file_data = [
+            ('data.csv', b'1,2,3\n' * 100, mtime),
+            ('plot.png', b'\x89PNG' * 100, mtime),
+            ('nested.omex', b'PK' * 100, mtime),
+        ]
+        zf = zipfile.ZipFile(ArchiveWriter().write(file_data))
+
+        assert [info.compress_type for info in zf.infolist()] == [
+            zipfile.ZIP_DEFLATED, zipfile.ZIP_STORED, zipfile.ZIP_STORED]
+        assert zf.getinfo('data.csv').compress_size < 600
+        assert zf.read('plot.png') == b'\x89PNG' * 100
+
+    def test_parallel_compression(self, monkeypatch):
+        monkeypatch.setattr(ArchiveWriter, 'PARALLEL_MAX_SIZE', 20000)
+        mtime = datetime.datetime(2020, 1, 2, 3, 4, 5)
+        file_data = [
+            ('file%02d.%s' % (i, 'png' if i % 3 else 'txt'), os.urandom(1000).hex() * i, mtime)
+            for i in range(20)
+        ]
+        # Include streams, and a file too large to deflate in a worker
+        file_data[4] = ('stream.txt', io.BytesIO(b'stream' * 1000), mtime)
+        file_data[5] = ('large.txt', b'large' * 10000, mtime)
+
+        def archive(workers):
+            file_data[4][1].seek(0)
+            return b''.join(ArchiveWriter.stream(file_data, workers=workers))
+
+        serial = archive(None)
+        parallel = archive(3)
+        serial_zip = zipfile.ZipFile(io.BytesIO(serial))
+        parallel_zip = zipfile.ZipFile(io.BytesIO(parallel))
+        assert parallel_zip.testzip() is None
+        assert parallel_zip.namelist() == serial_zip.namelist() == [name for name, _, _ in file_data]
+        assert [parallel_zip.read(name) for name in parallel_zip.namelist()] == [
+            serial_zip.read(name) for name in serial_zip.namelist()
+        ]
+        assert [info.compress_type for info in parallel_zip.infolist()] == [
+            info.compress_type for info in serial_zip.infolist()
+        ]
+        assert parallel == serial
+
+        file_data[4][1].seek(0)
+        assert ArchiveWriter(workers=3).write(file_data).read() == serial
+
+    def test_streams_files_in_chunks(self, monkeypatch):
+        monkeypatch.setattr(ArchiveWriter, 'CHUNK_SIZE', 1000)
+        contents = os.urandom(10000)
+        stream = io.BytesIO(contents)
+        reads = []
+        read = stream.read
+        monkeypatch.setattr(stream, 'read', lambda size: reads.append(size) or read(size))
+
+        chunks = iter(ArchiveWriter.stream([('plot.png', stream, datetime.datetime(2020, 1, 2))]))
+        first = next(chunks)  # The local header and first chunk of the stored file
+        assert first.endswith(contents[:1000])
+        assert reads == [1000]
+        assert next(chunks) == contents[1000:2000]
+        assert reads == [1000, 1000]
+
+        archive = first + contents[1000:2000] + b''.join(chunks)
+        assert set(reads) == {1000}
+        assert zipfile.ZipFile(io.BytesIO(archive)).read('plot.png') == contents
+
+    def test_streams_files_of_unknown_size_with_zip64(self, monkeypatch):
+        # Pretend the ZIP64 limit is small rather than write gigabytes
+        monkeypatch.setattr(zipfile, 'ZIP64_LIMIT', 1000)
+        contents = os.urandom(2000)
+
+        class Unseekable(io.RawIOBase):
+            def __init__(self):
+                self._stream = io.BytesIO(contents)
+
+            def readable(self):
+                return True
+
+            def readinto(self, buffer):
+                return self._stream.readinto(buffer)
+
+        mtime = datetime.datetime(2020, 1, 2)
+        archive = b''.join(ArchiveWriter.stream([
+            ('plot.png', Unseekable(), mtime),
+            ('data.bin', io.BytesIO(contents), mtime),
+            ('text.txt', contents, mtime),
+        ]))
+        zf = zipfile.ZipFile(io.BytesIO(archive))
+        assert zf.testzip() is None
+        assert [zf.read(name) for name in zf.namelist()] == [contents] * 3
@@ -0,0 +1,114 @@
+import io
+
+import pytest
+from django.test import RequestFactory
+
+from core.downloads import RangeNotSatisfiable, parse_range, ranged_file_response
+
+
+class NonSeekableFile(io.RawIOBase):
+    def __init__(self, data):
+        self._data = io.BytesIO(data)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        return self._data.readinto(buffer)
+
+
+@pytest.mark.parametrize('header,expected', [
+    (None, None),
+    ('', None),
+    ('bytes=0-9', (0, 9)),
+    ('bytes=5-', (5, 9)),
+    ('bytes=5-100', (5, 9)),
+    ('bytes=-3', (7, 9)),
+    ('bytes=-100', (0, 9)),
+    ('bytes=5-2', None),
+    ('bytes=0-1,5-6', None),
+    ('items=0-1', None),
+])
+def test_parse_range(header, expected):
+    assert parse_range(header, 10) == expected
+
+
+@pytest.mark.parametrize('header,size', [
+    ('bytes=10-', 10),
+    ('bytes=-0', 10),
+    ('bytes=0-', 0),
+    ('bytes=-1', 0),
+])
+def test_parse_unsatisfiable_range(header, size):
+    with pytest.raises(RangeNotSatisfiable):
+        parse_range(header, size)
+
+
+class TestRangedFileResponse:
+    data = b'0123456789' * 10
+
+    def get(self, open_file=None, **headers):
+        request = RequestFactory().get('/', **headers)
+        if open_file is None:
+            def open_file():
+                return io.BytesIO(self.data)
+        return ranged_file_response(
+            request, open_file, len(self.data), 'text/plain', etag='abc', cache_control='no-cache', chunk_size=7)
+
+    def test_whole_file(self):
+        response = self.get()
+
+        assert response.status_code == 200
+        assert response.getvalue() == self.data
+        assert response['Content-Length'] == '100'
+        assert response['Accept-Ranges'] == 'bytes'
+        assert response['ETag'] == '"abc"'
+        assert response['Cache-Control'] == 'no-cache'
+
+    def test_range(self):
+        response = self.get(HTTP_RANGE='bytes=15-34')
+
+        assert response.status_code == 206
+        assert response.getvalue() == self.data[15:35]
+        assert response['Content-Range'] == 'bytes 15-34/100'
+        assert response['Content-Length'] == '20'
+
+    def test_range_of_non_seekable_file(self):
+        response = self.get(lambda: NonSeekableFile(self.data), HTTP_RANGE='bytes=-12')
+
+        assert response.status_code == 206
+        assert response.getvalue() == self.data[-12:]
+
+    def test_if_range(self):
+        assert self.get(HTTP_RANGE='bytes=1-2', HTTP_IF_RANGE='"abc"').status_code == 206
+        assert self.get(HTTP_RANGE='bytes=1-2', HTTP_IF_RANGE='"old"').status_code == 200
+
+    def test_unsatisfiable_range(self):
+        response = self.get(HTTP_RANGE='bytes=100-')
+
+        assert response.status_code == 416
+        assert response['Content-Range'] == 'bytes */100'
+
+    def test_not_modified_does_not_open_file(self):
+        def open_file():
+            raise AssertionError('File opened')
+
+        response = self.get(open_file, HTTP_IF_NONE_MATCH='"xyz", "abc"')
+
+        assert response.status_code == 304
+        assert response['ETag'] == '"abc"'
+
+    def test_modified(self):
+        assert self.get(HTTP_IF_NONE_MATCH='"xyz"').status_code == 200
+
+    def test_closes_file(self):
+        files = []
+
+        def open_file():
+            files.append(io.BytesIO(self.data))
+            return files[-1]
+
+        response = self.get(open_file)
+        assert files == []
+        response.getvalue()
+        assert files[0].closed
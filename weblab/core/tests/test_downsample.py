@@ -0,0 +1,77 @@
+import math
+from array import array
+
+import pytest
+
+from core.downsample import downsample, lttb, m4
+
+
+@pytest.fixture
+def series():
+    x = array('d', range(1000))
+    y = array('d', (math.sin(i / 50) for i in range(1000)))
+    y[333] = 5
+    y[666] = -5
+    return x, y
+
+
+class TestLttb:
+    def test_keeps_short_series(self):
+        assert lttb([0, 1, 2], [3, 4, 5], 10) == [0, 1, 2]
+
+    def test_downsamples(self, series):
+        indices = lttb(*series, 100)
+
+        assert len(indices) == 100
+        assert indices[0] == 0 and indices[-1] == 999
+        assert indices == sorted(set(indices))
+        assert 333 in indices and 666 in indices
+
+    def test_picks_largest_triangle(self):
+        # One bucket between the end points; the spike makes the largest triangle
+        assert lttb([0, 1, 2, 3, 4], [0, 0, 1, 0, 0], 3) == [0, 2, 4]
+
+    def test_too_few_points(self, series):
+        with pytest.raises(ValueError):
+            lttb(*series, 2)
+
+
+class TestM4:
+    def test_keeps_short_series(self):
+        assert m4([0, 1, 2], [3, 4, 5], 10) == [0, 1, 2]
+
+    def test_downsamples(self, series):
+        indices = m4(*series, 100)
+
+        assert len(indices) <= 100
+        assert indices[0] == 0 and indices[-1] == 999
+        assert indices == sorted(set(indices))
+        assert 333 in indices and 666 in indices
+
+    def test_keeps_extremes_of_each_column(self):
+        x = list(range(9))
+        y = [0, 3, -3, 1, 2, 9, -9, 5, 0]
+
+        # Two columns, of x values 0-3 and 4-8
+        assert m4(x, y, 8) == [0, 1, 2, 3, 4, 5, 6, 8]
+        # One column
+        assert m4(x, y, 4) == [0, 5, 6, 8]
+
+
+def test_downsample_skips_missing_values():
+    xs, ys = downsample([0, 1, 2, 3], [1, math.nan, 3, 4], 10)
+
+    assert xs == [0, 2, 3]
+    assert ys == [1, 3, 4]
+
+
+def test_downsample_skips_infinite_values():
+    xs, ys = downsample([0, 1, 2, math.inf], [1, -math.inf, 3, 4], 10)
+
+    assert xs == [0, 2]
+    assert ys == [1, 3]
+
+
+def test_downsample_unknown_method():
+    with pytest.raises(ValueError):
+        downsample([0, 1], [0, 1], 10, 'mean')
@@ -0,0 +1,16 @@
+import os
+import stat
+
+from core.files import DEFAULT_FILE_MODE, UMASK, mkstemp
+
+
+def test_mkstemp_uses_default_permissions(tmpdir):
+    fd, path = mkstemp(dir=str(tmpdir), suffix='.tmp')
+    os.close(fd)
+    assert path.endswith('.tmp')
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o666 & ~UMASK == DEFAULT_FILE_MODE
+
+    # The same as a file created normally
+    other = str(tmpdir.join('other'))
+    open(other, 'w').close()
+    assert stat.S_IMODE(os.stat(other).st_mode) == DEFAULT_FILE_MODE
@@ -0,0 +1,55 @@
+import logging
+
+import pytest
+
+from core import permissions, recipes
+from entities.models import ModelEntity
+
+
+@pytest.mark.django_db
+class TestPermissionResolver:
+    def test_anonymous_user_has_no_shared_objects(self, anon_user, django_assert_num_queries):
+        with django_assert_num_queries(0):
+            assert permissions.shared_pks(anon_user, 'entities.edit_entity') == frozenset()
+
+    def test_inactive_by_default(self, user, other_user):
+        model = recipes.model.make(author=other_user)
+        model.add_collaborator(user)
+
+        assert permissions.current() is None
+        assert permissions.shared_pks(user, 'entities.edit_entity') == {model.pk}
+
+    def test_fetches_shared_objects_once(self, user, other_user, django_assert_num_queries):
+        model = recipes.model.make(author=other_user)
+        model.add_collaborator(user)
+        recipes.model.make(author=other_user)
+
+        with permissions.activate() as resolver:
+            assert permissions.shared_pks(user, 'entities.edit_entity') == {model.pk}
+            with django_assert_num_queries(0):
+                assert permissions.shared_pks(user, 'entities.edit_entity') == {model.pk}
+            assert permissions.shared_pks(other_user, 'entities.edit_entity') == frozenset()
+            assert list(ModelEntity.objects.shared_with_user(user)) == [model]
+
+        assert (resolver.hits, resolver.misses) == (2, 2)
+        assert permissions.current() is None
+
+    def test_forgets_changed_permissions(self, user, other_user):
+        model = recipes.model.make(author=other_user)
+        with permissions.activate():
+            assert permissions.shared_pks(user, 'entities.edit_entity') == frozenset()
+
+            model.add_collaborator(user)
+            assert permissions.shared_pks(user, 'entities.edit_entity') == {model.pk}
+
+            model.remove_collaborator(user)
+            assert permissions.shared_pks(user, 'entities.edit_entity') == frozenset()
+
+    def test_middleware_logs_hits(self, client, logged_in_user, caplog):
+        with caplog.at_level(logging.DEBUG, logger='core.middleware'):
+            client.get('/experiments/matrix')
+
+        assert permissions.current() is None
+        message = caplog.records[-1].getMessage()
+        assert message.startswith('GET /experiments/matrix: permission resolver had ')
+        assert not message.endswith('had 0 hits and 0 misses')
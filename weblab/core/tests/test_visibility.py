@@ -1,3 +1,5 @@
+from unittest.mock import patch
+
 import pytest
 
 from core.visibility import (
@@ -41,3 +43,42 @@ def test_visibility_check(user, other_user, anon_user):
     assert visibility_check('moderated', [], anon_user)
     assert visibility_check('public', [], anon_user)
     assert not visibility_check('private', [], anon_user)
+
+
+@pytest.mark.django_db
+def test_visibility_check_only_gets_users_if_needed(user, other_user, anon_user):
+    def no_users():
+        raise AssertionError('users should not be needed')
+
+    assert visibility_check('public', no_users, other_user)
+    assert visibility_check('moderated', no_users, anon_user)
+    assert not visibility_check('private', no_users, anon_user)
+
+    assert visibility_check('private', lambda: {user}, user)
+    assert not visibility_check('private', lambda: {user}, other_user)
+
+
+@pytest.mark.django_db
+class TestVisibilityMixin:
+    def test_public_object_needs_no_viewers(self, client, other_user, public_model):
+        client.force_login(other_user)
+        with patch('core.models.get_users_with_perms') as get_users_with_perms:
+            response = client.get('/entities/models/%d' % public_model.pk)
+
+        assert response.status_code == 302
+        assert not get_users_with_perms.called
+
+    def test_private_object_needs_viewers(self, client, other_user, private_model):
+        private_model.add_collaborator(other_user)
+        client.force_login(other_user)
+        response = client.get('/entities/models/%d' % private_model.pk)
+
+        assert response.status_code == 302
+
+    def test_fetches_object_once(self, client, public_model):
+        with patch('django.views.generic.detail.SingleObjectMixin.get_object',
+                   return_value=public_model) as get_object:
+            response = client.get('/entities/models/%d/versions/' % public_model.pk)
+
+        assert response.status_code == 200
+        get_object.assert_called_once_with()
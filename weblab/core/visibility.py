@@ -59,7 +59,8 @@ def visibility_check(visibility, allowed_users, user):
     Visibility check
 
     :param visibility: `Visibility` value
-    :param allowed_users: Users that have special privileges in this scenario
+    :param allowed_users: Users that have special privileges in this scenario, or a function
+        returning them, which is only called if they are needed
     :param: user: user to test against
 
     :returns: True if the user has permission to view, False otherwise
@@ -71,10 +72,11 @@ def visibility_check(visibility, allowed_users, user):
     elif user.is_authenticated:
         # Logged in user can view all except other people's private stuff
         # unless given special permissions to do so
-        return (
-            user in allowed_users or
-            visibility != Visibility.PRIVATE
-        )
+        if visibility != Visibility.PRIVATE:
+            return True
+        if callable(allowed_users):
+            allowed_users = allowed_users()
+        return user in allowed_users
 
     return False
 
@@ -98,6 +100,16 @@ class VisibilityMixin(AccessMixin):
         """
         return False  # Token access not used by default
 
+    def get_object(self, queryset=None):
+        """
+        Get the object this view is about, fetching it only once
+        """
+        if queryset is not None:
+            return super().get_object(queryset)
+        if not hasattr(self, '_visibility_object'):
+            self._visibility_object = super().get_object()
+        return self._visibility_object
+
     def get_visibility(self):
         """
         Get the visibility applicable to this view
@@ -110,6 +122,8 @@ class VisibilityMixin(AccessMixin):
         """
         Get users who are permitted to view the object regardless of visibility
 
+        This is only called if needed, i.e. when the object is private.
+
         :return: set of `User` objects
         """
         return self.get_object().viewers
@@ -126,7 +140,7 @@ class VisibilityMixin(AccessMixin):
 
         if obj:
             if visibility_check(self.get_visibility(),
-                                self.get_viewers(),
+                                self.get_viewers,
                                 self.request.user):
                 allow_access = True
             else:
@@ -3,9 +3,9 @@ import csv
 from django.core.validators import MinLengthValidator
 from django.db import models
 from django.utils.text import get_valid_filename
-from guardian.shortcuts import get_objects_for_user
 
 from core.models import FileCollectionMixin, UserCreatedModelMixin, VisibilityModelMixin
+from core.permissions import shared_pks
 from entities.models import ProtocolEntity
 from repocache.models import CachedProtocolVersion, ProtocolIoputs
 
@@ -22,9 +22,7 @@ class DatasetQuerySet(models.QuerySet):
     def shared_with_user(self, user):
         """Query over all datasets shared explicitly with the given user."""
         if user.is_authenticated:
-            shared_pks = get_objects_for_user(
-                user, 'datasets.edit_entity', with_superuser=False).values_list('pk', flat=True)
-            return self.filter(pk__in=shared_pks)
+            return self.filter(pk__in=shared_pks(user, 'datasets.edit_entity'))
         else:
             return self.none()
 
@@ -403,12 +403,29 @@ class TestDatasetFileDownloadView:
         )
 
         assert response.status_code == 200
-        assert response.content == file_contents
+        assert response.getvalue() == file_contents
         assert response['Content-Disposition'] == (
             'attachment; filename=mydataset.csv'
         )
         assert response['Content-Type'] == 'text/csv'
 
+    def test_download_range(self, client, my_dataset_with_file):
+        response = client.get(
+            '/datasets/%d/download/mydataset.csv' % my_dataset_with_file.pk,
+            HTTP_RANGE='bytes=3-6',
+        )
+
+        assert response.status_code == 206
+        assert response.getvalue() == b'test'
+        assert response['Content-Range'] == 'bytes 3-6/15'
+
+    def test_download_missing_file(self, client, my_dataset_with_file):
+        response = client.get(
+            '/datasets/%d/download/missing.csv' % my_dataset_with_file.pk
+        )
+
+        assert response.status_code == 404
+
     @pytest.mark.parametrize("filename", [
         ('oxmeta:membrane-voltage with spaces.csv'),
         # ('oxmeta%3Amembrane_voltage.csv'),  # You can't upload a file with this name
@@ -439,7 +456,7 @@ class TestDatasetFileDownloadView:
         )
 
         assert response.status_code == 200
-        assert response.content == b'my test dataset'
+        assert response.getvalue() == b'my test dataset'
         assert response['Content-Disposition'] == (
             'attachment; filename=' + filename
         )
@@ -26,6 +26,7 @@ from django.views.generic.list import ListView
 
 from accounts.forms import OwnershipTransferForm
 from core.combine import ManifestWriter
+from core.downloads import ranged_file_response
 from core.visibility import VisibilityMixin
 from entities.forms import EntityChangeVisibilityForm
 from entities.views import EditCollaboratorsAbstractView
@@ -209,13 +210,13 @@ class DatasetFileDownloadView(VisibilityMixin, SingleObjectMixin, View):
             content_type = 'application/octet-stream'
 
         try:
-            with dataset.open_file(filename) as file_:
-                response = HttpResponse(content_type=content_type)
-                response['Content-Disposition'] = 'attachment; filename=%s' % filename
-                response.write(file_.read())
-        except KeyError:
+            size = dataset.get_file_size(filename)
+        except (KeyError, FileNotFoundError):
             raise Http404
 
+        response = ranged_file_response(
+            request, lambda: dataset.open_file_stream(filename), size, content_type)
+        response['Content-Disposition'] = 'attachment; filename=%s' % filename
         return response
 
 
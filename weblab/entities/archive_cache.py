@@ -0,0 +1,219 @@
+import hashlib
+import os
+import threading
+import time
+from pathlib import Path
+
+from django.conf import settings
+
+from core.files import mkstemp
+
+
+class ArchiveCache:
+    """
+    On-disk cache of the COMBINE archives built for entity versions
+
+    Archives are content-addressed: each is stored under the commit SHA plus a digest of the
+    commit's ephemeral files (names and blob SHAs), so adding an ephemeral file to a commit
+    gives it a new key. Archives of the same commit in different repositories are identical,
+    and share one cache entry.
+
+    The cache may be shared by several processes. Entries are written to a temporary file and
+    renamed into place, and their modification time records when they were last used. Once the
+    total size exceeds ``settings.ARCHIVE_CACHE_MAX_SIZE`` bytes the least recently used
+    entries are removed. A size of 0 (or None) disables the cache.
+
+    To avoid listing the whole cache each time an archive is added, each process keeps a running
+    total of its size, which is recounted from disk when it goes over the limit, or when it is
+    more than `RECOUNT_INTERVAL` seconds old (to take account of other processes' additions).
+    """
+
+    SUFFIX = '.zip'
+
+    RECOUNT_INTERVAL = 10 * 60
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._size = None  # Estimated total size of the cache, or None if not yet counted
+        self._counted_root = None
+        self._counted_at = 0
+
+    @property
+    def root(self):
+        return Path(settings.ARCHIVE_CACHE_BASE)
+
+    @property
+    def max_size(self):
+        return settings.ARCHIVE_CACHE_MAX_SIZE or 0
+
+    @property
+    def enabled(self):
+        return self.max_size > 0
+
+    @staticmethod
+    def ephemeral_digest(commit):
+        """
+        Digest of the ephemeral files attached to a commit
+
+        :param commit: `entities.repository.Commit` object
+        :return: hex string identifying the names and contents of the commit's ephemeral files
+        """
+        hasher = hashlib.sha256()
+        for blob in sorted(commit.ephemeral_files, key=lambda blob: blob.name):
+            hasher.update(('%s %s\n' % (blob.hexsha, blob.name)).encode())
+        return hasher.hexdigest()
+
+    def path_for(self, commit):
+        """
+        Path at which the archive of a commit is cached
+
+        :param commit: `entities.repository.Commit` object
+        :return: `Path` of the (possibly non-existent) archive file
+        """
+        name = '%s-%s%s' % (commit.sha, self.ephemeral_digest(commit)[:16], self.SUFFIX)
+        return self.root / commit.sha[:2] / name
+
+    def open(self, commit, build=True):
+        """
+        Open the archive of a commit, building and caching it if necessary
+
+        :param commit: `entities.repository.Commit` object
+        :param build: whether to build the archive if it isn't cached
+        :return: binary file object positioned at the start of the archive, or None if the cache
+            is disabled, or the archive isn't cached and `build` is False. The file is opened by
+            descriptor and has no name, as the cache entry may be replaced or evicted while it
+            is being read.
+        """
+        if not self.enabled:
+            return None
+        path = self.path_for(commit)
+        try:
+            archive = self._open(path)
+        except FileNotFoundError:
+            return self._build(commit, path) if build else None
+        try:
+            os.utime(str(path))
+        except FileNotFoundError:
+            pass  # Evicted by another process since we opened it; our handle is still valid
+        return archive
+
+    def stream(self, commit):
+        """
+        Build the archive of a commit, yielding its data as it is written to the cache
+
+        The archive is only added to the cache once it has all been read. If the result is
+        not read to the end, nothing is cached.
+
+        :param commit: `entities.repository.Commit` object
+        :return: iterable of bytes chunks making up the archive
+        """
+        if not self.enabled:
+            yield from commit.stream_archive()
+            return
+        archive = yield from self._write(commit, self.path_for(commit))
+        archive.close()
+
+    @staticmethod
+    def _open(path):
+        return os.fdopen(os.open(str(path), os.O_RDONLY), 'rb')
+
+    def _build(self, commit, path):
+        writer = self._write(commit, path)
+        while True:
+            try:
+                next(writer)
+            except StopIteration as done:
+                return done.value
+
+    def _write(self, commit, path):
+        """
+        Write the archive of a commit to the cache, yielding its data as it is written
+
+        :return: generator whose return value is the new archive, opened for reading
+        """
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, temp_path = mkstemp(dir=str(path.parent), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as temp_file:
+                for chunk in commit.stream_archive():
+                    temp_file.write(chunk)
+                    yield chunk
+                size = temp_file.tell()
+            archive = self._open(temp_path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        os.replace(temp_path, str(path))
+        self._added(size)
+        return archive
+
+    def _added(self, size):
+        """
+        Note that an archive has been added to the cache, evicting others if it may now be too big
+
+        :param size: size of the new archive in bytes
+        """
+        with self._lock:
+            fresh = (
+                self._size is not None and
+                self._counted_root == self.root and
+                time.monotonic() - self._counted_at < self.RECOUNT_INTERVAL
+            )
+            if fresh:
+                self._size += size
+                if self._size <= self.max_size:
+                    return
+        self.evict()
+
+    def discard(self, sha):
+        """
+        Remove all cached archives of a commit
+
+        :param sha: hex SHA of the commit
+        """
+        for path in (self.root / sha[:2]).glob(sha + '-*' + self.SUFFIX):
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+
+    def entries(self):
+        """
+        Archives currently in the cache
+
+        :return: list of (last used time, size, path) tuples, least recently used first
+        """
+        entries = []
+        for path in self.root.glob('*/*' + self.SUFFIX):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return sorted(entries)
+
+    def evict(self):
+        """
+        Remove least recently used archives until the cache is within its maximum size
+
+        This also recounts the running total of the cache size.
+        """
+        root = self.root
+        counted_at = time.monotonic()
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_size:
+                break
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            total -= size
+        with self._lock:
+            self._size = total
+            self._counted_root = root
+            self._counted_at = counted_at
+
+
+archive_cache = ArchiveCache()
@@ -0,0 +1,314 @@
+import os
+import subprocess
+import threading
+from io import BytesIO, RawIOBase
+
+from git.db import GitCmdObjectDB
+from gitdb.base import OInfo, OStream
+from gitdb.exc import BadObject
+from gitdb.util import bin_to_hex, hex_to_bin
+
+
+class CatFile:
+    """
+    Long-lived ``git cat-file --batch`` and ``--batch-check`` processes for one repository
+
+    Object headers and contents are read by writing SHAs to the relevant process and parsing
+    its output. Requests for several objects are pipelined: all SHAs in a batch are written
+    (from a helper thread, so neither pipe can fill up and deadlock) while the responses are
+    read back. Each process is guarded by its own lock so the reader can be shared by threads.
+
+    Objects larger than `STREAM_SIZE` are not read into memory. Instead the ``--batch`` process
+    is handed over to a `BatchStream`, which reads the object from its output; a new process is
+    started for the next request, and the old one is taken back once the stream is finished.
+
+    The processes are started on first use, and restarted if they fail.
+    """
+
+    BATCH = '--batch'
+    BATCH_CHECK = '--batch-check'
+
+    # Maximum number of objects requested in one pipelined batch
+    BATCH_SIZE = 64
+
+    # Size of the buffers on the pipes to and from git
+    BUFFER_SIZE = 64 * 1024
+
+    # Size in bytes above which objects are streamed instead of read at once
+    STREAM_SIZE = 1024 * 1024
+
+    def __init__(self, git_dir):
+        """
+        :param git_dir: Path of the repository's git directory
+        """
+        self._git_dir = str(git_dir)
+        self._procs = {}
+        self._locks = {self.BATCH: threading.Lock(), self.BATCH_CHECK: threading.Lock()}
+        # Incremented by `close`, so that streams finished afterwards don't hand back their process
+        self._generation = 0
+
+    def _get_process(self, mode):
+        proc = self._procs.get(mode)
+        if proc is None or proc.poll() is not None:
+            proc = self._procs[mode] = subprocess.Popen(
+                ['git', '--git-dir', self._git_dir, 'cat-file', mode],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                bufsize=self.BUFFER_SIZE,
+            )
+        return proc
+
+    @staticmethod
+    def _kill(proc):
+        proc.kill()
+        proc.wait()
+        proc.stdin.close()
+        proc.stdout.close()
+
+    def _kill_process(self, mode):
+        proc = self._procs.pop(mode, None)
+        if proc is not None:
+            self._kill(proc)
+
+    @staticmethod
+    def _read_header(stdout, hexsha):
+        header = stdout.readline()
+        parts = header.split()
+        if len(parts) == 2:
+            # e.g. '<sha> missing' or '<sha> ambiguous'
+            raise BadObject(hexsha)
+        elif len(parts) != 3:
+            raise ValueError('Unexpected git cat-file output: %r' % header)
+        # GitPython expects the type name as bytes
+        return parts[0].decode(), parts[1], int(parts[2])
+
+    def _request(self, mode, hexshas):
+        """
+        Request several objects from one of our processes
+
+        When reading contents, the results stop at the first object larger than `STREAM_SIZE`,
+        which is given a `BatchStream` reading from the process's output.
+
+        :param mode: `BATCH` to get object contents, or `BATCH_CHECK` for headers only
+        :param hexshas: list of hex SHAs (or other object names) to look up
+        :return: list of (hexsha, type, size, stream) tuples, where type is the object type name
+            as bytes, and stream is a binary file-like object, or None for headers only
+        :raise: `gitdb.exc.BadObject` if any object is not found
+        """
+        request = ''.join(sha + '\n' for sha in hexshas).encode()
+        results = []
+        with self._locks[mode]:
+            proc = self._get_process(mode)
+            if len(hexshas) > 1:
+                writer = threading.Thread(target=self._write, args=(proc.stdin, request))
+                writer.start()
+            else:
+                writer = None
+                self._write(proc.stdin, request)
+            try:
+                for hexsha in hexshas:
+                    sha, type_, size = self._read_header(proc.stdout, hexsha)
+                    stream = None
+                    if mode == self.BATCH:
+                        if size > self.STREAM_SIZE:
+                            if writer is not None:
+                                writer.join()
+                                writer = None
+                            # The process is the stream's now; it can be reused only if no
+                            # responses are pending after this one
+                            del self._procs[mode]
+                            reusable = len(results) == len(hexshas) - 1
+                            stream = BatchStream(self if reusable else None, proc, size)
+                            results.append((sha, type_, size, stream))
+                            break
+                        stream = BytesIO(proc.stdout.read(size))
+                        proc.stdout.read(1)  # Trailing newline
+                    results.append((sha, type_, size, stream))
+            except BadObject:
+                # Responses for the rest of this batch are still pending, so start afresh
+                if len(results) < len(hexshas) - 1:
+                    self._kill_process(mode)
+                raise
+            except Exception:
+                self._kill_process(mode)
+                raise
+            finally:
+                if writer is not None:
+                    writer.join()
+        return results
+
+    def _reuse(self, proc, generation):
+        """
+        Take back a ``--batch`` process once a `BatchStream` has finished reading from it
+
+        :param proc: the process
+        :param generation: value of `_generation` when the stream was made
+        """
+        with self._locks[self.BATCH]:
+            if generation == self._generation and self._procs.get(self.BATCH) is None:
+                self._procs[self.BATCH] = proc
+                return
+        proc.stdin.close()
+        proc.wait()
+        proc.stdout.close()
+
+    @staticmethod
+    def _write(stdin, request):
+        try:
+            stdin.write(request)
+            stdin.flush()
+        except (OSError, ValueError):
+            pass  # The process has gone away, which the reader will notice
+
+    def info(self, hexsha):
+        """
+        Get the header of a single object
+
+        :param hexsha: hex SHA of the object
+        :return: (hexsha, type, size) tuple
+        :raise: `gitdb.exc.BadObject` if not found
+        """
+        return self._request(self.BATCH_CHECK, [hexsha])[0][:3]
+
+    def read(self, hexsha):
+        """
+        Read a single object into memory
+
+        :param hexsha: hex SHA of the object
+        :return: (hexsha, type, size, data) tuple, where data is a bytes object
+        :raise: `gitdb.exc.BadObject` if not found
+        """
+        hexsha, type_, size, stream = self.open(hexsha)
+        with stream:
+            return hexsha, type_, size, stream.read()
+
+    def open(self, hexsha):
+        """
+        Open a single object for reading
+
+        Objects no larger than `STREAM_SIZE` are read at once; larger ones are streamed.
+
+        :param hexsha: hex SHA of the object
+        :return: (hexsha, type, size, stream) tuple, where stream is a binary file-like object,
+            which should be closed after use
+        :raise: `gitdb.exc.BadObject` if not found
+        """
+        return self._request(self.BATCH, [hexsha])[0]
+
+    def read_many(self, hexshas):
+        """
+        Read several objects, pipelining the requests
+
+        Objects are requested in batches of `BATCH_SIZE`, and the lock is released between
+        batches, so abandoning this iterator part way through is safe. Objects no larger than
+        `STREAM_SIZE` are read into memory; a larger one ends its batch, and is streamed.
+
+        :param hexshas: iterable of object hex SHAs
+        :return: iterable of (hexsha, type, size, stream) tuples, in the order requested, where
+            stream is a binary file-like object, which should be closed after use
+        :raise: `gitdb.exc.BadObject` if any object is not found
+        """
+        hexshas = list(hexshas)
+        start = 0
+        while start < len(hexshas):
+            results = self._request(self.BATCH, hexshas[start:start + self.BATCH_SIZE])
+            start += len(results)
+            yield from results
+
+    def close(self):
+        """
+        Stop the git processes. They will be restarted if the reader is used again.
+        """
+        for mode, lock in self._locks.items():
+            with lock:
+                self._generation += 1
+                proc = self._procs.pop(mode, None)
+                if proc is not None:
+                    proc.stdin.close()
+                    proc.wait()
+                    proc.stdout.close()
+
+
+class BatchStream(RawIOBase):
+    """
+    Readable binary stream of one object's contents from the output of a ``git cat-file --batch``
+
+    The stream has the process to itself. Once all the contents have been read, the process is
+    handed back to its `CatFile` if possible, and otherwise stopped. If the stream is closed
+    before then, the process is killed.
+    """
+
+    def __init__(self, cat_file, proc, size):
+        """
+        :param cat_file: the `CatFile` to hand the process back to, or None if it can't be reused
+        :param proc: the process, whose output is at the start of the object's contents
+        :param size: size of the object in bytes
+        """
+        self._cat_file = cat_file
+        self._generation = cat_file._generation if cat_file is not None else None
+        self._proc = proc
+        self._remaining = size
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self._proc is None or not self._remaining:
+            return 0
+        count = self._proc.stdout.readinto(memoryview(buffer)[:self._remaining])
+        if not count:
+            # The process has gone away
+            self._release(reuse=False)
+            return 0
+        self._remaining -= count
+        if not self._remaining:
+            self._proc.stdout.read(1)  # Trailing newline
+            self._release(reuse=self._cat_file is not None)
+        return count
+
+    def _release(self, reuse):
+        proc, self._proc = self._proc, None
+        if reuse:
+            self._cat_file._reuse(proc, self._generation)
+        else:
+            CatFile._kill(proc)
+
+    def close(self):
+        if not self.closed and self._proc is not None:
+            self._release(reuse=False)
+        super().close()
+
+
+class CatFileObjectDB(GitCmdObjectDB):
+    """
+    GitPython object database which reads objects through a thread-safe `CatFile`
+
+    Pass as ``odbt`` when creating a `git.Repo` to route all its object reads through our
+    long-lived processes.
+    """
+
+    def __init__(self, root_path, git):
+        super().__init__(root_path, git)
+        self.cat_file = CatFile(os.path.dirname(os.path.abspath(root_path)))
+
+    def info(self, binsha):
+        hexsha, type_, size = self.cat_file.info(bin_to_hex(binsha).decode())
+        return OInfo(hex_to_bin(hexsha), type_, size)
+
+    def stream(self, binsha):
+        hexsha, type_, size, stream = self.cat_file.open(bin_to_hex(binsha).decode())
+        return OStream(hex_to_bin(hexsha), type_, size, stream)
+
+    def read_many(self, binshas):
+        """
+        Read several objects, pipelining the requests
+
+        :param binshas: iterable of binary object SHAs
+        :return: iterable of `gitdb.base.OStream` objects, in the order requested
+        """
+        for hexsha, type_, size, stream in self.cat_file.read_many(bin_to_hex(b).decode() for b in binshas):
+            yield OStream(hex_to_bin(hexsha), type_, size, stream)
+
+    def close(self):
+        self.cat_file.close()
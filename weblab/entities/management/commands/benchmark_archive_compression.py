@@ -0,0 +1,94 @@
+import datetime
+import os
+import random
+import time
+import zipfile
+
+from django.core.management.base import BaseCommand
+
+from core.combine import ArchiveWriter
+from entities.repository import Repository
+
+
+class StoreAllWriter(ArchiveWriter):
+    """Stores every file uncompressed, as archives were written before compression was chosen by type"""
+    @classmethod
+    def compress_type(cls, filename):
+        return zipfile.ZIP_STORED
+
+
+class DeflateAllWriter(ArchiveWriter):
+    """Deflates every file, whatever its type"""
+    @classmethod
+    def compress_type(cls, filename):
+        return zipfile.ZIP_DEFLATED
+
+
+class Command(BaseCommand):
+    help = 'Compares the speed and output size of ways of compressing files into COMBINE archives'
+
+    def add_arguments(self, parser):
+        source = parser.add_mutually_exclusive_group()
+        source.add_argument('--repo', help='existing entity repository to archive (latest commit)')
+        source.add_argument('--archive', help='existing archive (e.g. of a dataset) whose files to rewrite; '
+                                              'by default a mix of text and binary files is generated')
+        parser.add_argument('--files', type=int, default=200, help='number of files to generate')
+        parser.add_argument('--size', type=int, default=256 * 1024, help='size in bytes of each generated file')
+        parser.add_argument('--workers', type=int, default=4, help='number of threads for parallel compression')
+        parser.add_argument('--repeat', type=int, default=3, help='number of times to time each method')
+
+    def generate_files(self, num_files, size):
+        """Numeric CSV files, which compress well, alternating with PNG-named random data, which doesn't"""
+        rng = random.Random(0)
+        files = []
+        for i in range(num_files):
+            if i % 2:
+                files.append(('plot%04d.png' % i, os.urandom(size)))
+            else:
+                rows = []
+                length = 0
+                while length < size:
+                    rows.append(','.join('%.6g' % rng.gauss(0, 100) for _ in range(4)))
+                    length += len(rows[-1]) + 1
+                files.append(('data%04d.csv' % i, '\n'.join(rows).encode()[:size]))
+        return files
+
+    def read_repo(self, path):
+        repo = Repository(path)
+        try:
+            commit = repo.latest_commit
+            return [(blob.path, stream.read()) for blob, stream in repo.read_blobs(commit.files)]
+        finally:
+            repo.close()
+
+    def read_archive(self, path):
+        with zipfile.ZipFile(path) as archive:
+            return [(name, archive.read(name)) for name in archive.namelist()]
+
+    def time_method(self, name, writer, files, repeat):
+        mtime = datetime.datetime.now()
+        file_data = [(filename, contents, mtime) for filename, contents in files]
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            size = len(writer.write(file_data).getbuffer())
+            timings.append(time.perf_counter() - start)
+        self.stdout.write('{:<28} best {:8.2f} ms, mean {:8.2f} ms, archive {} bytes'.format(
+            name, 1000 * min(timings), 1000 * sum(timings) / len(timings), size))
+
+    def handle(self, *args, **options):
+        if options['repo']:
+            files = self.read_repo(options['repo'])
+        elif options['archive']:
+            files = self.read_archive(options['archive'])
+        else:
+            files = self.generate_files(options['files'], options['size'])
+        self.stdout.write('Archiving {} files, {} bytes in total'.format(
+            len(files), sum(len(contents) for _, contents in files)))
+
+        repeat = options['repeat']
+        self.time_method('store all', StoreAllWriter(), files, repeat)
+        self.time_method('deflate all', DeflateAllWriter(), files, repeat)
+        self.time_method('by file type', ArchiveWriter(), files, repeat)
+        self.time_method('by file type, {} threads'.format(options['workers']),
+                         ArchiveWriter(options['workers']), files, repeat)
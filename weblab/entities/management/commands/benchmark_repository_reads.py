@@ -0,0 +1,77 @@
+import os
+import time
+from tempfile import TemporaryDirectory
+
+from django.core.management.base import BaseCommand
+from git import Actor, Repo
+
+from entities.catfile import CatFileObjectDB
+
+
+class Command(BaseCommand):
+    help = 'Compares the speed of reading all files in a commit via GitPython and via our cat-file reader'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', help='existing repository to read (latest commit); '
+                                           'by default a temporary repository is generated')
+        parser.add_argument('--files', type=int, default=500, help='number of files in a generated repository')
+        parser.add_argument('--size', type=int, default=4096, help='size in bytes of each generated file')
+        parser.add_argument('--repeat', type=int, default=5, help='number of times to time each method')
+
+    def make_repo(self, path, num_files, size):
+        repo = Repo.init(path)
+        filenames = []
+        for i in range(num_files):
+            filename = 'file%04d.txt' % i
+            with open(os.path.join(path, filename), 'wb') as f:
+                f.write(os.urandom(size // 2).hex().encode())
+            filenames.append(filename)
+        repo.index.add(filenames)
+        author = Actor('Benchmark', 'benchmark@example.com')
+        repo.index.commit('Benchmark commit', author=author, committer=author)
+        repo.close()
+
+    def time_method(self, name, method, repeat):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            total = method()
+            timings.append(time.perf_counter() - start)
+        self.stdout.write('{:<28} best {:8.2f} ms, mean {:8.2f} ms ({} bytes)'.format(
+            name, 1000 * min(timings), 1000 * sum(timings) / len(timings), total))
+
+    def benchmark(self, path, repeat):
+        # Repositories are opened once, as the repository pool keeps them open between requests,
+        # and each method reads the same blobs of the latest commit
+        gitpython_repo = Repo(path)
+        cat_file_repo = Repo(path, odbt=CatFileObjectDB)
+
+        def gitpython():
+            # The default GitPython object database
+            return sum(len(blob.data_stream.read()) for blob in gitpython_repo.head.commit.tree.blobs)
+
+        def cat_file():
+            return sum(len(blob.data_stream.read()) for blob in cat_file_repo.head.commit.tree.blobs)
+
+        def cat_file_pipelined():
+            blobs = cat_file_repo.head.commit.tree.blobs
+            return sum(len(ostream.read()) for ostream in cat_file_repo.odb.read_many(b.binsha for b in blobs))
+
+        try:
+            self.time_method('GitPython', gitpython, repeat)
+            self.time_method('cat-file', cat_file, repeat)
+            self.time_method('cat-file (pipelined)', cat_file_pipelined, repeat)
+        finally:
+            gitpython_repo.close()
+            cat_file_repo.odb.close()
+            cat_file_repo.close()
+
+    def handle(self, *args, **options):
+        if options['path']:
+            self.benchmark(options['path'], options['repeat'])
+        else:
+            with TemporaryDirectory() as path:
+                self.stdout.write('Generating repository with {} files of {} bytes'.format(
+                    options['files'], options['size']))
+                self.make_repo(path, options['files'], options['size'])
+                self.benchmark(path, options['repeat'])
@@ -0,0 +1,112 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.core.management.base import BaseCommand
+from git import Git, GitCommandError
+
+from entities.models import Entity
+
+
+def objects_size(path):
+    """
+    Total size of a repository's object store
+
+    :param path: path of the repository's working tree
+    :return: size in bytes of all files under ``.git/objects``
+    """
+    total = 0
+    for dirpath, _, filenames in os.walk(os.path.join(path, '.git', 'objects')):
+        for filename in filenames:
+            try:
+                total += os.lstat(os.path.join(dirpath, filename)).st_size
+            except FileNotFoundError:
+                pass  # Removed by a concurrent git process
+    return total
+
+
+def maintain_repository(path, min_loose_objects, prune_expire):
+    """
+    Repack, prune and write a commit-graph for one repository, if it has enough loose objects
+
+    This is run in a worker process, so only takes and returns simple values.
+
+    :param path: path of the repository's working tree
+    :param min_loose_objects: skip the repository if it has fewer loose objects than this
+    :param prune_expire: only prune unreachable objects older than this (e.g. '2.weeks.ago'),
+        so that objects being written by a concurrent request are kept
+    :return: dict with keys 'loose_objects', 'skipped', 'seconds', 'size_before', 'size_after'
+        and 'error' (a message, or None)
+    """
+    git = Git(path)
+    start = time.perf_counter()
+    result = {'skipped': False, 'seconds': 0, 'size_before': 0, 'size_after': 0, 'error': None}
+    try:
+        counts = dict(line.split(': ', 1) for line in git.count_objects('-v').splitlines())
+        result['loose_objects'] = int(counts['count'])
+        if result['loose_objects'] < min_loose_objects:
+            result['skipped'] = True
+            return result
+
+        result['size_before'] = objects_size(path)
+        git.repack('-a', '-d', '-q')
+        git.prune('--expire', prune_expire)
+        git.commit_graph('write', '--reachable')
+        result['size_after'] = objects_size(path)
+    except GitCommandError as e:
+        result['error'] = str(e)
+    finally:
+        result['seconds'] = time.perf_counter() - start
+    return result
+
+
+class Command(BaseCommand):
+    help = 'Repacks, prunes and writes commit-graphs for entity repositories with many loose objects'
+
+    def add_arguments(self, parser):
+        parser.add_argument('entity_id', nargs='*', type=int)
+        parser.add_argument('--jobs', type=int, default=4,
+                            help='maximum number of repositories to maintain at once')
+        parser.add_argument('--min-loose-objects', type=int, default=256,
+                            help='skip repositories with fewer loose objects than this')
+        parser.add_argument('--prune-expire', default='2.weeks.ago',
+                            help='only prune unreachable objects older than this')
+
+    def handle(self, *args, **options):
+        entities = Entity.objects.all()
+        if options.get('entity_id', []):
+            entities = entities.filter(id__in=options['entity_id'])
+        labels = {
+            str(entity.repo_abs_path): '{} {}'.format(entity.entity_type, entity.name)
+            for entity in entities
+            if entity.repo_abs_path.exists()
+        }
+
+        start = time.perf_counter()
+        num_maintained = bytes_saved = 0
+        with ProcessPoolExecutor(max_workers=max(options.get('jobs', 4), 1)) as executor:
+            futures = {
+                executor.submit(
+                    maintain_repository,
+                    path,
+                    options.get('min_loose_objects', 256),
+                    options.get('prune_expire', '2.weeks.ago'),
+                ): path
+                for path in labels
+            }
+            for future in as_completed(futures):
+                label = labels[futures[future]]
+                result = future.result()
+                if result['error']:
+                    self.stderr.write('{}: maintenance failed: {}'.format(label, result['error']))
+                elif result['skipped']:
+                    self.stdout.write('{}: {} loose objects, skipped'.format(label, result['loose_objects']))
+                else:
+                    saved = result['size_before'] - result['size_after']
+                    num_maintained += 1
+                    bytes_saved += saved
+                    self.stdout.write('{}: {} loose objects, maintained in {:.2f} s, saving {} bytes'.format(
+                        label, result['loose_objects'], result['seconds'], saved))
+
+        self.stdout.write('Maintained {} of {} repositories in {:.2f} s, saving {} bytes'.format(
+            num_maintained, len(labels), time.perf_counter() - start, bytes_saved))
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+
+from core.visibility import Visibility
+from repocache.models import CACHED_VERSION_TYPE_MAP
+
+from ...archive_cache import archive_cache
+
+
+class Command(BaseCommand):
+    help = 'Builds and caches COMBINE archives for all moderated entity versions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('entity_id', nargs='*', type=int)
+
+    def handle(self, *args, **options):
+        if not archive_cache.enabled:
+            self.stderr.write('The archive cache is disabled (ARCHIVE_CACHE_MAX_SIZE is 0)')
+            return
+
+        num_archives = 0
+        for version_type in CACHED_VERSION_TYPE_MAP.values():
+            versions = version_type.objects.filter(
+                visibility=Visibility.MODERATED,
+            ).select_related('entity__entity')
+            if options.get('entity_id', []):
+                versions = versions.filter(entity__entity__id__in=options['entity_id'])
+
+            for version in versions:
+                entity = version.entity.entity
+                if not entity.repo_abs_path.exists():
+                    continue
+                self.stdout.write('Caching archive of {} {} version {}'.format(
+                    entity.entity_type, entity.name, version.sha[:10]))
+                with archive_cache.open(entity.repo.get_commit(version.sha)):
+                    num_archives += 1
+
+        entries = archive_cache.entries()
+        self.stdout.write('Cached {} archives; cache holds {} archives, {} bytes'.format(
+            num_archives, len(entries), sum(size for _, size, _ in entries)))
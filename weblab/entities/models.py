@@ -6,15 +6,15 @@ from django.core.exceptions import ObjectDoesNotExist
 from django.core.validators import MinLengthValidator
 from django.db import models
 from django.urls import reverse
-from django.utils.functional import cached_property
-from guardian.shortcuts import get_objects_for_user
+from django.utils import timezone
 
-from core.filetypes import get_file_type
 from core.models import UserCreatedModelMixin, VisibilityModelMixin
+from core.permissions import shared_pks
 from core.visibility import Visibility, visibility_check
+from repocache import versioncache
 from repocache.exceptions import RepoCacheMiss
 
-from .repository import Repository
+from .repository import repository_pool
 
 
 VISIBILITY_NOTE_PREFIX = 'Visibility: '
@@ -70,15 +70,15 @@ class Entity(UserCreatedModelMixin, models.Model):
     def __str__(self):
         return self.name
 
-    @cached_property
+    @property
     def repo(self):
         """This entity's git repository wrapper.
 
-        Caching this property actually reduces the number of open files, but there's still a risk
-        of running out of file handles eventually.
+        Repository handles are shared between all entity instances (and threads) via a
+        process-wide pool, which bounds the number of files kept open.
         See also https://gitpython.readthedocs.io/en/stable/intro.html#leakage-of-system-resources
         """
-        return Repository(self.repo_abs_path)
+        return repository_pool.get(self.repo_abs_path)
 
     @property
     def repo_abs_path(self):
@@ -113,7 +113,11 @@ class Entity(UserCreatedModelMixin, models.Model):
 
     @property
     def repocache(self):
+        from repocache import identitymap
         from repocache.models import get_or_create_cached_entity
+        identity_map = identitymap.current()
+        if identity_map is not None:
+            return identity_map.get_cached_entity(self)
         return get_or_create_cached_entity(self)[0]
 
     @property
@@ -134,7 +138,9 @@ class Entity(UserCreatedModelMixin, models.Model):
         commit = self.repo.get_commit(commit)
         self.set_visibility_in_repo(commit, visibility)
 
-        self.repocache.get_version(commit.sha).set_visibility(visibility)
+        version = self.repocache.get_version(commit.sha)
+        version.set_visibility(visibility)
+        versioncache.forget_version(version)
 
     def get_version_visibility(self, sha, default=None):
         """
@@ -196,7 +202,26 @@ class Entity(UserCreatedModelMixin, models.Model):
         commit = self.repo.get_commit(ref)
         self.repo.tag(tagname, ref=ref)
         try:
-            self.repocache.get_version(commit.sha).tag(tagname)
+            version = self.repocache.get_version(commit.sha)
+        except RepoCacheMiss:
+            return
+        version.tag(tagname)
+        versioncache.forget_version(version)
+
+    def add_ephemeral_file(self, commit, name, content=None, path=None):
+        """
+        Add an ephemeral file to the given entity version
+
+        Updates both the repository and the cache
+
+        :param commit: `repository.Commit` for the version
+        :param name: file name
+        :param content: bytes object containing the file contents
+        :param path: path to the file on disk
+        """
+        commit.add_ephemeral_file(name, content, path)
+        try:
+            self.repocache.get_version(commit.sha).store_files(commit)
         except RepoCacheMiss:
             pass
 
@@ -251,7 +276,7 @@ class Entity(UserCreatedModelMixin, models.Model):
         """
         return visibility_check(
             self.get_version_visibility(hexsha),
-            self.viewers,
+            lambda: self.viewers,
             user
         )
 
@@ -269,57 +294,61 @@ class Entity(UserCreatedModelMixin, models.Model):
             ok = self.repocache.get_version(version).parsed_ok
         return ok
 
-    def get_version_json(self, commit, ns):
+    def get_version_json(self, version, ns):
         """Get metadata for a particular version of this entity suitable for sending as JSON.
 
-        :param commit: a `Commit` instance (TODO #191 a `CachedEntityVersion` instance)
+        This is read entirely from the repocache.
+
+        :param version: a `CachedEntityVersion` instance
         :param str ns: the app namespace to use for reversing download URLs
         :return: a dictionary of version metadata, including file info
         """
+        # Stored timestamps are naive, but were reported with their time zone when read from git
+        created = version.timestamp
+        if timezone.is_naive(created):
+            created = timezone.make_aware(created)
         files = [
-            self.get_file_json(commit, f, ns)
-            for f in commit.files
+            self.get_file_json(version, f, created, ns)
+            for f in version.get_files()
             if f.name not in ['manifest.xml', 'metadata.rdf']
         ]
         return {
-            'id': commit.sha,
+            'id': version.sha,
             'entityId': self.id,
-            'author': commit.author.name,
-            'parsedOk': self.is_parsed_ok(commit.sha),
-            'visibility': self.get_version_visibility(commit.sha, default=self.DEFAULT_VISIBILITY),
-            'created': commit.timestamp,
+            'author': version.author,
+            'parsedOk': version.parsed_ok,
+            'visibility': version.visibility,
+            'created': created,
             'name': self.name,
-            'version': self.repocache.get_name_for_version(commit.sha),
+            'version': version.get_name(),
             'files': files,
-            'commitMessage': commit.message,
+            'commitMessage': version.message,
             'numFiles': len(files),
             'url': reverse(
                 ns + ':version',
-                args=[self.url_type, self.id, commit.sha]
+                args=[self.url_type, self.id, version.sha]
             ),
         }
 
-    def get_file_json(self, commit, file_, ns):
-        """Get metadata for a single file within a commit suitable for sending as JSON.
-
-        TODO #191 consider how to replace Commit with CachedEntityVersion here. We'd need
-        to cache the list of file names and sizes.
+    def get_file_json(self, version, file_, created, ns):
+        """Get metadata for a single file within a version suitable for sending as JSON.
 
-        :param commit: a `Commit` instance
-        :param git.Blob file_: the file to get metadata for
+        :param version: a `CachedEntityVersion` instance
+        :param file_: the `CachedEntityFile` to get metadata for
+        :param datetime created: when the version was made
         :param str ns: the app namespace to use for reversing download URLs
         :return: a dictionary of file metadata
         """
         return {
             'id': file_.name,
             'name': file_.name,
-            'author': commit.author.name,
-            'created': commit.timestamp,
-            'filetype': get_file_type(file_.name),
+            'author': version.author,
+            'created': created,
+            'filetype': file_.filetype,
             'size': file_.size,
             'url': reverse(
                 ns + ':file_download',
-                args=[self.url_type, self.id, commit.sha, file_.name]
+                args=[self.url_type, self.id, version.sha, file_.name]
             ),
         }
 
@@ -340,18 +369,9 @@ class EntityManager(models.Manager):
         - the entity has at least one non-private version
         - or the entity is explicitly shared with the user
         """
-        from repocache.models import CACHED_VERSION_TYPE_MAP
-        CachedEntityVersion = CACHED_VERSION_TYPE_MAP[self.model.entity_type]
-        non_private = self.annotate(
-            non_private=models.Exists(
-                CachedEntityVersion.objects.filter(
-                    entity__entity=models.OuterRef('pk'),
-                    visibility__in=['public', 'moderated'],
-                )
-            )
-        ).filter(
-            non_private=True,
-        )
+        non_private = self.filter(**{
+            'cached%s__aggregate_visibility__in' % self.model.entity_type: ['public', 'moderated'],
+        })
         owned = self.filter(author=user) if user.is_authenticated else self.none()
         shared = self.shared_with_user(user)
         return owned | non_private | shared
@@ -359,9 +379,7 @@ class EntityManager(models.Manager):
     def shared_with_user(self, user):
         """Query over all managed entities shared explicitly with the given user."""
         if user.is_authenticated:
-            shared_pks = get_objects_for_user(
-                user, 'entities.edit_entity', with_superuser=False).values_list('pk', flat=True)
-            return self.get_queryset().filter(pk__in=shared_pks)
+            return self.get_queryset().filter(pk__in=shared_pks(user, 'entities.edit_entity'))
         else:
             return self.none()
 
@@ -428,7 +446,7 @@ class ProtocolEntity(Entity):
             if doc_start >= 0 and doc_end > doc_start:
                 doc = content[doc_start + 1:doc_end]
                 # Create ephemeral file
-                commit.add_ephemeral_file(version.README_NAME, doc)
+                self.add_ephemeral_file(commit, version.README_NAME, doc)
                 version.has_readme = True
                 version.save()
 
@@ -7,6 +7,7 @@ from django.urls import reverse
 
 from core.processing import prepend_callback_base
 from experiments.models import PlannedExperiment
+from repocache import versioncache
 from repocache.models import ProtocolInterface, ProtocolIoputs
 
 from .models import AnalysisTask, ModelEntity, ProtocolEntity
@@ -110,6 +111,7 @@ def process_check_protocol_callback(data):
         cached_version.parsed_ok = True
         cached_version.interface.all().delete()  # Remove results of any previous analysis
         cached_version.save()
+        versioncache.forget_version(cached_version)
         terms = [
             ProtocolInterface(protocol_version=cached_version, term=term, optional=False)
             for term in data['required']
@@ -147,7 +149,7 @@ def process_check_protocol_callback(data):
             logger.warning('Error file already exists in commit. New error message is: %s', error_message)
         else:
             content = b'Error analysing protocol:\n\n' + error_message.encode('UTF-8')
-            commit.add_ephemeral_file(ERROR_FILE_NAME, content)
+            entity.add_ephemeral_file(commit, ERROR_FILE_NAME, content)
         # Don't try to analyse this protocol again
         cached_version = entity.repocache.get_version(version)
         cached_version.parsed_ok = False
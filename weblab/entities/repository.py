@@ -1,21 +1,33 @@
-import binascii
 import errno
+import hashlib
 import os
+import resource
 import stat
+import threading
+import weakref
+from collections import OrderedDict
 from datetime import datetime
+from io import BytesIO
 from itertools import chain
 from pathlib import Path
 from shutil import rmtree
 from tempfile import TemporaryDirectory
 
+from django.conf import settings
 from django.utils.functional import cached_property
 from django.utils.timezone import utc
 from git import (
     Actor,
     Blob,
-    GitCommandError,
+    Reference,
     Repo,
+    TagReference,
+    Tree,
 )
+from git.objects.commit import Commit as GitCommit
+from git.objects.fun import tree_to_stream
+from gitdb.base import IStream
+from gitdb.util import hex_to_bin
 
 from core.combine import (
     MANIFEST_FILENAME,
@@ -23,6 +35,15 @@ from core.combine import (
     ManifestReader,
     ManifestWriter,
 )
+from repocache import versioncache
+
+from .archive_cache import archive_cache
+from .catfile import CatFileObjectDB
+
+
+def _close_git_repo(repo):
+    repo.odb.close()
+    repo.close()
 
 
 class Repository:
@@ -30,11 +51,18 @@ class Repository:
     Wrapper class for `git.Repo`
     """
 
+    # Number of commits whose file indexes are kept by `get_file_index`
+    FILE_INDEX_CACHE_SIZE = 64
+
     def __init__(self, path):
         """
         :param path: Path of repository directory
         """
         self._root = str(path)
+        self._notes_index = None
+        self._ref_snapshot = None
+        self._file_indexes = OrderedDict()
+        self._file_indexes_lock = threading.Lock()
 
     def create(self):
         """
@@ -46,8 +74,21 @@ class Repository:
         """
         Delete the repository
         """
+        repository_pool.discard(self._root)
+        self.close()
         rmtree(self._root, ignore_errors=False, onerror=self.handle_remove_readonly)
 
+    def close(self):
+        """
+        Release any open files and git processes held by the underlying `git.Repo`
+
+        The repository can still be used after closing; resources will be reopened on demand.
+        """
+        if self.__dict__.pop('_repo', None) is not None:
+            self._close_repo()
+        with self._file_indexes_lock:
+            self._file_indexes.clear()
+
     @staticmethod
     def handle_remove_readonly(func, path, exc):
         """
@@ -59,7 +100,102 @@ class Repository:
 
     @cached_property
     def _repo(self):
-        return Repo(self._root)
+        repo = Repo(self._root, odbt=CatFileObjectDB)
+        # Handles evicted from the pool may still be in use, so are closed when no longer referenced
+        self._close_repo = weakref.finalize(self, _close_git_repo, repo)
+        return repo
+
+    @property
+    def notes_index(self):
+        """
+        In-memory index of the weblab git notes on all commits in this repository
+
+        The index is rebuilt whenever a notes ref has moved since it was last read, which is
+        checked by reading the ref files rather than running git.
+
+        :return: `NotesIndex` object
+        """
+        tips = self._notes_tips()
+        index = self._notes_index
+        if index is None or index.tips != tips:
+            index = self._notes_index = NotesIndex(self._repo, tips)
+        return index
+
+    def _notes_tips(self):
+        return {
+            ref.path: Reference.dereference_recursive(self._repo, ref.path)
+            for ref in Reference.iter_items(self._repo, common_path=NotesIndex.REF_BASE)
+        }
+
+    def invalidate_notes(self):
+        """
+        Discard the notes index, e.g. after notes have been written
+        """
+        self._notes_index = None
+
+    @property
+    def ref_snapshot(self):
+        """
+        The branches, tags and HEAD of this repository, with tags peeled to their commits
+
+        The snapshot is reread whenever any ref file has changed since it was last read, which is
+        checked by stat-ing the ref files rather than running git.
+
+        :return: `RefSnapshot` object
+        """
+        fingerprint = RefSnapshot.fingerprint(self._repo.git_dir)
+        snapshot = self._ref_snapshot
+        if snapshot is None or snapshot.key != fingerprint:
+            snapshot = self._ref_snapshot = RefSnapshot(self._repo, fingerprint)
+        return snapshot
+
+    @property
+    def ref_fingerprint(self):
+        """
+        A digest of the refs that determine what is cached about this repository
+
+        This changes whenever HEAD moves, a tag is added, removed or moved, or a note is written.
+
+        :return: hex string of the SHA-256 digest of HEAD, the tags and the notes refs
+        """
+        snapshot = self.ref_snapshot
+        lines = ['HEAD %s' % snapshot.head]
+        lines.extend('refs/tags/%s %s' % tag for tag in sorted(snapshot.tags.items()))
+        lines.extend('%s %s' % tip for tip in sorted(self._notes_tips().items()))
+        return hashlib.sha256('\n'.join(lines).encode()).hexdigest()
+
+    def invalidate_refs(self):
+        """
+        Discard the ref snapshot, e.g. after a branch or tag has been moved
+        """
+        self._ref_snapshot = None
+
+    def get_file_index(self, commit):
+        """
+        Index of all files in a commit's tree, including those in subdirectories
+
+        A commit's tree never changes, so indexes are cached by commit SHA for the most recently
+        used `FILE_INDEX_CACHE_SIZE` commits. Ephemeral files are not included.
+
+        :param commit: `git.Commit` object
+        :return: dict mapping file path to `git.Blob` object, in breadth-first tree order.
+            This must not be modified.
+        """
+        with self._file_indexes_lock:
+            index = self._file_indexes.get(commit.binsha)
+            if index is not None:
+                self._file_indexes.move_to_end(commit.binsha)
+                return index
+
+        index = {
+            blob.path: blob
+            for blob in commit.tree.traverse(predicate=lambda item, depth: item.type == 'blob')
+        }
+        with self._file_indexes_lock:
+            self._file_indexes[commit.binsha] = index
+            while len(self._file_indexes) > self.FILE_INDEX_CACHE_SIZE:
+                self._file_indexes.popitem(last=False)
+        return index
 
     def add_file(self, file_path):
         """
@@ -87,11 +223,13 @@ class Repository:
 
         :return: `Commit` object
         """
-        return Commit(self, self._repo.index.commit(
+        commit = self._repo.index.commit(
             message,
             author=Actor(author.full_name, author.email),
             committer=Actor(author.full_name, author.email),
-        ))
+        )
+        self.invalidate_refs()
+        return Commit(self, commit)
 
     def tag(self, tag, *, ref='HEAD'):
         """
@@ -101,6 +239,7 @@ class Repository:
         :param ref: A reference to a specific commit, defaults to the latest
         """
         self._repo.create_tag(tag, ref=ref)
+        self.invalidate_refs()
 
     @property
     def has_changes(self):
@@ -122,20 +261,67 @@ class Repository:
         """
         Roll back repository to previous commit, removing untracked files
         """
+        if self._repo.bare:
+            self._repo.head.reset('HEAD~', index=False)
+            self.invalidate_refs()
+            return
         self._repo.head.reset('HEAD~', working_tree=True)
+        self.invalidate_refs()
         for f in self.untracked_files:
             os.remove(os.path.join(self._root, f))
 
+    def set_head(self, sha, expected_sha=None, *, message='update'):
+        """
+        Atomically move the current branch to a commit, provided it hasn't moved
+
+        :param sha: hex SHA of the commit the branch should point to
+        :param expected_sha: hex SHA the branch must currently point to,
+            or None if the branch must not exist yet (i.e. there are no commits)
+        :param message: message for the reflog
+        :raise: `git.GitCommandError` if the branch is not at `expected_sha`
+        """
+        try:
+            self._repo.git.update_ref('-m', message, 'HEAD', sha, expected_sha or '0' * 40)
+        finally:
+            self.invalidate_refs()
+
+    def read_blobs(self, blobs):
+        """
+        Read the contents of several blobs, pipelining the object reads
+
+        Small blobs are read into memory; large ones are streamed from git when first read.
+
+        :param blobs: iterable of `git.Blob` objects
+        :return: iterable of (blob, file-like object) pairs, in the order given. The file-like
+            objects should be closed after use.
+        """
+        blobs = list(blobs)
+        streams = self._repo.odb.read_many(blob.binsha for blob in blobs)
+        return zip(blobs, streams)
+
+    def open_blob(self, blob):
+        """
+        Open the contents of a blob for reading
+
+        Blobs larger than `CatFile.STREAM_SIZE` are streamed from git rather than read into memory.
+
+        :param blob: `git.Blob` object
+        :return: binary file-like object, which should be closed after use.
+            Only small blobs give seekable objects.
+        """
+        return self._repo.odb.stream(blob.binsha).stream
+
     @property
     def tag_dict(self):
         """
         Mapping of commits to git tags in the entity repository
 
-        :return: dict of the form { 'commit_sha': ['tag_name'] }
+        :return: dict of the form { 'commit_sha': [`git.TagReference`] }, with each commit's
+            tags sorted by name
         """
         tags = {}
-        for tag in self._repo.tags:
-            tags.setdefault(tag.commit.hexsha, []).append(tag)
+        for name, sha in sorted(self.ref_snapshot.tags.items()):
+            tags.setdefault(sha, []).append(TagReference(self._repo, 'refs/tags/' + name))
         return tags
 
     def hard_reset(self):
@@ -151,7 +337,8 @@ class Repository:
 
         :return: `Commit` object or `None` if no commits
         """
-        return Commit(self, self._repo.head.commit) if self._repo.head.is_valid() else None
+        sha = self.ref_snapshot.head
+        return Commit(self, GitCommit(self._repo, hex_to_bin(sha))) if sha else None
 
     def get_commit(self, version):
         """
@@ -163,8 +350,10 @@ class Repository:
         """
         if version == 'latest':
             return self.latest_commit
-        else:
-            return Commit(self, self._repo.commit(version))
+        sha = self.ref_snapshot.tags.get(version)
+        if sha is not None:
+            return Commit(self, GitCommit(self._repo, hex_to_bin(sha)))
+        return Commit(self, self._repo.commit(version))
 
     @property
     def commits(self):
@@ -176,6 +365,15 @@ class Repository:
         else:
             return iter(())
 
+    def count_commits(self, sha):
+        """
+        Count the commits in the history of a commit, without reading them all
+
+        :param sha: hex string of the commit SHA
+        :return: number of commits reachable from the commit, including itself
+        """
+        return int(self._repo.git.rev_list('--count', sha))
+
     @property
     def manifest_path(self):
         """
@@ -211,6 +409,435 @@ class Repository:
         self.add_file(self.manifest_path)
 
 
+class CommitBuilder:
+    """
+    Build a new commit directly in a repository's object database
+
+    Unlike `Repository.commit`, this builds neither on the git index nor the working tree. The
+    new commit starts with the files of its parent; file contents are written straight to the
+    object database as blobs, and the trees are built from the resulting list of files. The
+    branch is moved to the new commit in one atomic step, which fails if another commit has
+    been made since the parent. Until `commit` is called nothing is visible in the repository,
+    so an abandoned build needs no cleaning up (`git gc` will remove the unused objects).
+
+    In repositories with a working tree, the index is then reset to the new commit, so that it
+    doesn't show the commit's changes as staged to be undone. The working tree is left alone.
+    """
+
+    FILE_MODE = 0o100644
+    TREE_MODE = 0o040000
+
+    def __init__(self, repo, parent=None):
+        """
+        :param repo: `Repository` to commit to
+        :param parent: `Commit` the new commit will follow, or None for the first commit
+        """
+        self._repo = repo
+        self._parent = parent
+        self._files = {}
+        if parent is not None:
+            self._files = {
+                path: (blob.mode, blob.binsha)
+                for path, blob in repo.get_file_index(parent._commit).items()
+            }
+        self._tree_binsha = None
+
+    @property
+    def filenames(self):
+        """
+        Names (paths) of the files the new commit will contain
+
+        :return: set of filenames
+        """
+        return set(self._files)
+
+    def _store(self, type_, size, stream):
+        return self._repo._repo.odb.store(IStream(type_, size, stream)).binsha
+
+    def _check_name(self, name):
+        parts = name.split('/')
+        if any(part in ('', '.', '..', '.git') for part in parts):
+            raise ValueError("Invalid file name '{}'".format(name))
+        prefixes = {'/'.join(parts[:i]) for i in range(1, len(parts))}
+        if prefixes & self._files.keys() or any(path.startswith(name + '/') for path in self._files):
+            raise ValueError("File name '{}' clashes with a directory name".format(name))
+
+    def add_file(self, name, *, content=None, path=None):
+        """
+        Add a file to the new commit, replacing any existing file of the same name
+
+        :param name: file name, which may include subdirectories separated by '/'
+        :param content: bytes object containing the file contents
+        :param path: path to a file on disk containing the file contents
+
+        One of content or path must be given.
+
+        :raise: `ValueError` if the name is not valid
+        """
+        self._check_name(name)
+        if path is None:
+            assert content is not None
+            binsha = self._store(Blob.type, len(content), BytesIO(content))
+        else:
+            with open(path, 'rb') as f:
+                binsha = self._store(Blob.type, os.fstat(f.fileno()).st_size, f)
+        self._files[name] = (self.FILE_MODE, binsha)
+        self._tree_binsha = None
+
+    def remove_file(self, name):
+        """
+        Remove a file from the new commit
+
+        :param name: file name
+        :raise: `ValueError` if there is no such file
+        """
+        if self._files.pop(name, None) is None:
+            raise ValueError("File '{}' does not exist".format(name))
+        self._tree_binsha = None
+
+    def generate_manifest(self, master_filename=None):
+        """
+        Add a COMBINE manifest listing all the files in the new commit
+
+        Will overwrite any existing manifest.
+
+        :param master_filename: Name of main/master file
+        """
+        writer = ManifestWriter()
+        for name in sorted(self._files.keys() | {MANIFEST_FILENAME}):
+            writer.add_file(name, is_master=name == master_filename)
+        manifest = BytesIO()
+        writer.write(manifest)
+        self.add_file(MANIFEST_FILENAME, content=manifest.getvalue())
+
+    def _store_tree(self, entries):
+        items = []
+        for name, entry in entries.items():
+            if isinstance(entry, dict):
+                items.append((self._store_tree(entry), self.TREE_MODE, name))
+            else:
+                mode, binsha = entry
+                items.append((binsha, mode, name))
+        # Git orders tree entries as if subdirectory names ended with '/'
+        items.sort(key=lambda item: (item[2] + '/' if item[1] == self.TREE_MODE else item[2]).encode())
+        data = BytesIO()
+        tree_to_stream(items, data.write)
+        return self._store(Tree.type, data.tell(), BytesIO(data.getvalue()))
+
+    @property
+    def tree_binsha(self):
+        """
+        Binary SHA of the new commit's tree, which is written to the object database if necessary
+        """
+        if self._tree_binsha is None:
+            root = {}
+            for path, entry in self._files.items():
+                *dirs, name = path.split('/')
+                node = root
+                for dirname in dirs:
+                    node = node.setdefault(dirname, {})
+                node[name] = entry
+            self._tree_binsha = self._store_tree(root)
+        return self._tree_binsha
+
+    @property
+    def has_changes(self):
+        """
+        Does the new commit differ from its parent?
+
+        :return: True if there are changes (or this is the first commit), False otherwise
+        """
+        return self._parent is None or self.tree_binsha != self._parent._commit.tree.binsha
+
+    def commit(self, message, author):
+        """
+        Write the new commit, and move the current branch to it
+
+        :param message: Commit message
+        :param author: `User` who is authoring (and committing) the changes
+        :return: `Commit` object
+        :raise: `git.GitCommandError` if the branch has moved on from the parent commit
+        """
+        git_repo = self._repo._repo
+        actor = Actor(author.full_name, author.email)
+        git_commit = GitCommit.create_from_tree(
+            git_repo,
+            Tree(git_repo, self.tree_binsha, mode=self.TREE_MODE, path=''),
+            message,
+            parent_commits=[] if self._parent is None else [self._parent._commit],
+            author=actor,
+            committer=actor,
+        )
+        self._repo.set_head(
+            git_commit.hexsha,
+            None if self._parent is None else self._parent.sha,
+            message='commit: %s' % message.splitlines()[0] if message else 'commit',
+        )
+        if not git_repo.bare:
+            git_repo.index.reset(git_commit)
+        return Commit(self._repo, git_commit)
+
+
+class RepositoryPool:
+    """
+    Process-wide, thread-safe LRU pool of `Repository` handles, keyed by repository path
+
+    Each open repository can hold several file descriptors (pack file maps and the pipes of
+    persistent ``git cat-file`` processes), so the pool size is bounded by the number of files
+    we are prepared to have open rather than a fixed count. Handles evicted from the pool may
+    still be in use by other threads, so are not closed immediately, but once they are garbage
+    collected. Hit, miss and eviction counts are kept to help with sizing the pool.
+    """
+
+    # Rough upper bound on the file descriptors used by one open repository
+    FILES_PER_REPOSITORY = 8
+
+    def __init__(self):
+        self._handles = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    @property
+    def capacity(self):
+        """
+        Maximum number of repositories to keep open
+
+        Taken from ``settings.REPO_POOL_MAX_OPEN_FILES`` if set, otherwise a quarter of the
+        process's soft limit on open files is allowed for repositories.
+        """
+        max_files = settings.REPO_POOL_MAX_OPEN_FILES
+        if max_files is None:
+            soft, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+            max_files = soft // 4
+        return max(1, max_files // self.FILES_PER_REPOSITORY)
+
+    @staticmethod
+    def _key(path):
+        return os.path.abspath(str(path))
+
+    def get(self, path):
+        """
+        Get the shared `Repository` for the given path, opening it if needed
+
+        :param path: Path of repository directory
+        :return: `Repository` object
+        """
+        key = self._key(path)
+        with self._lock:
+            repo = self._handles.get(key)
+            if repo is not None:
+                self.hits += 1
+                self._handles.move_to_end(key)
+            else:
+                self.misses += 1
+                repo = self._handles[key] = Repository(key)
+                capacity = self.capacity
+                while len(self._handles) > capacity:
+                    self._handles.popitem(last=False)
+                    self.evictions += 1
+        return repo
+
+    def discard(self, path):
+        """
+        Remove the repository at the given path from the pool, closing it
+
+        This should be called when a repository is moved or deleted on disk.
+
+        :param path: Path of repository directory
+        """
+        with self._lock:
+            repo = self._handles.pop(self._key(path), None)
+        if repo is not None:
+            repo.close()
+
+    def clear(self):
+        """
+        Close all pooled repositories and reset the counters
+        """
+        with self._lock:
+            handles = list(self._handles.values())
+            self._handles.clear()
+            self.hits = self.misses = self.evictions = 0
+        for repo in handles:
+            repo.close()
+
+    def __len__(self):
+        return len(self._handles)
+
+    @property
+    def stats(self):
+        """
+        Usage statistics for the pool
+
+        :return: dict with the current size and capacity, and hit, miss and eviction counts
+        """
+        with self._lock:
+            return {
+                'size': len(self._handles),
+                'capacity': self.capacity,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+repository_pool = RepositoryPool()
+
+
+class RefSnapshot:
+    """
+    The branches and tags of a repository, and the commit HEAD points at, read in bulk
+
+    All refs (loose or packed) are listed by a single ``git for-each-ref``, which also peels
+    annotated tags, instead of resolving each tag and its tag object separately.
+    """
+
+    REF_PATHS = ('refs/heads', 'refs/tags')
+
+    def __init__(self, repo, key):
+        """
+        :param repo: `git.Repo` object
+        :param key: the `fingerprint` of the ref files this snapshot is read from
+        """
+        self.key = key
+        self.heads = {}  # branch name -> commit SHA
+        self.tags = {}  # tag name -> SHA of the commit it (eventually) points at
+        peel = []
+
+        output = repo.git.for_each_ref(
+            '--format=%(objectname) %(*objecttype) %(*objectname) %(refname)', *self.REF_PATHS)
+        for line in output.splitlines():
+            sha, peeled_type, peeled_sha, ref_path = line.split(' ', 3)
+            kind, name = ref_path[len('refs/'):].split('/', 1)
+            if kind == 'heads':
+                self.heads[name] = sha
+            elif peeled_type == 'tag':
+                peel.append(name)  # A tag of a tag, which for-each-ref only peels once
+            else:
+                self.tags[name] = peeled_sha or sha
+        for name in peel:
+            self.tags[name] = repo.git.rev_parse('refs/tags/%s^{commit}' % name)
+
+        self.head = None
+        try:
+            with open(os.path.join(repo.git_dir, 'HEAD')) as head_file:
+                head = head_file.read().strip()
+        except FileNotFoundError:
+            return
+        if head.startswith('ref: refs/heads/'):
+            self.head = self.heads.get(head[len('ref: refs/heads/'):])
+        elif not head.startswith('ref: '):
+            self.head = head  # Detached HEAD
+
+    @classmethod
+    def fingerprint(cls, git_dir):
+        """
+        Identify the current state of the files holding HEAD, branches and tags
+
+        Git replaces a ref file by renaming a new file over it, so each update gives the file a
+        new inode even if its mtime does not change.
+
+        :param git_dir: path of the git directory
+        :return: tuple of (path, inode, mtime, size) tuples for each file
+        """
+        paths = [os.path.join(git_dir, 'HEAD'), os.path.join(git_dir, 'packed-refs')]
+        for ref_path in cls.REF_PATHS:
+            for dirpath, dirnames, filenames in os.walk(os.path.join(git_dir, ref_path)):
+                dirnames.sort()
+                paths.extend(os.path.join(dirpath, filename) for filename in sorted(filenames))
+        key = []
+        for path in paths:
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            key.append((path, st.st_ino, st.st_mtime_ns, st.st_size))
+        return tuple(key)
+
+
+class NotesIndex:
+    """
+    The weblab git notes for every commit in a repository, read in bulk
+
+    Each notes ref points at a commit whose tree maps (possibly fanned-out) commit SHAs to note
+    blobs, so we can walk these trees through the object database instead of running
+    ``git notes`` for each commit.
+    """
+
+    REF_BASE = 'refs/notes'
+
+    def __init__(self, repo, tips):
+        """
+        :param repo: `git.Repo` object
+        :param tips: dict mapping notes ref paths to the SHA of the notes commit they point at
+        """
+        self.tips = tips
+        self._notes = {}
+        self._file_lists = {}
+        self._files = {}
+
+        prefix = self.REF_BASE + '/'
+        for ref_path, tip in tips.items():
+            ref = ref_path[len(prefix):]
+            if ref == Commit.NOTE_REF:
+                self._notes = self._read_notes(repo, tip)
+            elif ref == Commit.FILE_LIST_REF:
+                self._file_lists = {
+                    sha: {n for n in note.split('\n') if n}
+                    for sha, note in self._read_notes(repo, tip).items()
+                }
+            elif ref.startswith(Commit.FILE_REF_BASE):
+                name = ref[len(Commit.FILE_REF_BASE):]
+                for sha, blob in self._iter_note_blobs(repo, tip):
+                    self._files.setdefault(sha, {})[name] = blob.binsha
+
+    @staticmethod
+    def _iter_note_blobs(repo, tip):
+        """
+        Iterate over the notes in a notes commit
+
+        :return: iterable of (annotated commit SHA, note `git.Blob`) pairs
+        """
+        for item in repo.commit(tip).tree.traverse():
+            if item.type == 'blob':
+                yield item.path.replace('/', ''), item
+
+    @classmethod
+    def _read_notes(cls, repo, tip):
+        """
+        Read the text of all notes in a notes commit, as ``git notes show`` would
+
+        :return: dict mapping annotated commit SHA to note text
+        """
+        notes = {}
+        for sha, blob in cls._iter_note_blobs(repo, tip):
+            note = blob.data_stream.read().decode()
+            notes[sha] = note[:-1] if note.endswith('\n') else note
+        return notes
+
+    def get_note(self, sha):
+        """
+        :param sha: hex SHA of the annotated commit
+        :return: text of the commit's weblab note, or None if there is none
+        """
+        return self._notes.get(sha)
+
+    def get_file_names(self, sha):
+        """
+        :param sha: hex SHA of the annotated commit
+        :return: set of names of the commit's ephemeral files
+        """
+        return set(self._file_lists.get(sha, ()))
+
+    def get_file_binsha(self, sha, name):
+        """
+        :param sha: hex SHA of the annotated commit
+        :param name: name of the ephemeral file
+        :return: binary SHA of the file contents blob, or None if not found
+        """
+        return self._files.get(sha, {}).get(name)
+
+
 class Commit:
     """
     Wrapper class for `git.Commit`
@@ -235,34 +862,41 @@ class Commit:
         self._repo = repo
         self._commit = commit
 
+    @property
+    def _file_index(self):
+        return self._repo.get_file_index(self._commit)
+
     @cached_property
     def filenames(self):
         """
         All filenames in this commit
 
+        Files in subdirectories are named by their path relative to the repository root.
+
         :return: set of filenames
         """
-        return {blob.name for blob in self._commit.tree.blobs} | self.ephemeral_file_names
+        return self._file_index.keys() | self.ephemeral_file_names
 
     @property
     def files(self):
         """
-        All files in this commit
+        All files in this commit, including those in subdirectories
 
         :return: iterable of `git.Blob` objects
         """
-        return chain(self._commit.tree.blobs, self.ephemeral_files)
+        return chain(self._file_index.values(), self.ephemeral_files)
 
     def get_blob(self, filename):
         """
         Get a file from the commit in blob form
 
-        :param filename: Name of file to retrieve
+        :param filename: Name of file to retrieve, i.e. its path within the commit
         :return: `git.Blob` object or None if file not found
         """
-        for blob in self.files:
-            if blob.name == filename:
-                return blob
+        blob = self._file_index.get(filename)
+        if blob is None and filename in self.ephemeral_file_names:
+            blob = self.get_ephemeral_file(filename)
+        return blob
 
     def write_archive(self):
         """
@@ -270,9 +904,30 @@ class Commit:
 
         :return: file handle to archive
         """
+        return ArchiveWriter(settings.ARCHIVE_COMPRESSION_WORKERS).write(self._archive_file_data())
+
+    def stream_archive(self):
+        """
+        Create a Combine Archive of all files in this commit, without holding it all in memory
+
+        The result is identical to that of `write_archive`.
+
+        :return: iterable of bytes chunks making up the archive
+        """
+        return ArchiveWriter.stream(self._archive_file_data(), settings.ARCHIVE_COMPRESSION_WORKERS)
+
+    def _archive_file_data(self):
+        """
+        Files to include in an archive of this commit, as used by `ArchiveWriter`
+
+        All files are given the commit time as their modification time, so archives of a
+        commit are always the same.
+
+        :return: iterable of (filename, file-like object, datetime) tuples
+        """
         mtime = self.timestamp
-        return ArchiveWriter().write(
-            (blob.name, blob.data_stream, mtime) for blob in self.files
+        return (
+            (blob.path, stream, mtime) for blob, stream in self._repo.read_blobs(self.files)
         )
 
     @property
@@ -305,26 +960,35 @@ class Commit:
     def __eq__(self, other):
         return other._commit == self._commit
 
-    @property
+    @cached_property
     def timestamp(self):
         """
         Datetime representation of commit timestamp
 
+        This is shared between requests (see `repocache.versioncache.get_commit_field`).
+
         :return: `datetime` object
         """
-        return datetime.fromtimestamp(self._commit.committed_date).replace(tzinfo=utc)
+        return versioncache.get_commit_field(
+            self.sha, 'timestamp',
+            lambda: datetime.fromtimestamp(self._commit.committed_date).replace(tzinfo=utc))
 
     @cached_property
     def master_filename(self):
         """
         Get name of master file on this commit, as defined by COMBINE manifest
 
+        This is shared between requests (see `repocache.versioncache.get_commit_field`).
+
         :return: master filename, or None if no master file or no manifest
         """
+        return versioncache.get_commit_field(self.sha, 'master_filename', self._read_master_filename)
+
+    def _read_master_filename(self):
         reader = ManifestReader()
-        for file_ in self.files:
-            if file_.name == MANIFEST_FILENAME:
-                reader.read(file_.data_stream)
+        manifest = self.get_blob(MANIFEST_FILENAME)
+        if manifest is not None:
+            reader.read(manifest.data_stream)
 
         return reader.master_filename
 
@@ -336,6 +1000,7 @@ class Commit:
         """
         cmd = self._repo._repo.git
         cmd.notes('--ref', self.NOTE_REF, 'add', '-f', '-m', note, self.sha)
+        self._repo.invalidate_notes()
 
     def get_note(self):
         """
@@ -343,11 +1008,7 @@ class Commit:
 
         :return: Textual content of the note, or None if there is no note
         """
-        cmd = self._repo._repo.git
-        try:
-            return cmd.notes('--ref', self.NOTE_REF, 'show', self.sha)
-        except GitCommandError:
-            return None
+        return self._repo.notes_index.get_note(self.sha)
 
     def add_ephemeral_file(self, name, content=None, path=None):
         """Add an ephemeral file as a git note.
@@ -377,6 +1038,9 @@ class Commit:
             cmd.notes('--ref', self.FILE_LIST_REF, 'append', '-m', name, self.sha)
             # Add the file as a note
             cmd.notes('--ref', self.FILE_REF_BASE + name, 'add', '-f', '-C', obj_id, self.sha)
+        self._repo.invalidate_notes()
+        # Archives built before this file was added are now out of date
+        archive_cache.discard(self.sha)
         # Clear cached properties so they get recalculated on next access
         del self.ephemeral_file_names
         del self.filenames
@@ -387,25 +1051,16 @@ class Commit:
         :param name: name of file to retrieve
         :return: `git.Blob` object or None if file not found
         """
-        cmd = self._repo._repo.git
-        try:
-            blob_hexsha = cmd.notes('--ref', self.FILE_REF_BASE + name, 'list', self.sha)
-            binsha = binascii.a2b_hex(blob_hexsha)
+        binsha = self._repo.notes_index.get_file_binsha(self.sha, name)
+        if binsha is not None:
             return Blob(self._repo._repo, binsha, path=name)
-        except GitCommandError:
-            return None
 
     def list_ephemeral_files(self):
         """Get the names of any ephemeral files associated with this commit.
 
         :return: set of file names
         """
-        cmd = self._repo._repo.git
-        try:
-            names_note = cmd.notes('--ref', self.FILE_LIST_REF, 'show', self.sha)
-            return {n for n in names_note.split('\n') if n}
-        except GitCommandError:
-            return set()
+        return self._repo.notes_index.get_file_names(self.sha)
 
     @property
     def ephemeral_files(self):
@@ -135,14 +135,7 @@ def _url_friendly_label(entity, version):
     :param entity: Entity the commit belongs to
     :param version: CachedEntityVersion object
     """
-    tags = version.tags.last()
-    if tags is not None:
-        tag = tags.tag
-        if tag is None or tag in ['new', 'latest']:
-            return version.sha
-        else:
-            return tag
-    return version.sha
+    return version.get_url_label()
 
 
 @register.filter
@@ -0,0 +1,151 @@
+import os
+import stat
+import zipfile
+
+import pytest
+
+from accounts.models import User
+from core.files import DEFAULT_FILE_MODE
+from entities.archive_cache import ArchiveCache
+from entities.repository import Repository
+
+
+@pytest.fixture
+def repo(tmpdir):
+    repo = Repository(str(tmpdir.join('repo')))
+    repo.create()
+    yield repo
+    repo.close()
+
+
+def make_commit(repo, contents):
+    path = repo.full_path('file.txt')
+    with open(path, 'w') as f:
+        f.write(contents)
+    repo.add_file(path)
+    return repo.commit('commit', User(full_name='Commit Author', email='author@example.com'))
+
+
+@pytest.fixture
+def cache():
+    return ArchiveCache()
+
+
+class TestArchiveCache:
+    def test_builds_and_reuses_archive(self, repo, cache):
+        commit = make_commit(repo, 'contents')
+
+        with cache.open(commit) as archive:
+            assert archive.read() == commit.write_archive().read()
+        path = cache.path_for(commit)
+        assert path.exists()
+        assert path.name.startswith(commit.sha)
+        assert stat.S_IMODE(path.stat().st_mode) == DEFAULT_FILE_MODE
+
+        # Serve the cached file rather than rebuilding it
+        with path.open('wb') as f:
+            f.write(b'cached')
+        with cache.open(commit) as archive:
+            assert archive.read() == b'cached'
+
+    def test_disabled(self, repo, cache, settings):
+        settings.ARCHIVE_CACHE_MAX_SIZE = 0
+        commit = make_commit(repo, 'contents')
+
+        assert cache.open(commit) is None
+        assert cache.entries() == []
+
+    def test_adding_ephemeral_file_invalidates(self, repo, cache):
+        commit = make_commit(repo, 'contents')
+        cache.open(commit).close()
+        old_path = cache.path_for(commit)
+
+        commit.add_ephemeral_file('errors.txt', b'error')
+
+        assert not old_path.exists()
+        assert cache.path_for(commit) != old_path
+        with cache.open(commit) as archive:
+            assert zipfile.ZipFile(archive).namelist() == ['file.txt', 'errors.txt']
+
+    def test_key_depends_on_ephemeral_file_contents(self, repo, cache):
+        commit = make_commit(repo, 'contents')
+        key = cache.ephemeral_digest(commit)
+        commit.add_ephemeral_file('readme.md', b'readme')
+        assert cache.ephemeral_digest(commit) != key
+
+    def test_evicts_least_recently_used(self, repo, cache, settings):
+        commits = [make_commit(repo, 'contents %d' % i) for i in range(3)]
+        for i, commit in enumerate(commits):
+            cache.open(commit).close()
+            os.utime(str(cache.path_for(commit)), (i, i))
+        size = cache.path_for(commits[0]).stat().st_size
+
+        # Using the first archive makes the second the least recently used
+        cache.open(commits[0]).close()
+        settings.ARCHIVE_CACHE_MAX_SIZE = 2 * size + 1
+        cache.evict()
+
+        assert [path for _, _, path in cache.entries()] == [
+            cache.path_for(commits[2]), cache.path_for(commits[0])
+        ]
+
+    def test_oversized_archive_is_still_served(self, repo, cache, settings):
+        settings.ARCHIVE_CACHE_MAX_SIZE = 1
+        commit = make_commit(repo, 'contents')
+
+        with cache.open(commit) as archive:
+            assert archive.read() == commit.write_archive().read()
+        assert cache.entries() == []
+
+    def test_streams_archive_while_caching(self, repo, cache):
+        commit = make_commit(repo, 'contents')
+        path = cache.path_for(commit)
+        assert cache.open(commit, build=False) is None
+
+        chunks = cache.stream(commit)
+        data = next(chunks)
+        assert not path.exists()
+        data += b''.join(chunks)
+
+        assert data == commit.write_archive().read()
+        with cache.open(commit, build=False) as archive:
+            assert archive.read() == data
+
+    def test_abandoned_stream_is_not_cached(self, repo, cache):
+        commit = make_commit(repo, 'contents')
+        chunks = cache.stream(commit)
+        next(chunks)
+        chunks.close()
+
+        assert list(cache.path_for(commit).parent.iterdir()) == []
+
+    def test_stream_without_cache(self, repo, cache, settings):
+        settings.ARCHIVE_CACHE_MAX_SIZE = 0
+        commit = make_commit(repo, 'contents')
+
+        assert b''.join(cache.stream(commit)) == commit.write_archive().read()
+        assert cache.entries() == []
+
+    def test_keeps_running_total_of_size(self, repo, cache, settings, monkeypatch):
+        commits = [make_commit(repo, 'contents %d' % i) for i in range(4)]
+        scans = []
+        entries = cache.entries
+        monkeypatch.setattr(cache, 'entries', lambda: scans.append(1) or entries())
+
+        # The cache is only listed to count its size at first
+        for commit in commits[:3]:
+            cache.open(commit).close()
+        assert len(scans) == 1
+        size = cache.path_for(commits[0]).stat().st_size
+
+        # ...and once the running total goes over the limit
+        settings.ARCHIVE_CACHE_MAX_SIZE = 3 * size + 1
+        cache.open(commits[3]).close()
+        assert len(scans) == 2
+        assert len(entries()) == 3
+
+        # ...or is out of date
+        cache.discard(commits[3].sha)
+        monkeypatch.setattr(ArchiveCache, 'RECOUNT_INTERVAL', 0)
+        cache.open(commits[3]).close()
+        assert len(scans) == 3
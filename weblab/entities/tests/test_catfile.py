@@ -0,0 +1,169 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from gitdb.exc import BadObject
+
+from accounts.models import User
+from entities.catfile import BatchStream, CatFile
+from entities.repository import Repository
+
+
+@pytest.fixture
+def repo(tmpdir):
+    repo = Repository(tmpdir)
+    repo.create()
+    for i in range(5):
+        path = str(tmpdir.join('file%d.txt' % i))
+        with open(path, 'w') as f:
+            f.write('contents %d' % i)
+        repo.add_file(path)
+    repo.commit('commit', User(full_name='Commit Author', email='author@example.com'))
+    yield repo
+    repo.close()
+
+
+@pytest.fixture
+def blobs(repo):
+    return sorted(repo.latest_commit.files, key=lambda blob: blob.name)
+
+
+@pytest.fixture
+def cat_file(repo):
+    cat_file = CatFile(repo._repo.git_dir)
+    yield cat_file
+    cat_file.close()
+
+
+class TestCatFile:
+    def test_info(self, cat_file, blobs):
+        assert cat_file.info(blobs[0].hexsha) == (blobs[0].hexsha, b'blob', len('contents 0'))
+
+    def test_read(self, cat_file, blobs):
+        assert cat_file.read(blobs[1].hexsha) == (blobs[1].hexsha, b'blob', 10, b'contents 1')
+
+    def test_read_many(self, cat_file, blobs):
+        cat_file.BATCH_SIZE = 2
+        data = [stream.read() for (_, _, _, stream) in cat_file.read_many(b.hexsha for b in blobs)]
+        assert data == [('contents %d' % i).encode() for i in range(5)]
+
+    def test_large_objects_streamed(self, cat_file, repo, blobs):
+        cat_file.STREAM_SIZE = 10
+        tree = repo.latest_commit._commit.tree
+        results = list(cat_file.read_many([blobs[0].hexsha, tree.hexsha, blobs[1].hexsha]))
+        assert [(type_, isinstance(stream, BatchStream)) for (_, type_, _, stream) in results] == [
+            (b'blob', False), (b'tree', True), (b'blob', False),
+        ]
+        assert [stream.read() for (_, _, _, stream) in results] == [
+            b'contents 0', tree.data_stream.read(), b'contents 1',
+        ]
+
+        _, type_, size, stream = cat_file.open(blobs[0].hexsha)
+        assert not isinstance(stream, BatchStream)
+        assert stream.read() == b'contents 0'
+
+        cat_file.STREAM_SIZE = 9
+        _, type_, size, stream = cat_file.open(blobs[0].hexsha)
+        with stream:
+            assert (type_, size) == (b'blob', 10)
+            assert stream.read(4) == b'cont'
+            assert stream.read() == b'ents 0'
+            assert stream.read() == b''
+
+    def test_streams_from_batch_process(self, cat_file, blobs):
+        cat_file.STREAM_SIZE = 9
+        cat_file.read(blobs[0].hexsha)
+        proc = cat_file._procs[CatFile.BATCH]
+
+        # The stream reads from the batch process, and hands it back once finished with
+        _, _, _, stream = cat_file.open(blobs[1].hexsha)
+        assert CatFile.BATCH not in cat_file._procs
+        assert cat_file.read(blobs[2].hexsha)[3] == b'contents 2'  # Uses a new process
+        assert stream.read() == b'contents 1'
+        assert cat_file._procs[CatFile.BATCH] is not proc
+        assert proc.poll() is not None
+
+        _, _, _, stream = cat_file.open(blobs[3].hexsha)
+        proc = stream._proc
+        assert stream.read() == b'contents 3'
+        assert cat_file._procs[CatFile.BATCH] is proc
+        assert cat_file.read(blobs[4].hexsha)[3] == b'contents 4'
+
+    def test_large_object_in_batch(self, cat_file, blobs):
+        cat_file.STREAM_SIZE = 9
+        hexshas = [blob.hexsha for blob in blobs]
+        results = cat_file.read_many(hexshas)
+        _, _, _, stream = next(results)
+        # The process has more responses to give, so can't be reused
+        proc = stream._proc
+        assert stream.read() == b'contents 0'
+        assert proc.poll() is not None
+        assert [stream.read() for (_, _, _, stream) in results] == [
+            ('contents %d' % i).encode() for i in range(1, 5)
+        ]
+
+    def test_missing_object(self, cat_file, blobs):
+        with pytest.raises(BadObject):
+            cat_file.read('0' * 40)
+        with pytest.raises(BadObject):
+            list(cat_file.read_many([blobs[0].hexsha, '0' * 40, blobs[1].hexsha]))
+
+        # The reader is still usable afterwards
+        assert cat_file.read(blobs[2].hexsha)[3] == b'contents 2'
+        assert cat_file.info(blobs[2].hexsha)[1] == b'blob'
+
+    def test_threads(self, cat_file, blobs):
+        def read(i):
+            return cat_file.read(blobs[i % 5].hexsha)[3]
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(read, range(100)))
+        assert results == [('contents %d' % (i % 5)).encode() for i in range(100)]
+
+    def test_close_and_reuse(self, cat_file, blobs):
+        cat_file.read(blobs[0].hexsha)
+        cat_file.close()
+        assert cat_file.read(blobs[0].hexsha)[3] == b'contents 0'
+
+
+class TestCatFileObjectDB:
+    def test_repository_reads_use_cat_file(self, repo, blobs):
+        assert repo._repo.odb.stream(blobs[3].binsha).read() == b'contents 3'
+        assert blobs[3].data_stream.read() == b'contents 3'
+        assert blobs[3].size == 10
+
+    def test_large_objects_streamed(self, repo, blobs, monkeypatch):
+        monkeypatch.setattr(CatFile, 'STREAM_SIZE', 4)
+        stream = repo._repo.odb.stream(blobs[3].binsha)
+        assert isinstance(stream.stream, BatchStream)
+        assert stream.read() == b'contents 3'
+        assert [stream.read() for _, stream in repo.read_blobs(blobs)] == [
+            ('contents %d' % i).encode() for i in range(5)
+        ]
+
+    def test_read_blobs(self, repo, blobs):
+        assert [
+            (blob.name, stream.read()) for blob, stream in repo.read_blobs(blobs)
+        ] == [
+            ('file%d.txt' % i, ('contents %d' % i).encode()) for i in range(5)
+        ]
+
+    def test_open_blob(self, repo, blobs, monkeypatch):
+        with repo.open_blob(blobs[0]) as stream:
+            assert stream.seekable()
+            assert stream.read() == b'contents 0'
+
+        monkeypatch.setattr(CatFile, 'STREAM_SIZE', 4)
+        with repo.open_blob(blobs[1]) as stream:
+            assert not stream.seekable()
+            assert stream.read(4) == b'cont'
+            assert stream.read() == b'ents 1'
+
+    def test_close_stream_early(self, cat_file, blobs):
+        cat_file.STREAM_SIZE = 9
+        _, _, _, stream = cat_file.open(blobs[2].hexsha)
+        proc = stream._proc
+        assert stream.read(1) == b'c'
+        stream.close()
+        assert stream.closed
+        assert proc.poll() is not None
+        assert cat_file.read(blobs[2].hexsha)[3] == b'contents 2'
@@ -1,9 +1,12 @@
+from io import StringIO
 from unittest.mock import call, patch
 
 import pytest
+from django.core.management import call_command
 
 from core import recipes
 from entities.management.commands.analyse_entity_versions import Command as AnalyseCommand
+from entities.management.commands.maintain_repositories import maintain_repository
 
 
 @pytest.mark.django_db
@@ -40,3 +43,40 @@ def test_analyse_all_entities(mock_base_analyse, mock_proto_analyse, helpers):
     assert mock_proto_analyse.call_count == 2
     mock_base_analyse.assert_has_calls([call(m1, c1)])
     mock_proto_analyse.assert_has_calls([call(p1, c4), call(p1, c3)])
+
+
+@pytest.mark.django_db
+def test_maintain_repository(helpers):
+    model = recipes.model.make()
+    for i in range(3):
+        helpers.add_version(model, filename='file%d.txt' % i, cache=False)
+    path = str(model.repo_abs_path)
+
+    result = maintain_repository(path, 10, 'now')
+    assert result['skipped']
+    assert result['loose_objects'] == 7  # 3 commits, 3 trees and 1 blob
+
+    result = maintain_repository(path, 0, 'now')
+    assert not result['skipped']
+    assert result['error'] is None
+    assert result['size_before'] > 0
+    assert result['size_after'] > 0
+    assert (model.repo_abs_path / '.git/objects/info/commit-graph').exists()
+    assert maintain_repository(path, 0, 'now')['loose_objects'] == 0
+    assert len(list(model.repo.commits)) == 3
+
+
+@pytest.mark.django_db
+def test_maintain_repositories_command(helpers):
+    model, other_model = recipes.model.make(_quantity=2)
+    helpers.add_version(model, cache=False)
+    helpers.add_version(other_model, cache=False)
+    recipes.model.make()  # No repository
+
+    out = StringIO()
+    call_command('maintain_repositories', model.pk, '--jobs=1', '--min-loose-objects=1', stdout=out)
+    output = out.getvalue()
+
+    assert 'model %s: 3 loose objects, maintained in' % model.name in output
+    assert other_model.name not in output
+    assert 'Maintained 1 of 1 repositories' in output
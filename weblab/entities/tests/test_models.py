@@ -206,6 +206,15 @@ class TestEntity:
 
         assert model.get_tags(sha) == {'mytag'}
 
+    def test_add_ephemeral_file(self, model_with_version):
+        commit = model_with_version.repo.latest_commit
+        model_with_version.add_ephemeral_file(commit, 'errors.txt', b'oops')
+
+        assert commit.get_blob('errors.txt').data_stream.read() == b'oops'
+        cached_file = model_with_version.repocache.get_version(commit.sha).files.get(name='errors.txt')
+        assert cached_file.ephemeral
+        assert cached_file.size == 4
+
     def test_entity_repo_is_deleted_when_entity_is_deleted(self, model_with_version):
         repo_path = model_with_version.repo_abs_path
         assert repo_path.exists()
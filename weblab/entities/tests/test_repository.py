@@ -1,13 +1,15 @@
+import gc
 import os.path
 import xml.etree.ElementTree as ET
 import zipfile
+from io import BytesIO
 from pathlib import Path
 
 import pytest
 from git import GitCommandError
 
 from accounts.models import User
-from entities.repository import Repository
+from entities.repository import CommitBuilder, Repository, RepositoryPool
 
 
 @pytest.fixture
@@ -118,6 +120,50 @@ class TestRepository:
         assert repo.get_commit('latest') == commit
         assert next(repo.commits) == commit
 
+    def test_get_commit_by_tag(self, repo, repo_file, author):
+        repo.add_file(repo_file)
+        commit = repo.commit('commit 1', author)
+        repo.tag('v1')
+        repo._repo.create_tag('annotated', message='an annotated tag')
+        repo._repo.create_tag('nested', ref='annotated', message='a tag of a tag')
+
+        assert repo.get_commit('v1') == commit
+        assert repo.get_commit('annotated') == commit
+        assert repo.get_commit('nested') == commit
+        assert [tag.name for tag in repo.tag_dict[commit.sha]] == ['annotated', 'nested', 'v1']
+
+    def test_ref_snapshot(self, repo, repo_file, author):
+        repo.create()
+        snapshot = repo.ref_snapshot
+        assert snapshot.head is None
+        assert snapshot.tags == {}
+        assert repo.ref_snapshot is snapshot
+
+        repo.add_file(repo_file)
+        commit = repo.commit('commit 1', author)
+        repo.tag('v1')
+        snapshot = repo.ref_snapshot
+        assert snapshot.head == commit.sha
+        assert snapshot.heads == {'master': commit.sha}
+        assert snapshot.tags == {'v1': commit.sha}
+        assert repo.ref_snapshot is snapshot
+
+    def test_ref_snapshot_sees_external_changes(self, repo, repo_file, author):
+        repo.add_file(repo_file)
+        commit = repo.commit('commit 1', author)
+        assert repo.ref_snapshot.tags == {}
+
+        # Change refs behind the repository's back, including packing them
+        repo._repo.git.tag('v1')
+        assert repo.ref_snapshot.tags == {'v1': commit.sha}
+        repo._repo.git.pack_refs('--all')
+        assert repo.ref_snapshot.tags == {'v1': commit.sha}
+        assert repo.ref_snapshot.head == commit.sha
+        repo._repo.git.checkout('--detach')
+        assert repo.ref_snapshot.head == commit.sha
+        repo._repo.git.commit('--allow-empty', '-m', 'commit 2')
+        assert repo.latest_commit.message.strip() == 'commit 2'
+
     def test_generate_manifest(self, repo, repo_file, author):
         repo.add_file(repo_file)
 
@@ -139,6 +185,177 @@ class TestRepository:
         assert commit.master_filename == 'file.cellml'
 
 
+class TestRepositoryPool:
+    @pytest.fixture
+    def pool(self, settings):
+        settings.REPO_POOL_MAX_OPEN_FILES = 2 * RepositoryPool.FILES_PER_REPOSITORY
+        return RepositoryPool()
+
+    def test_get_shares_handles(self, pool, tmpdir):
+        repo = pool.get(tmpdir)
+        assert pool.get(Path(str(tmpdir))) is repo
+        assert pool.stats == {'size': 1, 'capacity': 2, 'hits': 1, 'misses': 1, 'evictions': 0}
+
+    def test_evicts_least_recently_used(self, pool, tmpdir):
+        paths = [tmpdir.mkdir(name) for name in 'abc']
+        for path in paths:
+            Repository(path).create()
+        repo_a = pool.get(paths[0])
+        assert repo_a._repo is not None
+        pool.get(paths[1])
+        pool.get(paths[0])
+        pool.get(paths[2])
+
+        assert len(pool) == 2
+        assert pool.stats['evictions'] == 1
+        assert pool.get(paths[0]) is repo_a  # b was evicted rather than a
+        assert pool.stats['misses'] == 3
+
+        pool.get(paths[1])
+        pool.get(paths[2])
+        assert pool.stats['evictions'] == 3
+        assert '_repo' in repo_a.__dict__  # Evicted handles are left open for any current users
+
+    def test_evicted_handle_closed_once_unused(self, pool, tmpdir, author):
+        paths = [tmpdir.mkdir(name) for name in 'abc']
+        repo_a = pool.get(paths[0])
+        repo_a.create()
+        path = paths[0].join('file.txt')
+        path.write('contents')
+        repo_a.add_file(str(path))
+        sha = repo_a.commit('commit 1', author).sha
+        assert repo_a.get_commit(sha).get_blob('file.txt').data_stream.read() == b'contents'
+        cat_file = repo_a._repo.odb.cat_file
+        procs = list(cat_file._procs.values())
+        assert procs
+
+        # Evicting the handle while it is in use doesn't stop it working
+        pool.get(paths[1])
+        pool.get(paths[2])
+        assert pool.stats['evictions'] == 1
+        assert repo_a.get_commit(sha).get_blob('file.txt').data_stream.read() == b'contents'
+        assert all(proc.poll() is None for proc in procs)
+
+        # It is closed once no longer referenced
+        del repo_a
+        gc.collect()
+        assert not cat_file._procs
+        assert all(proc.poll() is not None for proc in procs)
+
+    def test_discard(self, pool, tmpdir):
+        repo = pool.get(tmpdir)
+        pool.discard(tmpdir)
+        assert len(pool) == 0
+        assert pool.get(tmpdir) is not repo
+
+    def test_delete_removes_from_pool(self, tmpdir):
+        from entities.repository import repository_pool
+        repo = repository_pool.get(tmpdir)
+        repo.create()
+        repo.delete()
+        assert repository_pool.get(tmpdir) is not repo
+
+    def test_clear(self, pool, tmpdir):
+        pool.get(tmpdir)
+        pool.clear()
+        assert pool.stats == {'size': 0, 'capacity': 2, 'hits': 0, 'misses': 0, 'evictions': 0}
+
+
+class TestCommitBuilder:
+    def test_first_commit(self, repo, repo_file, author):
+        builder = CommitBuilder(repo)
+        builder.add_file('file.cellml', path=str(repo_file))
+        builder.add_file('sub/dir/other.txt', content=b'other contents')
+        builder.generate_manifest(master_filename='file.cellml')
+        assert builder.has_changes
+        commit = builder.commit('commit 1', author)
+
+        assert repo.latest_commit == commit
+        assert commit.message == 'commit 1'
+        assert commit.author.email == 'author@example.com'
+        assert list(commit.parents) == []
+        assert commit.filenames == {'file.cellml', 'manifest.xml', 'sub/dir/other.txt'}
+        assert commit.get_blob('sub/dir/other.txt').data_stream.read() == b'other contents'
+        assert commit.master_filename == 'file.cellml'
+
+        # The index follows the new commit, the working tree is untouched, and the objects are
+        # well formed
+        assert {path for (path, _) in repo._repo.index.entries} == commit.filenames
+        assert not os.path.exists(repo.full_path('sub'))
+        repo._repo.git.fsck('--strict')
+
+        # So later commits made through the index keep the files
+        repo.add_file(repo_file)
+        assert repo.commit('commit 2', author).filenames == commit.filenames
+
+    def test_trees_match_git(self, repo):
+        repo.create()
+        builder = CommitBuilder(repo)
+        for name in ['a0.txt', 'a/b.txt', 'a-b.txt', 'a.txt', 'b/c/d.txt']:
+            path = repo.full_path(name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w') as f:
+                f.write(name)
+            repo.add_file(path)
+            builder.add_file(name, content=name.encode())
+
+        assert builder.tree_binsha == repo._repo.index.write_tree().binsha
+
+    def test_name_clashes(self, repo):
+        repo.create()
+        builder = CommitBuilder(repo)
+        builder.add_file('a/b.txt', content=b'')
+        with pytest.raises(ValueError):
+            builder.add_file('a', content=b'')
+        with pytest.raises(ValueError):
+            builder.add_file('a/b.txt/c', content=b'')
+
+    def test_changes_from_parent(self, repo, repo_file, author):
+        repo.add_file(repo_file)
+        repo.generate_manifest()
+        parent = repo.commit('commit 1', author)
+
+        builder = CommitBuilder(repo, parent)
+        assert builder.filenames == {'file.cellml', 'manifest.xml'}
+        builder.add_file('file.cellml', content=b'file contents')
+        assert not builder.has_changes
+
+        builder.add_file('new.txt', content=b'new')
+        builder.remove_file('file.cellml')
+        with pytest.raises(ValueError):
+            builder.remove_file('file.cellml')
+        builder.generate_manifest()
+        assert builder.has_changes
+        commit = builder.commit('commit 2', author)
+
+        assert list(commit.parents) == [parent]
+        assert commit.filenames == {'new.txt', 'manifest.xml'}
+        reader = ET.parse(commit.get_blob('manifest.xml').data_stream).getroot()
+        assert [e.attrib['location'] for e in reader] == ['manifest.xml', 'new.txt']
+
+    @pytest.mark.parametrize('name', ['', '/abs', 'a//b', '../up', 'a/./b', '.git/config'])
+    def test_invalid_names(self, repo, name):
+        with pytest.raises(ValueError):
+            CommitBuilder(repo).add_file(name, content=b'')
+
+    def test_fails_if_branch_has_moved(self, repo, repo_file, author):
+        repo.add_file(repo_file)
+        parent = repo.commit('commit 1', author)
+        builder = CommitBuilder(repo, parent)
+        builder.add_file('new.txt', content=b'new')
+
+        other = CommitBuilder(repo, parent)
+        other.add_file('other.txt', content=b'other')
+        other_commit = other.commit('commit 2', author)
+
+        with pytest.raises(GitCommandError):
+            builder.commit('commit 3', author)
+        assert repo.latest_commit == other_commit
+
+        with pytest.raises(GitCommandError):
+            CommitBuilder(repo).commit('another first commit', author)
+
+
 class TestCommit:
     def test_files(self, repo, repo_file, author):
         repo.add_file(repo_file)
@@ -149,6 +366,47 @@ class TestCommit:
         assert commit.get_blob('file.cellml').data_stream.read().decode() == 'file contents'
         assert commit.get_blob('nonexistent.cellml') is None
 
+    def test_files_in_subdirectories(self, repo, repo_file, author):
+        os.mkdir(repo.full_path('sub'))
+        sub_file = repo.full_path('sub/other.txt')
+        with open(sub_file, 'w') as f:
+            f.write('other contents')
+        repo.add_file(repo_file)
+        repo.add_file(sub_file)
+        repo.generate_manifest()
+        commit = repo.commit('commit 1', author)
+        commit.add_ephemeral_file('errors.txt', b'error')
+
+        assert commit.filenames == {'file.cellml', 'manifest.xml', 'sub/other.txt', 'errors.txt'}
+        assert [blob.path for blob in commit.files] == [
+            'file.cellml', 'manifest.xml', 'sub/other.txt', 'errors.txt']
+        assert commit.get_blob('sub/other.txt').data_stream.read() == b'other contents'
+        assert commit.get_blob('other.txt') is None
+        assert commit.get_blob('errors.txt').data_stream.read() == b'error'
+
+        zf = zipfile.ZipFile(commit.write_archive())
+        assert zf.namelist() == ['file.cellml', 'manifest.xml', 'sub/other.txt', 'errors.txt']
+        assert zf.open('sub/other.txt').read() == b'other contents'
+
+    def test_file_index_is_cached_by_sha(self, repo, repo_file, author, monkeypatch):
+        monkeypatch.setattr(Repository, 'FILE_INDEX_CACHE_SIZE', 2)
+        commits = []
+        for i in range(3):
+            with repo_file.open('w') as f:
+                f.write('contents %d' % i)
+            repo.add_file(repo_file)
+            commits.append(repo.commit('commit %d' % i, author))
+
+        index = repo.get_file_index(commits[0]._commit)
+        assert repo.get_commit(commits[0].sha)._file_index is index
+        assert repo.get_file_index(commits[1]._commit) is not index
+
+        # Only the most recently used indexes are kept
+        repo.get_file_index(commits[0]._commit)
+        repo.get_file_index(commits[2]._commit)
+        assert repo.get_file_index(commits[0]._commit) is index
+        assert list(repo._file_indexes) == [commits[2]._commit.binsha, commits[0]._commit.binsha]
+
     def test_write_archive(self, repo, repo_file, author):
         repo.add_file(repo_file)
         repo.generate_manifest()
@@ -157,6 +415,18 @@ class TestCommit:
         archive = repo.get_commit('latest').write_archive()
         assert zipfile.ZipFile(archive).namelist() == ['file.cellml', 'manifest.xml']
 
+    def test_stream_archive(self, repo, repo_file, author):
+        repo.add_file(repo_file)
+        repo.generate_manifest()
+        commit = repo.commit('commit 1', author)
+
+        archive = b''.join(commit.stream_archive())
+        assert archive == commit.write_archive().read()
+        zf = zipfile.ZipFile(BytesIO(archive))
+        assert zf.namelist() == ['file.cellml', 'manifest.xml']
+        # Zip files store times to the nearest 2 seconds
+        assert zf.getinfo('file.cellml').date_time[:5] == commit.timestamp.timetuple()[:5]
+
     def test_write_archive_for_old_version(self, repo, repo_file, author):
         # Initial commit
         repo.add_file(repo_file)
@@ -193,6 +463,32 @@ class TestCommit:
         commit.add_note('Visibility: private')
         assert commit.get_note() == 'Visibility: private'
 
+    def test_notes_index(self, repo, repo_file, author):
+        repo.add_file(repo_file)
+        commit1 = repo.commit('commit 1', author)
+        commit2 = repo.commit('commit 2', author)
+        commit1.add_note('Visibility: public')
+        commit2.add_ephemeral_file('readme.md', b'readme content')
+
+        index = repo.notes_index
+        assert repo.notes_index is index  # No notes have changed
+        assert index.get_note(commit1.sha) == 'Visibility: public'
+        assert index.get_note(commit2.sha) is None
+        assert index.get_file_names(commit1.sha) == set()
+        assert index.get_file_names(commit2.sha) == {'readme.md'}
+        assert index.get_file_binsha(commit2.sha, 'readme.md') == commit2.get_ephemeral_file('readme.md').binsha
+        assert index.get_file_binsha(commit1.sha, 'readme.md') is None
+
+        # Writing notes through the wrapper invalidates the index
+        commit2.add_note('Visibility: private')
+        assert repo.notes_index is not index
+        assert repo.notes_index.get_note(commit2.sha) == 'Visibility: private'
+
+    def test_notes_index_sees_external_changes(self, commit):
+        assert commit.get_note() is None
+        commit._repo._repo.git.notes('--ref', commit.NOTE_REF, 'add', '-m', 'Visibility: public', commit.sha)
+        assert commit.get_note() == 'Visibility: public'
+
     def test_properties(self, repo, repo_file, author):
         repo.add_file(repo_file)
         commit = repo.commit('commit 1', author)
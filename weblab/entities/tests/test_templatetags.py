@@ -126,6 +126,7 @@ def test_url_friendly_label(model_with_version, helpers):
 
     model_with_version.repo.tag('v1')
     populate_entity_cache(model_with_version)
+    version.refresh_from_db()  # The label is stored in the version
 
     assert entity_tags._url_friendly_label(model_with_version, version) == 'v1'
 
@@ -18,6 +18,7 @@ from git import GitCommandError
 from guardian.shortcuts import assign_perm
 
 from core import recipes
+from entities.catfile import CatFile
 from entities.models import (
     AnalysisTask,
     ModelEntity,
@@ -466,7 +467,9 @@ class TestEntityVersionJsonView:
         cached_version.parsed_ok = is_parsed_ok
         cached_version.save()
 
-        response = client.get('/entities/models/%d/versions/latest/files.json' % model.pk)
+        # The details all come from the repocache
+        with patch('entities.repository.Repository.get_commit', side_effect=AssertionError):
+            response = client.get('/entities/models/%d/versions/latest/files.json' % model.pk)
 
         assert response.status_code == 200
 
@@ -1583,7 +1586,7 @@ class TestVersionCreation:
         assert latest.message == 'delete file1'
         assert len(list(latest.files)) == 2
         assert 'file2.txt' in latest.filenames
-        assert not (model.repo_abs_path / 'file1.txt').exists()
+        assert 'file1.txt' not in latest.filenames
 
         assert 0 == PlannedExperiment.objects.count()
         assert 0 == model.files.count()
@@ -1614,8 +1617,8 @@ class TestVersionCreation:
         assert latest.message == 'delete files'
         assert len(list(latest.files)) == 2
         assert 'file3.txt' in latest.filenames
-        assert not (model.repo_abs_path / 'file1.txt').exists()
-        assert not (model.repo_abs_path / 'file2.txt').exists()
+        assert 'file1.txt' not in latest.filenames
+        assert 'file2.txt' not in latest.filenames
 
         assert 0 == PlannedExperiment.objects.count()
         assert 0 == model.files.count()
@@ -1658,8 +1661,7 @@ class TestVersionCreation:
         assert latest.message == 'replace file1'
         assert len(list(latest.files)) == 3
         assert {'manifest.xml', 'file1.txt', 'file2.txt'} == latest.filenames
-        with (model.repo_abs_path / 'file1.txt').open() as f:
-            assert f.read() == 'file 1 new'
+        assert latest.get_blob('file1.txt').data_stream.read() == b'file 1 new'
 
         assert 0 == PlannedExperiment.objects.count()
         assert 0 == model.files.count()
@@ -2258,7 +2260,7 @@ class TestAlterFileView:
         model = recipes.model.make(author=logged_in_user)
         first_commit = helpers.add_version(model, tag_name='v1', contents='initial file 1')
 
-        with patch('entities.repository.Repository.add_file', side_effect=GitCommandError('add', 1, 'error')):
+        with patch('entities.repository.CommitBuilder.add_file', side_effect=OSError('error')):
             response = client.post('/entities/models/%d/versions/edit' % model.id, json.dumps({
                 'parent_hexsha': first_commit.sha,
                 'file_name': 'file1.txt',
@@ -2270,8 +2272,7 @@ class TestAlterFileView:
             }), content_type='application/json')
         assert response.status_code == 200
         assert model.repo.latest_commit == first_commit
-        with (model.repo_abs_path / 'file1.txt').open() as f:
-            assert f.read() == 'initial file 1'
+        assert model.repo.latest_commit.get_blob('file1.txt').data_stream.read() == b'initial file 1'
         detail = json.loads(response.content.decode())['updateEntityFile']
         assert not detail['response']
         assert 'failed to add new file version' in detail['responseText']
@@ -2292,8 +2293,7 @@ class TestAlterFileView:
         }), content_type='application/json')
         assert response.status_code == 200
         assert model.repo.latest_commit == first_commit
-        with (model.repo_abs_path / 'file1.txt').open() as f:
-            assert f.read() == 'initial file 1'
+        assert model.repo.latest_commit.get_blob('file1.txt').data_stream.read() == b'initial file 1'
         detail = json.loads(response.content.decode())['updateEntityFile']
         assert not detail['response']
         assert 'failed to tag' in detail['responseText']
@@ -2315,8 +2315,8 @@ class TestAlterFileView:
         assert response.status_code == 200
         new_commit = model.repo.latest_commit
         assert new_commit != first_commit
-        with (model.repo_abs_path / 'file1.txt').open() as f:
-            assert f.read() == 'new file 1'
+        assert new_commit.get_blob('file1.txt').data_stream.read() == b'new file 1'
+        assert new_commit.parents
         detail = json.loads(response.content.decode())['updateEntityFile']
         assert detail['response']
         assert detail['url'] == '/entities/models/%d/versions/%s' % (
@@ -2611,11 +2611,80 @@ class TestEntityFileDownloadView:
         )
 
         assert response.status_code == 200
-        assert response.content == b'entity contents'
+        assert response.getvalue() == b'entity contents'
         assert response['Content-Disposition'] == (
             'attachment; filename=file1.txt'
         )
         assert response['Content-Type'] == 'text/plain'
+        assert response['ETag'] == '"%s"' % version.get_blob('file1.txt').hexsha
+        assert response['Cache-Control'] == 'max-age=31536000, s-maxage=300, immutable'
+
+    def test_download_file_by_tag_must_be_revalidated(self, client, public_model):
+        response = client.get(
+            '/entities/models/%d/versions/latest/download/file1.txt' % public_model.pk
+        )
+
+        assert response.status_code == 200
+        assert response['Cache-Control'] == 'no-cache'
+
+    def test_private_file_is_not_publicly_cached(self, client, logged_in_user, helpers):
+        model = recipes.model.make(author=logged_in_user)
+        version = helpers.add_version(model, visibility='private')
+
+        response = client.get(
+            '/entities/models/%d/versions/%s/download/file1.txt' % (model.pk, version.sha)
+        )
+
+        assert response.status_code == 200
+        assert response['Cache-Control'] == 'private, max-age=31536000, immutable'
+
+    def test_not_modified(self, client, public_model):
+        version = public_model.repo.latest_commit
+        etag = '"%s"' % version.get_blob('file1.txt').hexsha
+
+        response = client.get(
+            '/entities/models/%d/versions/%s/download/file1.txt' % (public_model.pk, version.sha),
+            HTTP_IF_NONE_MATCH=etag,
+        )
+
+        assert response.status_code == 304
+        assert response['ETag'] == etag
+
+    def test_download_range(self, client, public_model):
+        version = public_model.repo.latest_commit
+
+        response = client.get(
+            '/entities/models/%d/versions/%s/download/file1.txt' % (public_model.pk, version.sha),
+            HTTP_RANGE='bytes=7-',
+        )
+
+        assert response.status_code == 206
+        assert response.getvalue() == b'contents'
+        assert response['Content-Range'] == 'bytes 7-14/15'
+        assert response['Content-Length'] == '8'
+
+    def test_download_unsatisfiable_range(self, client, public_model):
+        version = public_model.repo.latest_commit
+
+        response = client.get(
+            '/entities/models/%d/versions/%s/download/file1.txt' % (public_model.pk, version.sha),
+            HTTP_RANGE='bytes=100-',
+        )
+
+        assert response.status_code == 416
+        assert response['Content-Range'] == 'bytes */15'
+
+    def test_streams_large_file(self, client, public_model, monkeypatch):
+        monkeypatch.setattr(CatFile, 'STREAM_SIZE', 4)
+        version = public_model.repo.latest_commit
+
+        response = client.get(
+            '/entities/models/%d/versions/%s/download/file1.txt' % (public_model.pk, version.sha),
+            HTTP_RANGE='bytes=0-5',
+        )
+
+        assert response.status_code == 206
+        assert response.getvalue() == b'entity'
 
     @pytest.mark.parametrize("filename", [
         ('oxmeta:membrane-voltage with spaces.csv'),
@@ -2630,12 +2699,26 @@ class TestEntityFileDownloadView:
         )
 
         assert response.status_code == 200
-        assert response.content == b'entity contents'
+        assert response.getvalue() == b'entity contents'
         assert response['Content-Disposition'] == (
             'attachment; filename=' + filename
         )
         assert response['Content-Type'] == 'text/csv'
 
+    def test_download_file_in_subdirectory(self, client, helpers):
+        model = recipes.model.make()
+        helpers.add_version(model, visibility='public')
+        (model.repo_abs_path / 'sub').mkdir()
+        version = helpers.add_version(model, filename='sub/file2.txt', visibility='public')
+
+        url = reverse('entities:file_download', args=['model', model.pk, version.sha, 'sub/file2.txt'])
+        response = client.get(url)
+
+        assert response.status_code == 200
+        assert response.getvalue() == b'entity contents'
+        cached_version = model.repocache.get_version(version.sha)
+        assert url in [f['url'] for f in model.get_version_json(cached_version, 'entities')['files']]
+
     @pytest.mark.parametrize("filename", [
         ('/etc/passwd'),
         ('../../../../../pytest.ini'),
@@ -2680,11 +2763,48 @@ class TestEntityArchiveView:
 
         response = client.get('/entities/models/%d/versions/latest/archive' % model.pk)
         assert response.status_code == 200
-        archive = zipfile.ZipFile(BytesIO(response.content))
+        assert response.streaming
+        content = response.getvalue()
+        archive = zipfile.ZipFile(BytesIO(content))
         assert archive.filelist[0].filename == 'file1.txt'
         assert response['Content-Disposition'] == (
             'attachment; filename=%s_%s.zip' % (model.name.replace(' ', '_'), commit.sha)
         )
+        assert content == commit.write_archive().read()
+
+    def test_download_archive_is_cached(self, client, helpers, settings):
+        model = recipes.model.make()
+        commit = helpers.add_version(model, filename='file1.txt', visibility='public')
+
+        # The first download is streamed as the archive is built and cached
+        response = client.get('/entities/models/%d/versions/latest/archive' % model.pk)
+        assert response.status_code == 200
+        assert not response.has_header('Content-Length')
+        assert not list(settings.ARCHIVE_CACHE_BASE.glob('*/%s-*.zip' % commit.sha))
+        assert response.getvalue() == commit.write_archive().read()
+        cached = list(settings.ARCHIVE_CACHE_BASE.glob('*/%s-*.zip' % commit.sha))
+        assert len(cached) == 1
+
+        # Later downloads are served from the cache
+        response = client.get('/entities/models/%d/versions/latest/archive' % model.pk)
+        assert response['Content-Length'] == str(len(commit.write_archive().read()))
+
+        # A later ephemeral file gives a new archive
+        commit.add_ephemeral_file('errors.txt', b'error')
+        response = client.get('/entities/models/%d/versions/latest/archive' % model.pk)
+        archive = zipfile.ZipFile(BytesIO(response.getvalue()))
+        assert archive.namelist() == ['file1.txt', 'errors.txt']
+        assert list(settings.ARCHIVE_CACHE_BASE.glob('*/%s-*.zip' % commit.sha)) != cached
+
+    def test_download_archive_without_cache(self, client, helpers, settings):
+        settings.ARCHIVE_CACHE_MAX_SIZE = 0
+        model = recipes.model.make()
+        commit = helpers.add_version(model, filename='file1.txt', visibility='public')
+
+        response = client.get('/entities/models/%d/versions/latest/archive' % model.pk)
+        assert response.status_code == 200
+        assert response.getvalue() == commit.write_archive().read()
+        assert not settings.ARCHIVE_CACHE_BASE.exists()
 
     def test_returns_404_if_no_commits_yet(self, logged_in_user, client):
         model = recipes.model.make()
@@ -2703,7 +2823,7 @@ class TestEntityArchiveView:
         )
 
         assert response.status_code == 200
-        archive = zipfile.ZipFile(BytesIO(response.content))
+        archive = zipfile.ZipFile(BytesIO(response.getvalue()))
         assert archive.filelist[0].filename == 'file1.txt'
 
     def test_anonymous_protocol_download_for_running_experiment(self, client, queued_experiment):
@@ -2716,7 +2836,7 @@ class TestEntityArchiveView:
         )
 
         assert response.status_code == 200
-        archive = zipfile.ZipFile(BytesIO(response.content))
+        archive = zipfile.ZipFile(BytesIO(response.getvalue()))
         assert archive.filelist[0].filename == 'file1.txt'
 
     @pytest.mark.parametrize("entity_type,url_fragment", [
@@ -2737,7 +2857,7 @@ class TestEntityArchiveView:
         )
 
         assert response.status_code == 200
-        archive = zipfile.ZipFile(BytesIO(response.content))
+        archive = zipfile.ZipFile(BytesIO(response.getvalue()))
         assert archive.filelist[0].filename == 'file1.txt'
 
     def test_anonymous_protocol_download_for_analysis_task(self, client, analysis_task):
@@ -2750,7 +2870,7 @@ class TestEntityArchiveView:
         )
 
         assert response.status_code == 200
-        archive = zipfile.ZipFile(BytesIO(response.content))
+        archive = zipfile.ZipFile(BytesIO(response.getvalue()))
         assert archive.filelist[0].filename == 'file1.txt'
 
     def test_public_entity_still_visible_with_invalid_token(self, client, queued_experiment):
@@ -2763,7 +2883,7 @@ class TestEntityArchiveView:
         )
 
         assert response.status_code == 200
-        archive = zipfile.ZipFile(BytesIO(response.content))
+        archive = zipfile.ZipFile(BytesIO(response.getvalue()))
         assert archive.filelist[0].filename == 'file1.txt'
 
 
@@ -7,6 +7,8 @@ from . import views
 _COMMIT = r'(?P<sha>[^^~:/ ]+)'
 _FILENAME = r'(?P<filename>[\w\-. \%:]+)'
 _FILEVIEW = r'%s/(?P<viz>\w+)' % _FILENAME
+# A filename which may be in a subdirectory
+_FILEPATH = r'(?P<filename>[\w\-. \%:]+(?:/[\w\-. \%:]+)*)'
 _ENTITY_TYPE = '(?P<entity_type>model|protocol)s'
 
 urlpatterns = [
@@ -102,7 +104,7 @@ urlpatterns = [
 
 
     url(
-        r'^%s/(?P<pk>\d+)/versions/%s/download/%s$' % (_ENTITY_TYPE, _COMMIT, _FILENAME),
+        r'^%s/(?P<pk>\d+)/versions/%s/download/%s$' % (_ENTITY_TYPE, _COMMIT, _FILEPATH),
         views.EntityFileDownloadView.as_view(),
         name='file_download',
     ),
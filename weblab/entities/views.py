@@ -1,7 +1,6 @@
 import json
 import mimetypes
 import os.path
-import shutil
 import subprocess
 from itertools import groupby
 from tempfile import NamedTemporaryFile
@@ -18,11 +17,12 @@ from django.contrib.auth.mixins import (
 from django.core.exceptions import ObjectDoesNotExist, PermissionDenied
 from django.db.models import Count, F, Q
 from django.http import (
+    FileResponse,
     Http404,
-    HttpResponse,
     HttpResponseBadRequest,
     HttpResponseRedirect,
     JsonResponse,
+    StreamingHttpResponse,
 )
 from django.urls import reverse
 from django.utils.decorators import method_decorator
@@ -40,10 +40,11 @@ from django.views.generic.edit import (
 )
 from django.views.generic.list import ListView
 from git import BadName, GitCommandError
-from guardian.shortcuts import get_objects_for_user
 
 from accounts.forms import OwnershipTransferForm
-from core.visibility import Visibility, VisibilityMixin
+from core.downloads import IMMUTABLE_MAX_AGE, SHARED_MAX_AGE, ranged_file_response
+from core.permissions import shared_pks
+from core.visibility import Visibility, VisibilityMixin, visibility_check
 from experiments.models import Experiment, ExperimentVersion, PlannedExperiment
 from fitting.models import FittingResult, FittingSpec
 from repocache.exceptions import RepoCacheMiss
@@ -55,6 +56,7 @@ from repocache.models import (
 )
 from stories.models import StoryGraph
 
+from .archive_cache import archive_cache
 from .forms import (
     EntityChangeVisibilityForm,
     EntityCollaboratorFormSet,
@@ -75,6 +77,7 @@ from .models import (
     ProtocolEntity,
 )
 from .processing import process_check_protocol_callback, record_experiments_to_run
+from .repository import CommitBuilder, repository_pool
 from stories.emails import send_story_changed_email
 
 
@@ -249,7 +252,7 @@ class EntityVersionJsonView(EntityTypeMixin, EntityVersionMixin, SingleObjectMix
 
     def get(self, request, *args, **kwargs):
         obj = self._get_object()
-        commit = self.get_commit()
+        version = self.get_version()
         ns = self.request.resolver_match.namespace
 
         if request.user.has_perm('experiments.create_experiment') and obj.entity_type in ('model', 'protocol'):
@@ -257,20 +260,20 @@ class EntityVersionJsonView(EntityTypeMixin, EntityVersionMixin, SingleObjectMix
         else:
             planned_experiments = []
 
-        details = obj.get_version_json(commit, ns)
+        details = obj.get_version_json(version, ns)
         details.update({
             'planned_experiments': planned_experiments,
             'url': reverse(
                 ns + ':version',
-                args=[obj.url_type, obj.id, commit.sha]
+                args=[obj.url_type, obj.id, version.sha]
             ),
             'download_url': reverse(
                 ns + ':entity_archive',
-                args=[obj.url_type, obj.id, commit.sha]
+                args=[obj.url_type, obj.id, version.sha]
             ),
             'change_url': reverse(
                 ns + ':change_visibility',
-                args=[obj.url_type, obj.id, commit.sha]
+                args=[obj.url_type, obj.id, version.sha]
             ),
         })
         return JsonResponse({
@@ -397,7 +400,7 @@ class EntityComparisonJsonView(EntityTypeMixin, View):
                 entity = self.model.objects.get(pk=id)
                 if entity.is_version_visible_to_user(sha, request.user):
                     json_entities.append(
-                        entity.get_version_json(entity.repo.get_commit(sha), ns)
+                        entity.get_version_json(entity.repocache.get_version(sha), ns)
                     )
             except (RepoCacheMiss, Entity.DoesNotExist):
                 pass
@@ -547,22 +550,21 @@ class EntityAlterFileView(
             if arg not in params:
                 return self.json_error('missing required argument ' + arg)
 
-        # Store the file and add to index
-        path = str(entity.repo_abs_path / params['file_name'])
-        with open(path, 'w') as f:
-            f.write(params['file_contents'])
+        # Store the file in a new commit
+        builder = CommitBuilder(entity.repo, parent)
         try:
-            entity.repo.add_file(path)
-        except GitCommandError as e:
-            # Reset index & working tree so resubmission works as expected
-            entity.repo.hard_reset()
-            return self.json_error('failed to add new file version: ' + e.stderr)
+            builder.add_file(params['file_name'], content=params['file_contents'].encode())
+        except (OSError, ValueError) as e:
+            return self.json_error('failed to add new file version: %s' % e)
 
-        if not entity.repo.has_changes:
+        if not builder.has_changes:
             return self.json_error('new version is identical to parent!')
 
         # Commit and optionally tag the repo
-        commit = entity.repo.commit(params['commit_message'], request.user)
+        try:
+            commit = builder.commit(params['commit_message'], request.user)
+        except GitCommandError:
+            return self.json_error('someone has saved a newer version since you started editing')
         entity.set_visibility_in_repo(commit, params['visibility'])
         entity.repocache.add_version(commit.sha)
 
@@ -633,13 +635,13 @@ class EntityNewVersionView(
     def post(self, request, *args, **kwargs):
 
         entity = self.object = self.get_object()
-        latest_entity_version = entity.repocache.latest_version if entity.repocache.versions.exists() else None
+        latest_entity_version = entity.repocache.latest_version
 
         form = self.get_form()
         if not form.is_valid():
             return self.form_invalid(form)
 
-        git_errors = []
+        errors = []
         files_to_delete = set()  # Temp files to be removed if successful
 
         deletions = set(request.POST.getlist('delete_filename[]'))
@@ -647,51 +649,53 @@ class EntityNewVersionView(
         parent_hexsha = request.POST.get('parent_hexsha')
 
         # check if sha is still that of the latest version
-        if entity.repo.latest_commit is not None:
-            if entity.repo.latest_commit.sha != parent_hexsha:
+        parent = entity.repo.latest_commit
+        if parent is not None:
+            if parent.sha != parent_hexsha:
 
                 form.add_error(None, 'Someone has saved a newer version since you started editing')
                 return self.form_invalid(form)
 
-        # Copy files into the index
+        # Store uploaded files in the new commit
+        builder = CommitBuilder(entity.repo, parent)
         for upload in entity.files.filter(upload__in=additions).order_by('pk'):
             src = upload.upload.path
-            dest = str(entity.repo_abs_path / upload.original_name)
             files_to_delete.add(src)
             if upload.original_name in deletions:
                 # This is either (i) replacing an existing file, or (ii) a file the user uploaded
                 # then decided they didn't want. In either case, don't remove from the repo.
                 deletions.remove(upload.original_name)
-                if not os.path.exists(dest):
+                if upload.original_name not in builder.filenames:
                     # It's the second case (ii), so don't add the file
                     continue
-            shutil.copy(src, dest)
             try:
-                entity.repo.add_file(dest)
-            except GitCommandError as e:
-                git_errors.append(e.stderr)
+                builder.add_file(upload.original_name, path=src)
+            except (OSError, ValueError) as e:
+                errors.append(str(e))
 
-        # Delete files from the index
+        # Delete files from the new commit
         for filename in deletions:
-            path = str(entity.repo_abs_path / filename)
             try:
-                entity.repo.rm_file(path)
-            except GitCommandError as e:
-                git_errors.append(e.stderr)
-
-        if git_errors:
-            # If there were any errors with adding or deleting files,
-            # inform the user and reset the index / working tree
-            # (as resubmission of the form will do it all again).
-            entity.repo.hard_reset()
-            return self.fail_with_git_errors(git_errors, form)
+                builder.remove_file(filename)
+            except ValueError as e:
+                errors.append(str(e))
+
+        if errors:
+            # Nothing has been written to the repository, so resubmitting the form will work
+            for error in errors:
+                form.add_error(None, error)
+            return self.form_invalid(form)
 
         main_file = request.POST.get('mainEntry')
-        entity.repo.generate_manifest(master_filename=main_file)
+        builder.generate_manifest(master_filename=main_file)
 
-        if entity.repo.has_changes:
+        if builder.has_changes:
             # Commit and tag the repo
-            commit = entity.repo.commit(request.POST['commit_message'], request.user)
+            try:
+                commit = builder.commit(request.POST['commit_message'], request.user)
+            except GitCommandError:
+                form.add_error(None, 'Someone has saved a newer version since you started editing')
+                return self.form_invalid(form)
 
             visibility = request.POST['visibility']
             entity.set_visibility_in_repo(commit, visibility)
@@ -758,13 +762,12 @@ class EntityVersionListView(EntityTypeMixin, VisibilityMixin, DetailView):
         entity = self.object
 
         versions = entity.cachedentity.versions
-        if self.request.user not in entity.viewers:
+        if not visibility_check(Visibility.PRIVATE, lambda: entity.viewers, self.request.user):
             versions = versions.filter(~Q(visibility=Visibility.PRIVATE))
 
         kwargs.update(**{
             'versions': list(
-                (list(version.tags.values_list('tag', flat=True)),
-                 entity.repocache.get_version(version.sha))
+                ([tag.tag for tag in version.tags.all()], version)
                 for version in versions.prefetch_related('tags')
             )
         })
@@ -813,11 +816,14 @@ class EntityArchiveView(SingleObjectMixin, EntityVersionMixin, View):
             get_valid_filename('%s_%s.zip' % (entity.name, commit.sha))
         )
 
-        archive = commit.write_archive()
-
-        response = HttpResponse(content_type='application/zip')
+        archive = archive_cache.open(commit, build=False)
+        if archive is None:
+            # Send the archive as it is built, caching it at the same time
+            response = StreamingHttpResponse(archive_cache.stream(commit), content_type='application/zip')
+        else:
+            response = FileResponse(archive, content_type='application/zip')
+            response['Content-Length'] = os.fstat(archive.fileno()).st_size
         response['Content-Disposition'] = 'attachment; filename=%s' % zipfile_name
-        response.write(archive.read())
 
         return response
 
@@ -902,14 +908,33 @@ class EntityFileDownloadView(EntityTypeMixin, EntityVersionMixin, SingleObjectMi
         if content_type is None:
             content_type = 'application/octet-stream'
 
-        response = HttpResponse(content_type=content_type)
-        response['Content-Disposition'] = 'attachment; filename=%s' % filename
         blob = version.get_blob(filename)
-        if blob:
-            response.write(blob.data_stream.read())
-        else:
+        if not blob:
             raise Http404
 
+        private = self.get_visibility() == Visibility.PRIVATE
+        if self.kwargs['sha'] != version.sha:
+            cache_control = 'no-cache'
+        elif private:
+            # A full commit SHA always refers to the same file contents
+            cache_control = 'max-age=%d, immutable' % IMMUTABLE_MAX_AGE
+        else:
+            # Shared caches mustn't keep serving the file for long after the version is made private
+            cache_control = 'max-age=%d, s-maxage=%d, immutable' % (IMMUTABLE_MAX_AGE, SHARED_MAX_AGE)
+        if private:
+            cache_control = 'private, ' + cache_control
+
+        repo = self._get_object().repo
+        response = ranged_file_response(
+            request,
+            lambda: repo.open_blob(blob),
+            blob.size,
+            content_type,
+            etag=blob.hexsha,
+            cache_control=cache_control,
+        )
+        response['Content-Disposition'] = 'attachment; filename=%s' % filename
+
         return response
 
 
@@ -947,6 +972,7 @@ class TransferView(LoginRequiredMixin, UserPassesTestMixin,
             new_path = entity.repo_abs_path
             new_path.parent.mkdir(exist_ok=True, parents=True)
 
+            repository_pool.discard(old_path)
             os.rename(str(old_path), str(new_path))
             return self.form_valid(form)
         else:
@@ -1079,12 +1105,9 @@ class GetProtocolInterfacesJsonView(View):
         # from the user's own protocols and those they have permission for
         user = request.user
         if user.is_authenticated:
-            visible_protocols = user.entity_set.filter(
-                entity_type='protocol'
-            ).union(
-                get_objects_for_user(user, 'entities.edit_entity', with_superuser=False),
-            ).values_list(
-                'id', flat=True
+            visible_protocols = (
+                set(user.entity_set.filter(entity_type='protocol').values_list('id', flat=True)) |
+                shared_pks(user, 'entities.edit_entity')
             )
             where = where | Q(entity__entity__in=visible_protocols)
         # Now sort and filter these so we only get the latest version per protocol,
@@ -1236,13 +1259,11 @@ class EntityRunExperimentView(PermissionRequiredMixin, LoginRequiredMixin,
         context['object_list'] = []
         context['other_object_list'] = []
         for item in other_entities:
-            versions = item.cachedentity.versions
+            latest_version_id = item.cachedentity.latest_version_id
             version_info = []
-            for version in versions.prefetch_related('tags'):
-                tag_list = list(version.tags.values_list('tag', flat=True))
-                ver = item.repocache.get_version(version.sha)
-                latest_version = item.repocache.latest_version
-                version_info.append({'commit': ver, 'tags': tag_list, 'latest': latest_version == ver})
+            for version in item.cachedentity.versions.all():
+                tag_list = [tag.tag for tag in version.tags.all()]
+                version_info.append({'commit': version, 'tags': tag_list, 'latest': version.pk == latest_version_id})
             if item.author == self.request.user:
                 context['object_list'].append(
                     {'entity': item, 'id': item.id, 'name': item.name, 'versions': version_info})
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from ...models import Runnable
+from ...processing import write_column_files
+
+
+class Command(BaseCommand):
+    help = 'Writes binary column files for the numeric CSV outputs of results received before they were made'
+
+    def add_arguments(self, parser):
+        parser.add_argument('runnable_id', nargs='*', type=int)
+        parser.add_argument('--all', action='store_true',
+                            help='rewrite the column files of results that already have them')
+
+    def handle(self, *args, **options):
+        runnables = Runnable.objects.order_by('pk')
+        if options.get('runnable_id', []):
+            runnables = runnables.filter(pk__in=options['runnable_id'])
+
+        num_written = 0
+        for runnable in runnables:
+            if not runnable.archive_path.exists():
+                continue
+            if runnable.columns_path.exists() and not options.get('all', False):
+                continue
+            self.stdout.write('Writing column files for results {}'.format(runnable.pk))
+            write_column_files(runnable, runnable.files)
+            num_written += 1
+
+        self.stdout.write('Wrote column files for {} results'.format(num_written))
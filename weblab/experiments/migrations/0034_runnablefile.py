@@ -0,0 +1,28 @@
+# Generated by Django 2.2.28 on 2026-10-17 07:38
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('experiments', '0033_auto_20220125_2102'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RunnableFile',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255)),
+                ('fmt', models.CharField(max_length=255)),
+                ('size', models.BigIntegerField()),
+                ('is_master', models.BooleanField(default=False)),
+                ('runnable', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archive_files', to='experiments.Runnable')),
+            ],
+            options={
+                'ordering': ['pk'],
+            },
+        ),
+    ]
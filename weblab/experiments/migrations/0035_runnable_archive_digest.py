@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-17 07:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('experiments', '0034_runnablefile'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='runnable',
+            name='archive_digest',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+    ]
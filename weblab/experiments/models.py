@@ -1,9 +1,13 @@
+import hashlib
+import urllib.parse
 import uuid
 from pathlib import Path
 
 from django.conf import settings
 from django.db import models
+from django.urls import reverse
 
+from core.combine import ArchiveFile
 from core.models import FileCollectionMixin, UserCreatedModelMixin
 from core.visibility import Visibility, get_joint_visibility, visibility_check
 from entities.models import ModelEntity, ProtocolEntity
@@ -54,7 +58,7 @@ class ExperimentMixin(models.Model):
 
         :returns: True if the user is allowed to view the experiment, False otherwise
         """
-        return visibility_check(self.visibility, self.viewers, user)
+        return visibility_check(self.visibility, lambda: self.viewers, user)
 
     @property
     def viewers(self):
@@ -162,6 +166,8 @@ class Runnable(UserCreatedModelMixin, FileCollectionMixin, models.Model):
         default=STATUS_QUEUED,
     )
     return_text = models.TextField(blank=True)
+    # SHA-256 digest of the results archive, recorded when it is received
+    archive_digest = models.CharField(max_length=64, blank=True)
 
     class Meta:
         indexes = [
@@ -220,6 +226,51 @@ class Runnable(UserCreatedModelMixin, FileCollectionMixin, models.Model):
             self.STATUS_FAILED,
         )
 
+    @property
+    def files(self):
+        """The files in the results archive, as recorded when the archive was received.
+
+        Results received before archive contents were recorded are listed from the archive itself.
+        """
+        files = [archive_file.as_archive_file() for archive_file in self.archive_files.all()]
+        return files or super().files
+
+    def get_archive_digest(self):
+        """The SHA-256 digest of the results archive.
+
+        For results received before digests were recorded, it is computed and saved now.
+        """
+        if not self.archive_digest:
+            sha256 = hashlib.sha256()
+            with self.archive_path.open('rb') as archive:
+                for chunk in iter(lambda: archive.read(1024 * 1024), b''):
+                    sha256.update(chunk)
+            self.archive_digest = sha256.hexdigest()
+            self.save(update_fields=['archive_digest'])
+        return self.archive_digest
+
+    @property
+    def columns_path(self):
+        """The folder holding binary column files made from numeric CSV outputs."""
+        return self.abs_path / 'columns'
+
+    def column_file_path(self, name):
+        """The path of the column file (see ``core.columnar``) made from a CSV file in the archive.
+
+        :param name: name of the CSV file within the archive
+        :return: ``Path`` of the column file, which exists only if the CSV file was numeric
+        """
+        return self.columns_path / (hashlib.sha256(name.encode()).hexdigest()[:32] + '.cols')
+
+    def get_file_json(self, file_, ns, url_args):
+        """Get information about a file, including where to get its columns if it's a numeric CSV file."""
+        file_json = super().get_file_json(file_, ns, url_args)
+        if self.column_file_path(file_.name).exists():
+            file_args = url_args + [urllib.parse.quote(file_.name)]
+            file_json['columnsUrl'] = reverse(ns + ':file_columns', args=file_args)
+            file_json['downsampleUrl'] = reverse(ns + ':file_downsample', args=file_args)
+        return file_json
+
     def update(self, status, txt):
         """
         Update the results / status of the experiment
@@ -229,6 +280,32 @@ class Runnable(UserCreatedModelMixin, FileCollectionMixin, models.Model):
         self.save()
 
 
+class RunnableFile(models.Model):
+    """A file in the results archive of a `Runnable`, recorded when the archive is received.
+
+    This lets results be listed without opening the archive.
+    """
+    runnable = models.ForeignKey(Runnable, related_name='archive_files', on_delete=models.CASCADE)
+    name = models.CharField(max_length=255)
+    fmt = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    is_master = models.BooleanField(default=False)
+
+    class Meta:
+        # Files are created in manifest order
+        ordering = ['pk']
+
+    def __str__(self):
+        return self.name
+
+    def as_archive_file(self):
+        """Get this file's details in the same form as from the archive.
+
+        :return: ``core.combine.ArchiveFile`` instance
+        """
+        return ArchiveFile(self.name, self.fmt, is_master=self.is_master, size=self.size)
+
+
 class ExperimentVersion(Runnable):
     """ ExperimentVersion class
     This records a single run of a particular Experiment.
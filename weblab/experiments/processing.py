@@ -1,4 +1,6 @@
+import hashlib
 import logging
+import shutil
 import zipfile
 
 import requests
@@ -7,6 +9,9 @@ from django.core.exceptions import MultipleObjectsReturned
 from django.urls import reverse
 from django.utils.timezone import now
 
+from core.columnar import convert_csv
+from core.combine import ArchiveReader
+from core.filetypes import get_file_type
 from core.processing import prepend_callback_base
 
 from .emails import send_experiment_finished_email
@@ -14,6 +19,7 @@ from .models import (
     Experiment,
     ExperimentVersion,
     Runnable,
+    RunnableFile,
     RunningExperiment,
 )
 
@@ -171,7 +177,36 @@ def cancel_experiment(task_id):
         logger.exception("Unable to cancel experiment")
 
 
-def process_callback(data, files):
+def write_column_files(runnable, archive_files):
+    """Convert the numeric CSV files in a runnable's results to binary column files.
+
+    See ``core.columnar``. Any column files from previous results are removed, and CSV files
+    that aren't entirely numeric are skipped. The folder of column files is always created, to
+    show that the results have been converted (see the ``write_column_files`` command).
+
+    @param runnable  the `Runnable` whose archive has just been received
+    @param archive_files  the `ArchiveFile`s in its archive
+    """
+    shutil.rmtree(str(runnable.columns_path), ignore_errors=True)
+    runnable.columns_path.mkdir(parents=True)
+    for archive_file in archive_files:
+        if get_file_type(archive_file.name) != 'CSV':
+            continue
+        try:
+            with runnable.open_file(archive_file.name) as source:
+                convert_csv(source, runnable.column_file_path(archive_file.name))
+        except ValueError:
+            pass  # Not numeric
+
+
+def process_callback(data, files, upload_error=None):
+    """Record the status, and any results, of a run sent by the back-end.
+
+    @param data  dict of fields sent by the back-end
+    @param files  dict of uploaded files, possibly including the results archive as 'experiment'
+    @param upload_error  why the results archive was rejected while being received, if it was
+    @return  dict to send back to the back-end as JSON
+    """
     signature = data.get('signature')
     if not signature:
         return {'error': 'missing signature'}
@@ -213,22 +248,42 @@ def process_callback(data, files):
     if exp.is_finished:
         send_experiment_finished_email(exp)
 
+        if upload_error:
+            exp.update(Runnable.STATUS_FAILED, '%s (%s)' % (exp.return_text, upload_error))
+            return {'error': upload_error}
+
         if not files.get('experiment'):
             exp.update(Runnable.STATUS_FAILED,
                        '%s (backend returned no archive)' % exp.return_text)
             return {'error': 'no archive found'}
 
         exp.mkdir()
-        with exp.archive_path.open('wb+') as dest:
-            for chunk in files['experiment'].chunks():
-                dest.write(chunk)
-
-        # Make sure it's a valid zip
+        exp.archive_files.all().delete()
+        upload = files['experiment']
+        if hasattr(upload, 'move_to'):
+            upload.move_to(exp.archive_path)
+            exp.archive_digest = upload.sha256
+            logger.info('Received %d byte archive for %s with SHA-256 %s', upload.size, exp, upload.sha256)
+        else:
+            sha256 = hashlib.sha256()
+            with exp.archive_path.open('wb+') as dest:
+                for chunk in upload.chunks():
+                    dest.write(chunk)
+                    sha256.update(chunk)
+            exp.archive_digest = sha256.hexdigest()
+        exp.save(update_fields=['archive_digest'])
+
+        # Make sure it's a valid archive, and record its contents
         try:
-            zipfile.ZipFile(str(exp.archive_path))
+            archive_files = ArchiveReader(str(exp.archive_path)).verify()
         except zipfile.BadZipFile as e:
             exp.update(Runnable.STATUS_FAILED, 'error reading archive: %s' % e)
             return {'experiment': 'failed'}
+        RunnableFile.objects.bulk_create(
+            RunnableFile(runnable=exp, name=f.name, fmt=f.fmt, size=f.size, is_master=f.is_master)
+            for f in archive_files
+        )
+        write_column_files(exp, archive_files)
 
         return {'experiment': 'ok'}
 
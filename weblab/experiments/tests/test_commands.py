@@ -0,0 +1,43 @@
+import shutil
+from pathlib import Path
+
+import pytest
+from django.core.management import call_command
+
+from core.columnar import ColumnFile
+
+
+CSV_NAME = 'oxmeta:membrane%3Avoltage - space.csv'
+
+
+@pytest.fixture
+def archive_file_path():
+    return str(Path(__file__).absolute().parent.joinpath('./test.omex'))
+
+
+@pytest.mark.django_db
+class TestWriteColumnFiles:
+    def test_writes_missing_column_files(self, experiment_with_result, fittingresult_with_result,
+                                         experiment_version, archive_file_path):
+        for runnable in (experiment_with_result, fittingresult_with_result):
+            shutil.copyfile(archive_file_path, str(runnable.archive_path))
+
+        call_command('write_column_files')
+
+        for runnable in (experiment_with_result, fittingresult_with_result):
+            assert list(ColumnFile(runnable.column_file_path(CSV_NAME)).read_column(1)) == [1]
+        # Without an archive there is nothing to do
+        assert not experiment_version.columns_path.exists()
+
+    def test_skips_converted_results(self, experiment_with_result, archive_file_path):
+        shutil.copyfile(archive_file_path, str(experiment_with_result.archive_path))
+        experiment_with_result.columns_path.mkdir()
+
+        call_command('write_column_files')
+        assert not experiment_with_result.column_file_path(CSV_NAME).exists()
+
+        call_command('write_column_files', experiment_with_result.pk + 1000)
+        assert not experiment_with_result.column_file_path(CSV_NAME).exists()
+
+        call_command('write_column_files', experiment_with_result.pk, all=True)
+        assert experiment_with_result.column_file_path(CSV_NAME).exists()
@@ -60,10 +60,12 @@ class TestExperiment:
 
         exp.model.repo.tag('v1')
         populate_entity_cache(exp.model)
+        exp.model_version.refresh_from_db()  # The label is stored in the version
         assert exp.nice_model_version == 'v1'
 
         exp.protocol.repo.tag('v2')
         populate_entity_cache(exp.protocol)
+        exp.protocol_version.refresh_from_db()
 
         assert exp.nice_protocol_version == 'v2'
 
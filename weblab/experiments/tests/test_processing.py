@@ -1,4 +1,6 @@
+import hashlib
 import uuid
+import zipfile
 from datetime import timedelta
 from pathlib import Path
 from unittest.mock import Mock, patch
@@ -10,6 +12,7 @@ from django.core.files.uploadedfile import SimpleUploadedFile
 from django.utils.timezone import now
 
 from core import recipes
+from core.columnar import ColumnFile
 from experiments.models import Experiment, ExperimentVersion, RunningExperiment
 from experiments.processing import ProcessingException, process_callback, submit_experiment
 
@@ -309,6 +312,74 @@ class TestProcessCallback:
 
         assert queued_experiment.archive_path.exists()
 
+    def test_records_archive_files(self, queued_experiment, archive_upload):
+        process_callback({
+            'signature': queued_experiment.signature,
+            'returntype': 'success',
+        }, {
+            'experiment': archive_upload,
+        })
+
+        assert [(f.name, f.size, f.is_master) for f in queued_experiment.archive_files.all()] == [
+            ('manifest.xml', 580, False),
+            ('stdout.txt', 27, False),
+            ('errors.txt', 16, False),
+            ('oxmeta:membrane%3Avoltage - space.csv', 4, True),
+        ]
+
+        # The archive is not needed to list the files
+        queued_experiment.archive_path.unlink()
+        version = ExperimentVersion.objects.get(pk=queued_experiment.pk)
+        assert [f.name for f in version.files] == [
+            'manifest.xml', 'stdout.txt', 'errors.txt', 'oxmeta:membrane%3Avoltage - space.csv']
+        assert version.master_file.name == 'oxmeta:membrane%3Avoltage - space.csv'
+
+    def test_writes_column_files(self, queued_experiment, archive_upload):
+        process_callback({
+            'signature': queued_experiment.signature,
+            'returntype': 'success',
+        }, {
+            'experiment': archive_upload,
+        })
+
+        column_file = ColumnFile(queued_experiment.column_file_path('oxmeta:membrane%3Avoltage - space.csv'))
+        assert column_file.names is None
+        assert list(column_file.read_column(1)) == [1]
+        assert [path.name for path in queued_experiment.columns_path.iterdir()] == [
+            queued_experiment.column_file_path('oxmeta:membrane%3Avoltage - space.csv').name]
+
+    def test_records_archive_digest(self, queued_experiment, archive_upload, archive_file_path):
+        process_callback({
+            'signature': queued_experiment.signature,
+            'returntype': 'success',
+        }, {
+            'experiment': archive_upload,
+        })
+
+        queued_experiment.refresh_from_db()
+        with open(archive_file_path, 'rb') as archive:
+            assert queued_experiment.archive_digest == hashlib.sha256(archive.read()).hexdigest()
+        assert queued_experiment.get_archive_digest() == queued_experiment.archive_digest
+
+    def test_returns_error_on_corrupt_archive(self, queued_experiment, archive_upload):
+        archive_upload.seek(0)
+        data = bytearray(archive_upload.read())
+        info = zipfile.ZipFile(archive_upload).getinfo('stdout.txt')
+        # Change the last byte of the (possibly compressed) file data, which follows the local header
+        data[info.header_offset + 30 + len(info.filename.encode()) + len(info.extra) + info.compress_size - 1] ^= 1
+        result = process_callback({
+            'signature': queued_experiment.signature,
+            'returntype': 'success',
+        }, {
+            'experiment': SimpleUploadedFile('test.omex', bytes(data))
+        })
+
+        assert result == {'experiment': 'failed'}
+        queued_experiment.refresh_from_db()
+        assert queued_experiment.status == 'FAILED'
+        assert 'stdout.txt' in queued_experiment.return_text
+        assert queued_experiment.archive_files.count() == 0
+
     def test_finished_experiment_must_have_attachment(self, queued_experiment):
         result = process_callback({
             'signature': queued_experiment.signature,
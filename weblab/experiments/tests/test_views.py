@@ -1,5 +1,7 @@
 import json
 import shutil
+import stat
+import struct
 import uuid
 import zipfile
 from datetime import date
@@ -11,18 +13,23 @@ import pytest
 from django.contrib.auth.models import Permission
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.messages import get_messages
+from django.core.cache import cache
 from django.test import Client
 from django.urls import reverse
 from django.utils.dateparse import parse_datetime
 from pytest_django.asserts import assertContains, assertTemplateUsed
 
 from core import recipes
+from core.columnar import ColumnFile
+from core.files import DEFAULT_FILE_MODE
 from experiments.models import (
     Experiment,
     ExperimentVersion,
     PlannedExperiment,
     RunningExperiment,
 )
+from experiments.processing import write_column_files
+from experiments.uploadhandler import ArchiveUploadHandler, _get_upload_slots
 from repocache.populate import populate_entity_cache
 
 
@@ -472,6 +479,27 @@ class TestExperimentMatrix:
         assert set(data['getMatrix']['rows'].keys()) == {str(v1.sha), str(v2.sha)}
         assert set(data['getMatrix']['experiments'].keys()) == {str(exp.pk)}
 
+    def test_submatrix_names_tagged_versions(self, client, helpers, quick_experiment_version):
+        exp = quick_experiment_version.experiment
+        v1 = exp.model_version
+        v2 = helpers.add_fake_version(exp.model)
+        v2.tag('first')
+        v2.tag('second')
+
+        response = client.get(
+            '/experiments/matrix',
+            {
+                'subset': 'all',
+                'rowIds[]': [exp.model.pk],
+                'rowVersions[]': [str(v1.sha), str(v2.sha)],
+            }
+        )
+
+        assert response.status_code == 200
+        rows = json.loads(response.content.decode())['getMatrix']['rows']
+        assert rows[str(v1.sha)]['name'] == '%s @ %s' % (exp.model.name, v1.sha)
+        assert rows[str(v2.sha)]['name'] == '%s @ first' % exp.model.name
+
     def test_submatrix_with_all_model_versions(self, client, helpers, quick_experiment_version):
         exp = quick_experiment_version.experiment
         v1 = exp.model_version
@@ -893,6 +921,11 @@ class TestNewExperimentView:
         assert data['newExperiment']['expName'] == new_version.experiment.name
 
 
+def staged_archives():
+    staging_dir = ArchiveUploadHandler.staging_dir()
+    return list(staging_dir.iterdir()) if staging_dir.exists() else []
+
+
 @pytest.mark.django_db
 class TestExperimentCallbackView:
     def test_saves_valid_experiment_results(self, client, queued_experiment, archive_file):
@@ -907,6 +940,63 @@ class TestExperimentCallbackView:
         # this checks that the form was saved
         queued_experiment.refresh_from_db()
         assert queued_experiment.status == 'SUCCESS'
+        with open(archive_file.name, 'rb') as original:
+            assert queued_experiment.archive_path.read_bytes() == original.read()
+        assert stat.S_IMODE(queued_experiment.archive_path.stat().st_mode) == DEFAULT_FILE_MODE
+        assert queued_experiment.archive_files.count() == 4
+        assert staged_archives() == []
+
+    def test_removes_unused_archive(self, client, archive_file):
+        response = client.post('/experiments/callback', {
+            'signature': uuid.uuid4(),
+            'returntype': 'success',
+            'experiment': archive_file,
+        })
+
+        assert json.loads(response.content.decode()) == {'error': 'invalid signature'}
+        assert staged_archives() == []
+
+    @pytest.mark.parametrize('setting,value,error', [
+        ('CALLBACK_UPLOAD_MAX_SIZE', 500, 'archive too large'),
+        ('CALLBACK_UPLOAD_MIN_FREE_SPACE', 2 ** 62, 'insufficient disk space'),
+    ])
+    def test_rejects_archive(self, client, settings, queued_experiment, archive_file, setting, value, error):
+        setattr(settings, setting, value)
+        response = client.post('/experiments/callback', {
+            'signature': queued_experiment.signature,
+            'returntype': 'success',
+            'experiment': archive_file,
+        })
+
+        assert json.loads(response.content.decode()) == {'error': error}
+        queued_experiment.refresh_from_db()
+        assert queued_experiment.status == 'FAILED'
+        assert queued_experiment.return_text == 'finished (%s)' % error
+        assert not queued_experiment.archive_path.exists()
+        assert staged_archives() == []
+
+    @patch('experiments.uploadhandler.ArchiveUploadHandler.SLOT_TIMEOUT', 0)
+    def test_rejects_archive_when_busy(self, client, queued_experiment, archive_file):
+        slots = _get_upload_slots()
+        taken = 0
+        while slots.acquire(blocking=False):
+            taken += 1
+        try:
+            response = client.post('/experiments/callback', {
+                'signature': queued_experiment.signature,
+                'returntype': 'success',
+                'experiment': archive_file,
+            })
+        finally:
+            for _ in range(taken):
+                slots.release()
+
+        assert json.loads(response.content.decode()) == {'error': 'too many archives being received'}
+        # The slots are all free again
+        for _ in range(taken):
+            assert slots.acquire(blocking=False)
+        for _ in range(taken):
+            slots.release()
 
     def test_returns_form_errors(self, client):
         response = client.post('/experiments/callback', {
@@ -1494,6 +1584,144 @@ class TestExperimentArchiveView:
         assert response.status_code == 404
 
 
+@pytest.mark.django_db
+class TestExperimentFileColumnsView:
+    @pytest.fixture
+    def version_with_columns(self, experiment_version):
+        experiment_version.mkdir()
+        with zipfile.ZipFile(str(experiment_version.archive_path), 'w') as archive:
+            archive.writestr('manifest.xml', (
+                '<omexManifest xmlns="http://identifiers.org/combine.specifications/omex-manifest">'
+                '<content format="text/csv" location="data.csv" master="true" />'
+                '</omexManifest>'
+            ))
+            archive.writestr('data.csv', 'time,a,b\n0,1,2\n1,3,4\n')
+        write_column_files(experiment_version, experiment_version.files)
+        return experiment_version
+
+    def get(self, client, version, filename='data.csv', **params):
+        return client.get(
+            reverse('experiments:file_columns', args=[version.experiment.pk, version.pk, filename]), params)
+
+    def test_gets_columns(self, client, tmpdir, version_with_columns):
+        response = self.get(client, version_with_columns, columns='2,0')
+
+        assert response.status_code == 200
+        assert response['Content-Type'] == 'application/octet-stream'
+        data = response.getvalue()
+        assert int(response['Content-Length']) == len(data)
+        path = tmpdir.join('response.cols')
+        path.write_binary(data)
+        column_file = ColumnFile(str(path))
+        assert column_file.names == ['b', 'time']
+        assert list(column_file.read_column(0)) == [2, 4]
+
+    def test_gets_all_columns(self, client, version_with_columns):
+        response = self.get(client, version_with_columns)
+
+        assert response.status_code == 200
+        assert response.getvalue().endswith(struct.pack('<6d', 0, 1, 1, 3, 2, 4))
+
+    @pytest.mark.parametrize('columns', ['3', 'a', '-1'])
+    def test_invalid_columns(self, client, version_with_columns, columns):
+        assert self.get(client, version_with_columns, columns=columns).status_code == 400
+
+    def test_missing_file(self, client, version_with_columns):
+        assert self.get(client, version_with_columns, 'manifest.xml').status_code == 404
+
+    def test_listed_in_json(self, client, version_with_columns):
+        response = client.get(reverse('experiments:version_json', args=[
+            version_with_columns.experiment.pk, version_with_columns.pk]))
+
+        file_json = json.loads(response.content.decode())['version']['files'][0]
+        assert file_json['name'] == 'data.csv'
+        url_args = [version_with_columns.experiment.pk, version_with_columns.pk, 'data.csv']
+        assert file_json['columnsUrl'] == reverse('experiments:file_columns', args=url_args)
+        assert file_json['downsampleUrl'] == reverse('experiments:file_downsample', args=url_args)
+
+
+@pytest.mark.django_db
+class TestExperimentFileDownsampleView:
+    @pytest.fixture
+    def version_with_columns(self, experiment_version):
+        experiment_version.mkdir()
+        rows = ''.join('%d,%d,%d\n' % (i, i % 7, -i) for i in range(100))
+        with zipfile.ZipFile(str(experiment_version.archive_path), 'w') as archive:
+            archive.writestr('manifest.xml', (
+                '<omexManifest xmlns="http://identifiers.org/combine.specifications/omex-manifest">'
+                '<content format="text/csv" location="data.csv" master="true" />'
+                '</omexManifest>'
+            ))
+            archive.writestr('data.csv', 'time,a,b\n' + rows)
+        write_column_files(experiment_version, experiment_version.files)
+        return experiment_version
+
+    def get(self, client, version, filename='data.csv', **params):
+        return client.get(
+            reverse('experiments:file_downsample', args=[version.experiment.pk, version.pk, filename]), params)
+
+    def test_downsamples_all_columns(self, client, version_with_columns):
+        response = self.get(client, version_with_columns, points=10)
+
+        assert response.status_code == 200
+        data = json.loads(response.content.decode())
+        assert data['x'] == 'time'
+        assert [series['name'] for series in data['series']] == ['a', 'b']
+        for series in data['series']:
+            assert len(series['x']) == len(series['y']) == 10
+            assert series['x'][0] == 0 and series['x'][-1] == 99
+
+    def test_downsamples_chosen_columns(self, client, version_with_columns):
+        response = self.get(client, version_with_columns, x='b', y='time', points=8, method='m4')
+
+        data = json.loads(response.content.decode())
+        assert data['x'] == 'b'
+        assert [series['name'] for series in data['series']] == ['time']
+        assert len(data['series'][0]['x']) <= 8
+
+    def test_caches_by_archive_digest(self, client, version_with_columns):
+        cache.clear()
+        self.get(client, version_with_columns, points=10)
+        version_with_columns.refresh_from_db()
+        assert len(version_with_columns.archive_digest) == 64
+
+        with patch('core.downsample.downsample') as downsample:
+            response = self.get(client, version_with_columns, points=10)
+            assert len(json.loads(response.content.decode())['series']) == 2
+            downsample.assert_not_called()
+
+    @pytest.mark.parametrize('params', [
+        {'x': 'c'},
+        {'y': '0'},
+        {'points': '3'},
+        {'points': '100000'},
+        {'method': 'mean'},
+    ])
+    def test_invalid_parameters(self, client, version_with_columns, params):
+        assert self.get(client, version_with_columns, **params).status_code == 400
+
+    def test_missing_file(self, client, version_with_columns):
+        assert self.get(client, version_with_columns, 'manifest.xml').status_code == 404
+
+    def test_leaves_out_non_finite_values(self, client, experiment_version):
+        experiment_version.mkdir()
+        with zipfile.ZipFile(str(experiment_version.archive_path), 'w') as archive:
+            archive.writestr('manifest.xml', (
+                '<omexManifest xmlns="http://identifiers.org/combine.specifications/omex-manifest">'
+                '<content format="text/csv" location="data.csv" />'
+                '</omexManifest>'
+            ))
+            archive.writestr('data.csv', 'time,a\n0,1\n1,inf\n2,nan\n3,-inf\n4,5\n')
+        write_column_files(experiment_version, experiment_version.files)
+
+        response = self.get(client, experiment_version)
+
+        def reject(constant):
+            raise ValueError('Invalid JSON constant %s' % constant)
+        data = json.loads(response.content.decode(), parse_constant=reject)
+        assert data['series'] == [{'name': 'a', 'x': [0, 4], 'y': [1, 5]}]
+
+
 @pytest.mark.django_db
 class TestExperimentFileDownloadView:
     def test_download_file(self, client, archive_file_path, experiment_version):
@@ -1505,7 +1733,7 @@ class TestExperimentFileDownloadView:
             (experiment_version.experiment.pk, experiment_version.pk)
         )
         assert response.status_code == 200
-        assert response.content == b'line of output\nmore output\n'
+        assert response.getvalue() == b'line of output\nmore output\n'
         assert response['Content-Disposition'] == (
             'attachment; filename=stdout.txt'
         )
@@ -1522,7 +1750,7 @@ class TestExperimentFileDownloadView:
         )
 
         assert response.status_code == 200
-        assert response.content == b'1,1\n'
+        assert response.getvalue() == b'1,1\n'
         assert response['Content-Disposition'] == (
             'attachment; filename=' + filename
         )
@@ -0,0 +1,165 @@
+import hashlib
+import os
+import shutil
+import threading
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, SkipFile
+
+from core.files import mkstemp
+
+
+_upload_slots = None
+_upload_slots_lock = threading.Lock()
+
+
+def _get_upload_slots():
+    """The semaphore limiting how many archives this process receives at once"""
+    global _upload_slots
+    with _upload_slots_lock:
+        if _upload_slots is None:
+            _upload_slots = threading.BoundedSemaphore(settings.CALLBACK_MAX_CONCURRENT_UPLOADS)
+        return _upload_slots
+
+
+class StagedArchive(UploadedFile):
+    """
+    A results archive that has been received into a staging file
+
+    The staging file is on the same filesystem as the experiment results, so `move_to` can
+    rename it into place rather than copying it.
+    """
+    def __init__(self, path, name, content_type, size, charset, sha256):
+        super().__init__(open(path, 'rb'), name, content_type, size, charset)
+        self.path = path
+        self.sha256 = sha256
+
+    def temporary_file_path(self):
+        return self.path
+
+    def move_to(self, dest):
+        """
+        Atomically move the archive to its final location
+
+        :param dest: path to move the archive to, replacing any existing file
+        """
+        self.file.close()
+        os.replace(self.path, str(dest))
+        self.path = None
+
+    def close(self):
+        super().close()
+        if self.path is not None:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+            self.path = None
+
+
+class ArchiveUploadHandler(FileUploadHandler):
+    """
+    Receive an experiment results archive straight into a staging file, hashing it on the way
+
+    Unlike Django's own handlers, the archive is neither held in memory nor copied out of a
+    temporary file. To protect the server:
+
+    - archives larger than ``CALLBACK_UPLOAD_MAX_SIZE`` bytes are rejected;
+    - an archive is rejected if it would leave less than ``CALLBACK_UPLOAD_MIN_FREE_SPACE`` bytes
+      free on disk;
+    - at most ``CALLBACK_MAX_CONCURRENT_UPLOADS`` archives are received at once by each process.
+      Further uploads wait, without reading from the client, for up to `SLOT_TIMEOUT` seconds
+      before being rejected.
+
+    Rejected archives are skipped, leaving the rest of the request intact, and the reason is
+    recorded in `error`. Only files in the `FIELD_NAME` field are accepted.
+    """
+
+    FIELD_NAME = 'experiment'
+
+    # Seconds to wait for another upload to finish before rejecting an archive
+    SLOT_TIMEOUT = 60
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.error = None
+        self._file = None
+        self._path = None
+        self._sha256 = None
+        self._size = 0
+        self._has_slot = False
+
+    @staticmethod
+    def staging_dir():
+        """
+        :return: `Path` of the folder where archives are received
+        """
+        return settings.EXPERIMENT_BASE / 'incoming'
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        if content_length > settings.CALLBACK_UPLOAD_MAX_SIZE:
+            self.error = 'archive too large'
+
+    def new_file(self, field_name, *args, **kwargs):
+        super().new_file(field_name, *args, **kwargs)
+        if field_name != self.FIELD_NAME or self.error:
+            raise SkipFile
+
+        if not _get_upload_slots().acquire(timeout=self.SLOT_TIMEOUT):
+            self.error = 'too many archives being received'
+            raise SkipFile
+        self._has_slot = True
+
+        staging_dir = self.staging_dir()
+        staging_dir.mkdir(parents=True, exist_ok=True)
+        expected_size = self.content_length or 0
+        if shutil.disk_usage(str(staging_dir)).free < expected_size + settings.CALLBACK_UPLOAD_MIN_FREE_SPACE:
+            self.error = 'insufficient disk space'
+            self.release()
+            raise SkipFile
+
+        fd, self._path = mkstemp(dir=str(staging_dir), suffix='.omex.part')
+        self._file = os.fdopen(fd, 'wb')
+        self._sha256 = hashlib.sha256()
+        self._size = 0
+
+    def receive_data_chunk(self, raw_data, start):
+        self._size += len(raw_data)
+        if self._size > settings.CALLBACK_UPLOAD_MAX_SIZE:
+            self.error = 'archive too large'
+            self.release()
+            raise SkipFile
+        self._file.write(raw_data)
+        self._sha256.update(raw_data)
+
+    def file_complete(self, file_size):
+        self._file.close()
+        self._file = None
+        archive = StagedArchive(
+            self._path, self.file_name, self.content_type, file_size, self.charset, self._sha256.hexdigest())
+        self._path = None  # Now owned by the StagedArchive
+        return archive
+
+    def upload_complete(self):
+        self.release()
+
+    def release(self):
+        """
+        Give up our upload slot and remove any partly received archive
+
+        This is safe to call more than once, and should be called when the request has been
+        handled in case parsing was interrupted.
+        """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self._path is not None:
+            try:
+                os.remove(self._path)
+            except FileNotFoundError:
+                pass
+            self._path = None
+        if self._has_slot:
+            self._has_slot = False
+            _get_upload_slots().release()
@@ -90,6 +90,18 @@ urlpatterns = [
         name='file_download',
     ),
 
+    url(
+        r'^(?P<experiment_pk>\d+)/versions/(?P<pk>\d+)/columns/%s$' % _FILENAME,
+        views.ExperimentFileColumnsView.as_view(),
+        name='file_columns',
+    ),
+
+    url(
+        r'^(?P<experiment_pk>\d+)/versions/(?P<pk>\d+)/downsample/%s$' % _FILENAME,
+        views.ExperimentFileDownsampleView.as_view(),
+        name='file_downsample',
+    ),
+
     url(
         r'^(?P<experiment_pk>\d+)/versions/(?P<pk>\d+)/archive$',
         views.ExperimentVersionArchiveView.as_view(),
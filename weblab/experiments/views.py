@@ -1,11 +1,19 @@
+import hashlib
+import json
 import logging
 
+from django.conf import settings
 from django.contrib import messages
 from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.mixins import LoginRequiredMixin, PermissionRequiredMixin
+from django.core.cache import cache
 from django.db.models import F, Q
-from django.db.models.functions import Coalesce
-from django.http import Http404, JsonResponse
+from django.http import (
+    Http404,
+    HttpResponseBadRequest,
+    JsonResponse,
+    StreamingHttpResponse,
+)
 from django.shortcuts import get_object_or_404, redirect
 from django.urls import reverse
 from django.utils.decorators import method_decorator
@@ -15,8 +23,10 @@ from django.views.decorators.csrf import csrf_exempt
 from django.views.generic import ListView, TemplateView
 from django.views.generic.detail import DetailView, SingleObjectMixin
 from django.views.generic.edit import FormMixin
-from guardian.shortcuts import get_objects_for_user
 
+from core import downsample
+from core.columnar import ColumnFile
+from core.permissions import shared_pks
 from core.visibility import VisibilityMixin
 from datasets import views as dataset_views
 from entities.models import ModelEntity, ModelGroup, ProtocolEntity
@@ -31,6 +41,7 @@ from .models import (
     RunningExperiment,
 )
 from .processing import process_callback, submit_experiment
+from .uploadhandler import ArchiveUploadHandler
 
 
 logger = logging.getLogger(__name__)
@@ -143,7 +154,6 @@ class ExperimentMatrixJsonView(View):
             'entity__entity',
         ).annotate(
             author_name=F('entity__entity__author__full_name'),
-            friendly_name=Coalesce(F('tags__tag'), F('sha')),
         )
         return q_entity_versions
 
@@ -187,10 +197,8 @@ class ExperimentMatrixJsonView(View):
         if user.is_authenticated:
             q_mine = Q(author=user)
             # Can also include versions the user has explicit permission to see
-            visible_entities = user.entity_set.union(
-                get_objects_for_user(user, 'entities.edit_entity', with_superuser=False)
-            ).values_list(
-                'id', flat=True
+            visible_entities = (
+                set(user.entity_set.values_list('id', flat=True)) | shared_pks(user, 'entities.edit_entity')
             )
         else:
             q_mine = Q()
@@ -247,7 +255,7 @@ class ExperimentMatrixJsonView(View):
                                            extend_name=bool(model_versions),
                                            visibility=version.visibility,
                                            author=version.author_name,
-                                           friendly_version=version.friendly_name)
+                                           friendly_version=version.display_name)
                           for version in q_model_versions]
         model_versions = {ver['id']: ver for ver in model_versions}
 
@@ -255,7 +263,7 @@ class ExperimentMatrixJsonView(View):
                                               extend_name=bool(protocol_versions),
                                               visibility=version.visibility,
                                               author=version.author_name,
-                                              friendly_version=version.friendly_name)
+                                              friendly_version=version.display_name)
                              for version in q_protocol_versions]
         protocol_versions = {ver['id']: ver for ver in protocol_versions}
 
@@ -360,7 +368,14 @@ class NewExperimentView(PermissionRequiredMixin, View):
 @method_decorator(csrf_exempt, name='dispatch')
 class ExperimentCallbackView(View):
     def post(self, request, *args, **kwargs):
-        result = process_callback(request.POST, request.FILES)
+        # Results archives are received straight to disk; see ArchiveUploadHandler
+        handler = ArchiveUploadHandler(request)
+        request.upload_handlers = [handler]
+        try:
+            data, files = request.POST, request.FILES
+            result = process_callback(data, files, upload_error=handler.error)
+        finally:
+            handler.release()
         return JsonResponse(result)
 
 
@@ -576,6 +591,96 @@ class ExperimentFileDownloadView(dataset_views.DatasetFileDownloadView):
     model = ExperimentVersion
 
 
+class ExperimentFileColumnsView(VisibilityMixin, SingleObjectMixin, View):
+    """
+    Download columns of a numeric CSV file from an experiment, in binary form
+
+    The response is a column file as described in `core.columnar`, holding the columns given by
+    index in the comma-separated `columns` query parameter, or all columns by default.
+    """
+    model = ExperimentVersion
+
+    def get(self, request, *args, **kwargs):
+        version = self.get_object()
+        try:
+            column_file = ColumnFile(version.column_file_path(self.kwargs['filename']))
+        except FileNotFoundError:
+            raise Http404
+
+        try:
+            if request.GET.get('columns'):
+                indices = [int(index) for index in request.GET['columns'].split(',')]
+            else:
+                indices = list(range(column_file.num_columns))
+            content = column_file.iter_bytes(indices, with_header=True)
+        except (ValueError, IndexError):
+            return HttpResponseBadRequest('invalid columns')
+
+        response = StreamingHttpResponse(content, content_type='application/octet-stream')
+        response['Content-Length'] = column_file.subset_size(indices)
+        return response
+
+
+class ExperimentFileDownsampleView(VisibilityMixin, SingleObjectMixin, View):
+    """
+    Get series from a numeric CSV file from an experiment, downsampled for plotting
+
+    Query parameters are:
+
+    - `x`: the column giving x values (default the first)
+    - `y`: a column to plot against it, which may be repeated (default all other columns)
+    - `points`: the maximum number of points in each series (default ``DOWNSAMPLE_DEFAULT_POINTS``,
+      at most ``DOWNSAMPLE_MAX_POINTS``)
+    - `method`: the downsampling method, ``lttb`` (the default) or ``m4`` (see `core.downsample`)
+
+    Columns are given by name, or by index if the file has no column names. Results are cached
+    by the digest of the results archive, so they never need to be invalidated.
+    """
+    model = ExperimentVersion
+
+    @staticmethod
+    def _column_index(column_file, column):
+        if column_file.names is None:
+            index = int(column)
+        else:
+            index = column_file.names.index(column)
+        if not 0 <= index < column_file.num_columns:
+            raise ValueError('No column %s' % column)
+        return index
+
+    def get(self, request, *args, **kwargs):
+        version = self.get_object()
+        filename = self.kwargs['filename']
+        try:
+            column_file = ColumnFile(version.column_file_path(filename))
+        except FileNotFoundError:
+            raise Http404
+
+        try:
+            x = self._column_index(column_file, request.GET.get('x', column_file.names[0] if column_file.names else 0))
+            ys = [self._column_index(column_file, y) for y in request.GET.getlist('y')]
+            ys = ys or [i for i in range(column_file.num_columns) if i != x]
+            points = int(request.GET.get('points', settings.DOWNSAMPLE_DEFAULT_POINTS))
+            method = request.GET.get('method', 'lttb')
+            if method not in downsample.METHODS or not 4 <= points <= settings.DOWNSAMPLE_MAX_POINTS:
+                raise ValueError
+        except (ValueError, IndexError):
+            return HttpResponseBadRequest('invalid parameters')
+
+        key = 'downsample:' + hashlib.sha256(json.dumps(
+            [version.get_archive_digest(), filename, x, ys, points, method]).encode()).hexdigest()
+        result = cache.get(key)
+        if result is None:
+            names = column_file.names or [str(i) for i in range(column_file.num_columns)]
+            x_values = column_file.read_column(x)
+            result = {'x': names[x], 'series': []}
+            for y in ys:
+                xs, y_values = downsample.downsample(x_values, column_file.read_column(y), points, method)
+                result['series'].append({'name': names[y], 'x': xs, 'y': y_values})
+            cache.set(key, result, None)
+        return JsonResponse(result)
+
+
 class ExperimentVersionArchiveView(dataset_views.DatasetArchiveView):
     """
     Download a combine archive of an experiment version
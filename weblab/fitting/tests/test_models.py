@@ -143,14 +143,17 @@ class TestFittingResult:
 
         fitres.model.repo.tag('v1')
         populate_entity_cache(fitres.model)
+        fitres.model_version.refresh_from_db()  # The label is stored in the version
         assert fitres.nice_model_version == 'v1'
 
         fitres.protocol.repo.tag('v2')
         populate_entity_cache(fitres.protocol)
+        fitres.protocol_version.refresh_from_db()
         assert fitres.nice_protocol_version == 'v2'
 
         fitres.fittingspec.repo.tag('v3')
         populate_entity_cache(fitres.fittingspec)
+        fitres.fittingspec_version.refresh_from_db()
         assert fitres.nice_fittingspec_version == 'v3'
 
     def test_visibility(self, helpers):
@@ -1,5 +1,6 @@
 import json
 import shutil
+import struct
 import zipfile
 from io import BytesIO
 from pathlib import Path
@@ -11,6 +12,7 @@ from django.utils.dateparse import parse_datetime
 from pytest_django.asserts import assertContains, assertTemplateUsed
 
 from core import recipes
+from experiments.processing import write_column_files
 from fitting.models import FittingResult, FittingResultVersion, FittingSpec
 from repocache.populate import populate_entity_cache
 
@@ -90,6 +92,24 @@ class TestFittingResultArchiveView:
         assert response.status_code == 404
 
 
+@pytest.mark.django_db
+class TestFittingResultFileColumnsView:
+    def test_gets_columns(self, client, archive_file_path, fittingresult_version):
+        fittingresult_version.mkdir()
+        shutil.copyfile(archive_file_path, str(fittingresult_version.archive_path))
+        write_column_files(fittingresult_version, fittingresult_version.files)
+        filename = 'oxmeta:membrane%3Avoltage - space.csv'
+
+        response = client.get(
+            reverse('fitting:result:file_columns',
+                    args=[fittingresult_version.fittingresult.pk, fittingresult_version.pk, filename]),
+            {'columns': '1'}
+        )
+
+        assert response.status_code == 200
+        assert response.getvalue().endswith(struct.pack('<d', 1))
+
+
 @pytest.mark.django_db
 class TestFittingResultFileDownloadView:
     def test_download_file(self, client, archive_file_path, fittingresult_version):
@@ -101,7 +121,7 @@ class TestFittingResultFileDownloadView:
             (fittingresult_version.fittingresult.pk, fittingresult_version.pk)
         )
         assert response.status_code == 200
-        assert response.content == b'line of output\nmore output\n'
+        assert response.getvalue() == b'line of output\nmore output\n'
         assert response['Content-Disposition'] == (
             'attachment; filename=stdout.txt'
         )
@@ -118,7 +138,7 @@ class TestFittingResultFileDownloadView:
         )
 
         assert response.status_code == 200
-        assert response.content == b'1,1\n'
+        assert response.getvalue() == b'1,1\n'
         assert response['Content-Disposition'] == (
             'attachment; filename=' + filename
         )
@@ -9,6 +9,8 @@ from .models import FittingSpec
 _COMMIT = r'(?P<sha>[^^~:/ ]+)'
 _FILENAME = r'(?P<filename>[\w\-. \%:]+)'
 _FILEVIEW = r'%s/(?P<viz>\w+)' % _FILENAME
+# A filename which may be in a subdirectory
+_FILEPATH = r'(?P<filename>[\w\-. \%:]+(?:/[\w\-. \%:]+)*)'
 _ENTITY_TYPE = '(?P<entity_type>%s)s' % FittingSpec.url_type
 
 app_name = 'fitting'
@@ -37,6 +39,18 @@ result_patterns = [
         name='file_download',
     ),
 
+    url(
+        r'^(?P<fittingresult_pk>\d+)/versions/(?P<pk>\d+)/columns/%s$' % _FILENAME,
+        views.FittingResultFileColumnsView.as_view(),
+        name='file_columns',
+    ),
+
+    url(
+        r'^(?P<fittingresult_pk>\d+)/versions/(?P<pk>\d+)/downsample/%s$' % _FILENAME,
+        views.FittingResultFileDownsampleView.as_view(),
+        name='file_downsample',
+    ),
+
     url(
         r'^(?P<fittingresult_pk>\d+)/versions/(?P<pk>\d+)/files.json$',
         views.FittingResultVersionJsonView.as_view(),
@@ -172,7 +186,7 @@ urlpatterns = [
     ),
 
     url(
-        r'^%s/(?P<pk>\d+)/versions/%s/download/%s$' % (_ENTITY_TYPE, _COMMIT, _FILENAME),
+        r'^%s/(?P<pk>\d+)/versions/%s/download/%s$' % (_ENTITY_TYPE, _COMMIT, _FILEPATH),
         entity_views.EntityFileDownloadView.as_view(),
         name='file_download',
     ),
@@ -23,14 +23,18 @@ from django.views import View
 from django.views.generic import TemplateView
 from django.views.generic.detail import DetailView, SingleObjectMixin
 from django.views.generic.edit import CreateView, FormView
-from guardian.shortcuts import get_objects_for_user
 
+from core.permissions import shared_pks
 from core.visibility import VisibilityMixin
 from datasets import views as dataset_views
 from datasets.models import Dataset
 from entities.models import ModelEntity, ProtocolEntity
 from entities.views import EntityNewVersionView, EntityTypeMixin, RenameView
-from experiments.views import ExperimentMatrixJsonView
+from experiments.views import (
+    ExperimentFileColumnsView,
+    ExperimentFileDownsampleView,
+    ExperimentMatrixJsonView,
+)
 from repocache.models import CachedFittingSpecVersion, CachedModelVersion, CachedProtocolVersion
 
 from .forms import (
@@ -145,10 +149,8 @@ class FittingSpecResultsMatrixJsonView(SingleObjectMixin, ExperimentMatrixJsonVi
         if user.is_authenticated:
             q_mine = Q(author=user)
             # Can also include versions the user has explicit permission to see
-            visible_entities = user.entity_set.union(
-                get_objects_for_user(user, 'entities.edit_entity', with_superuser=False)
-            ).values_list(
-                'id', flat=True
+            visible_entities = (
+                set(user.entity_set.values_list('id', flat=True)) | shared_pks(user, 'entities.edit_entity')
             )
         else:
             q_mine = Q()
@@ -202,7 +204,7 @@ class FittingSpecResultsMatrixJsonView(SingleObjectMixin, ExperimentMatrixJsonVi
                                            extend_name=bool(model_versions),
                                            visibility=version.visibility,
                                            author=version.author_name,
-                                           friendly_version=version.friendly_name)
+                                           friendly_version=version.display_name)
                           for version in q_model_versions]
         model_versions = {ver['id']: ver for ver in model_versions}
 
@@ -278,6 +280,20 @@ class FittingResultFileDownloadView(dataset_views.DatasetFileDownloadView):
     model = FittingResultVersion
 
 
+class FittingResultFileColumnsView(ExperimentFileColumnsView):
+    """
+    Download columns of a numeric CSV file from a fitting result, in binary form
+    """
+    model = FittingResultVersion
+
+
+class FittingResultFileDownsampleView(ExperimentFileDownsampleView):
+    """
+    Get series from a numeric CSV file from a fitting result, downsampled for plotting
+    """
+    model = FittingResultVersion
+
+
 class FittingResultVersionJsonView(VisibilityMixin, SingleObjectMixin, View):
     """
     Serve up json view of a fitting result verson
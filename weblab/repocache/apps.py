@@ -1,5 +1,17 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_delete, post_save
+
+from .signals import tag_changed, version_changed
 
 
 class RepocacheConfig(AppConfig):
     name = 'repocache'
+
+    def ready(self):
+        from .models import CACHED_VERSION_TYPE_MAP
+
+        for sender in CACHED_VERSION_TYPE_MAP.values():
+            post_save.connect(version_changed, sender)
+            post_delete.connect(version_changed, sender)
+            post_save.connect(tag_changed, sender.CachedTagClass)
+            post_delete.connect(tag_changed, sender.CachedTagClass)
@@ -0,0 +1,115 @@
+"""
+A request-scoped identity map for the repocache
+
+While a map is active (see `repocache.middleware`), each cached entity is fetched at most once,
+however many times `Entity.repocache` is called, and likewise each version looked up by
+`CachedEntity.get_version`. Repeated lookups return the same Python object, so changes made
+through one reference are seen through the others.
+"""
+import contextlib
+import contextvars
+
+
+_current = contextvars.ContextVar('repocache_identity_map', default=None)
+
+
+class IdentityMap:
+    """
+    Cached entities and versions already fetched in the current request
+    """
+    def __init__(self):
+        self._entities = {}  # (entity type, entity pk) -> cached entity
+        self._versions = {}  # (cache class, cached entity pk, ref) -> cached version
+        self.hits = 0
+        self.misses = 0
+
+    def get_cached_entity(self, entity):
+        """
+        Get the cache for an entity, creating it if needed
+
+        :param entity: `Entity` object
+        :return: `CachedEntity` object
+        """
+        from .models import get_or_create_cached_entity
+
+        key = (entity.entity_type, entity.pk)
+        cached = self._entities.get(key)
+        if cached is None:
+            self.misses += 1
+            cached = self._entities[key] = get_or_create_cached_entity(entity)[0]
+        else:
+            self.hits += 1
+        return cached
+
+    def get_version(self, cached, ref, lookup):
+        """
+        Get a version of a cached entity
+
+        Versions that are not found are not remembered, since they may be added later.
+
+        :param cached: `CachedEntity` object
+        :param ref: SHA, tag or 'latest' identifying the version
+        :param lookup: function taking `ref` and returning the version, used if it hasn't
+            already been fetched
+        :return: `CachedEntityVersion` object
+        """
+        key = (type(cached), cached.pk, ref)
+        version = self._versions.get(key)
+        if version is None:
+            self.misses += 1
+            version = self._versions[key] = lookup(ref)
+        else:
+            self.hits += 1
+        return version
+
+    def version_changed(self, version):
+        """
+        Update the map after a version has been added, changed or deleted
+
+        All versions of its entity are forgotten, since 'latest' or a tag may now refer to a
+        different version, and the stored summary of the entity is refreshed.
+
+        :param version: the `CachedEntityVersion` that changed
+        """
+        self.versions_changed(version.CachedEntityClass, version.entity_id)
+
+    def versions_changed(self, cache_cls, cached_pk):
+        """
+        Update the map after any number of versions of a cached entity have changed
+
+        :param cache_cls: `CachedEntity` subclass
+        :param cached_pk: primary key of the cached entity
+        """
+        self._versions = {
+            key: value for key, value in self._versions.items()
+            if not (key[0] is cache_cls and key[1] == cached_pk)
+        }
+        for cached in self._entities.values():
+            if type(cached) is cache_cls and cached.pk == cached_pk:
+                try:
+                    cached.refresh_from_db(fields=['aggregate_visibility', 'latest_version'])
+                except cache_cls.DoesNotExist:
+                    pass  # The entity is being deleted
+
+
+def current():
+    """
+    :return: the active `IdentityMap`, or None if there isn't one
+    """
+    return _current.get()
+
+
+@contextlib.contextmanager
+def activate():
+    """
+    Context manager making a new `IdentityMap` active within its block
+
+    :return: the new `IdentityMap`
+    """
+    identity_map = IdentityMap()
+    token = _current.set(identity_map)
+    try:
+        yield identity_map
+    finally:
+        _current.reset(token)
+
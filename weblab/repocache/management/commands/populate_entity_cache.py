@@ -1,15 +1,62 @@
-from django.core.management.base import BaseCommand
+import logging
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
 
 from entities.models import Entity
 
 from ...populate import populate_entity_cache
 
 
+logger = logging.getLogger(__name__)
+
+
+def refresh_entity(entity_id, incremental, force):
+    """
+    Populate the cache for one entity, unless its repository hasn't changed since last time
+
+    This is run in a worker process, so only takes and returns simple values. Each worker
+    opens its own database connection when first needed.
+
+    :param entity_id: primary key of the entity
+    :param incremental: whether to add only new commits to the cache
+    :param force: whether to populate the cache even if the repository hasn't changed
+    :return: dict with keys 'skipped', 'versions' (the number of cached versions), 'seconds',
+        'error' (a message, or None) and 'traceback' (the formatted traceback of the error, or None)
+    """
+    start = time.perf_counter()
+    result = {'skipped': False, 'versions': 0, 'seconds': 0, 'error': None, 'traceback': None}
+    try:
+        entity = Entity.objects.get(pk=entity_id)
+        cached = entity.repocache
+        if not force and cached.ref_fingerprint and cached.ref_fingerprint == entity.repo.ref_fingerprint:
+            result['skipped'] = True
+        else:
+            populate_entity_cache(entity, incremental=incremental)
+        result['versions'] = cached.versions.count()
+    except Exception as e:
+        logger.exception('Unable to populate cache for entity %s', entity_id)
+        result['error'] = '{}: {}'.format(type(e).__name__, e)
+        result['traceback'] = traceback.format_exc()
+    finally:
+        result['seconds'] = time.perf_counter() - start
+    return result
+
+
 class Command(BaseCommand):
     help = 'Indexes entity repositories in to cache tables'
 
     def add_arguments(self, parser):
         parser.add_argument('entity_id', nargs='*', type=int)
+        parser.add_argument('--incremental', action='store_true',
+                            help='only add commits made since the latest cached commit')
+        parser.add_argument('--force', action='store_true',
+                            help='also process repositories that have not changed since they were last cached')
+        parser.add_argument('--jobs', type=int, default=4,
+                            help='maximum number of repositories to process at once')
 
     def handle(self, *args, **options):
         # Avoid 'too many open files' errors
@@ -25,7 +72,48 @@ class Command(BaseCommand):
         entities = Entity.objects.all()
         if options.get('entity_id', []):
             entities = entities.filter(id__in=options['entity_id'])
+        labels = {
+            entity.pk: '{} {}'.format(entity.entity_type, entity.name)
+            for entity in entities
+            if entity.repo_abs_path.exists()
+        }
+        args = (options.get('incremental', False), options.get('force', False))
+        jobs = max(options.get('jobs', 4), 1)
+
+        start = time.perf_counter()
+        self.num_done = self.num_skipped = self.num_failed = 0
+        if jobs == 1:
+            for entity_id in labels:
+                self.report(labels[entity_id], refresh_entity(entity_id, *args), len(labels))
+        else:
+            # Worker processes must not share our database connection
+            connections.close_all()
+            with ProcessPoolExecutor(max_workers=jobs) as executor:
+                futures = {executor.submit(refresh_entity, entity_id, *args): entity_id for entity_id in labels}
+                for future in as_completed(futures):
+                    self.report(labels[futures[future]], future.result(), len(labels))
+
+        seconds = time.perf_counter() - start
+        num_processed = len(labels) - self.num_skipped - self.num_failed
+        self.stdout.write(
+            'Processed {} of {} repositories ({} unchanged, {} failed) in {:.2f} s, {:.1f} repositories/s'.format(
+                num_processed, len(labels), self.num_skipped, self.num_failed, seconds,
+                num_processed / seconds if seconds else 0))
+        if self.num_failed:
+            raise CommandError('{} of {} repositories failed'.format(self.num_failed, len(labels)))
 
-        for entity in entities:
-            if entity.repo_abs_path.exists():
-                populate_entity_cache(entity)
+    def report(self, label, result, total):
+        """Report the result of `refresh_entity` for one entity"""
+        self.num_done += 1
+        progress = '[{}/{}] {}'.format(self.num_done, total, label)
+        if result['error']:
+            self.num_failed += 1
+            self.stderr.write('{}: failed: {}'.format(progress, result['error']))
+            if result.get('traceback'):
+                self.stderr.write(result['traceback'], ending='')
+        elif result['skipped']:
+            self.num_skipped += 1
+            self.stdout.write('{}: unchanged'.format(progress))
+        else:
+            self.stdout.write('{}: {} versions cached in {:.2f} s'.format(
+                progress, result['versions'], result['seconds']))
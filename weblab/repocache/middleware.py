@@ -0,0 +1,21 @@
+import logging
+
+from . import identitymap
+
+
+logger = logging.getLogger(__name__)
+
+
+class IdentityMapMiddleware:
+    """
+    Use a new repocache `IdentityMap` for each request, logging how well it did at debug level
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with identitymap.activate() as identity_map:
+            response = self.get_response(request)
+        logger.debug('%s %s: repocache identity map had %d hits and %d misses',
+                     request.method, request.path, identity_map.hits, identity_map.misses)
+        return response
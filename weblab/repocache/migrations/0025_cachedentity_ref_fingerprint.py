@@ -0,0 +1,28 @@
+# Generated by Django 2.2.28 on 2026-10-17 08:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('repocache', '0024_auto_20220125_1459'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cachedfittingspec',
+            name='ref_fingerprint',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='cachedmodel',
+            name='ref_fingerprint',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='cachedprotocol',
+            name='ref_fingerprint',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+    ]
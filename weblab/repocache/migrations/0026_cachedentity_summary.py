@@ -0,0 +1,71 @@
+# Generated by Django 2.2.28 on 2026-10-17 08:13
+
+from django.db import migrations, models
+from django.db.models import Case, OuterRef, Subquery, Value, When
+from django.db.models.functions import Coalesce
+import django.db.models.deletion
+
+
+def fill_summaries(apps, schema_editor):
+    """Store the visibility and latest version of every cached entity.
+
+    This repeats CachedEntity.update_summaries, which historical models don't have.
+    """
+    for entity_type in ['Model', 'Protocol', 'FittingSpec']:
+        CachedEntity = apps.get_model('repocache', 'Cached' + entity_type)
+        CachedVersion = apps.get_model('repocache', 'Cached%sVersion' % entity_type)
+        versions = CachedVersion.objects.filter(entity=OuterRef('pk'))
+        rank = Case(
+            When(visibility='moderated', then=2),
+            When(visibility='public', then=1),
+            default=0,
+            output_field=models.IntegerField(),
+        )
+        CachedEntity.objects.update(
+            latest_version=Subquery(versions.order_by('-timestamp', '-pk').values('pk')[:1]),
+            aggregate_visibility=Coalesce(
+                Subquery(versions.annotate(rank=rank).order_by('-rank').values('visibility')[:1]),
+                Value('private'),
+            ),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('repocache', '0025_cachedentity_ref_fingerprint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cachedfittingspec',
+            name='aggregate_visibility',
+            field=models.CharField(choices=[('private', 'Private'), ('public', 'Public'), ('moderated', 'Moderated')], db_index=True, default='private', help_text='Visibility of the most visible version', max_length=16),
+        ),
+        migrations.AddField(
+            model_name='cachedfittingspec',
+            name='latest_version',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='repocache.CachedFittingSpecVersion'),
+        ),
+        migrations.AddField(
+            model_name='cachedmodel',
+            name='aggregate_visibility',
+            field=models.CharField(choices=[('private', 'Private'), ('public', 'Public'), ('moderated', 'Moderated')], db_index=True, default='private', help_text='Visibility of the most visible version', max_length=16),
+        ),
+        migrations.AddField(
+            model_name='cachedmodel',
+            name='latest_version',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='repocache.CachedModelVersion'),
+        ),
+        migrations.AddField(
+            model_name='cachedprotocol',
+            name='aggregate_visibility',
+            field=models.CharField(choices=[('private', 'Private'), ('public', 'Public'), ('moderated', 'Moderated')], db_index=True, default='private', help_text='Visibility of the most visible version', max_length=16),
+        ),
+        migrations.AddField(
+            model_name='cachedprotocol',
+            name='latest_version',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='repocache.CachedProtocolVersion'),
+        ),
+        migrations.RunPython(fill_summaries, migrations.RunPython.noop),
+    ]
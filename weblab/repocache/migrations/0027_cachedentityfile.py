@@ -0,0 +1,65 @@
+# Generated by Django 2.2.28 on 2026-10-17 08:32
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('repocache', '0026_cachedentity_summary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CachedProtocolFile',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.TextField(help_text='Path of the file within the commit')),
+                ('size', models.BigIntegerField(help_text='Size of the file in bytes')),
+                ('blob_sha', models.CharField(help_text='SHA of the git blob holding the file contents', max_length=40)),
+                ('filetype', models.CharField(help_text='File type, as given by core.filetypes', max_length=32)),
+                ('ephemeral', models.BooleanField(default=False, help_text='Whether this is an ephemeral file stored as a git note')),
+                ('version', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='files', to='repocache.CachedProtocolVersion')),
+            ],
+            options={
+                'ordering': ['pk'],
+                'abstract': False,
+                'unique_together': {('version', 'name')},
+            },
+        ),
+        migrations.CreateModel(
+            name='CachedModelFile',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.TextField(help_text='Path of the file within the commit')),
+                ('size', models.BigIntegerField(help_text='Size of the file in bytes')),
+                ('blob_sha', models.CharField(help_text='SHA of the git blob holding the file contents', max_length=40)),
+                ('filetype', models.CharField(help_text='File type, as given by core.filetypes', max_length=32)),
+                ('ephemeral', models.BooleanField(default=False, help_text='Whether this is an ephemeral file stored as a git note')),
+                ('version', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='files', to='repocache.CachedModelVersion')),
+            ],
+            options={
+                'ordering': ['pk'],
+                'abstract': False,
+                'unique_together': {('version', 'name')},
+            },
+        ),
+        migrations.CreateModel(
+            name='CachedFittingSpecFile',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.TextField(help_text='Path of the file within the commit')),
+                ('size', models.BigIntegerField(help_text='Size of the file in bytes')),
+                ('blob_sha', models.CharField(help_text='SHA of the git blob holding the file contents', max_length=40)),
+                ('filetype', models.CharField(help_text='File type, as given by core.filetypes', max_length=32)),
+                ('ephemeral', models.BooleanField(default=False, help_text='Whether this is an ephemeral file stored as a git note')),
+                ('version', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='files', to='repocache.CachedFittingSpecVersion')),
+            ],
+            options={
+                'ordering': ['pk'],
+                'abstract': False,
+                'unique_together': {('version', 'name')},
+            },
+        ),
+    ]
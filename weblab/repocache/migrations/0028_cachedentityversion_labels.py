@@ -0,0 +1,68 @@
+# Generated by Django 2.2.28 on 2026-10-17 08:45
+
+from collections import defaultdict
+
+from django.db import migrations, models
+
+
+def fill_labels(apps, schema_editor):
+    """Store the display name and URL label of every cached version.
+
+    This repeats CachedEntityVersion.update_labels, which historical models don't have.
+    """
+    for entity_type in ['Model', 'Protocol', 'FittingSpec']:
+        CachedVersion = apps.get_model('repocache', 'Cached%sVersion' % entity_type)
+        CachedTag = apps.get_model('repocache', 'Cached%sTag' % entity_type)
+        tag_names = defaultdict(list)
+        for version_pk, tag in CachedTag.objects.order_by('pk').values_list('version_id', 'tag'):
+            tag_names[version_pk].append(tag)
+        versions = list(CachedVersion.objects.only('sha'))
+        for version in versions:
+            names = tag_names[version.pk]
+            version.display_name = names[0] if names else version.sha
+            if names and names[-1] not in ['new', 'latest']:
+                version.url_label = names[-1]
+            else:
+                version.url_label = version.sha
+        CachedVersion.objects.bulk_update(versions, ['display_name', 'url_label'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('repocache', '0027_cachedentityfile'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cachedfittingspecversion',
+            name='display_name',
+            field=models.CharField(blank=True, help_text='Name to show for this version: its first tag, or its SHA if untagged', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='cachedfittingspecversion',
+            name='url_label',
+            field=models.CharField(blank=True, help_text='Name to use in URLs for this version: its latest tag, or its SHA if untagged', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='cachedmodelversion',
+            name='display_name',
+            field=models.CharField(blank=True, help_text='Name to show for this version: its first tag, or its SHA if untagged', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='cachedmodelversion',
+            name='url_label',
+            field=models.CharField(blank=True, help_text='Name to use in URLs for this version: its latest tag, or its SHA if untagged', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='cachedprotocolversion',
+            name='display_name',
+            field=models.CharField(blank=True, help_text='Name to show for this version: its first tag, or its SHA if untagged', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='cachedprotocolversion',
+            name='url_label',
+            field=models.CharField(blank=True, help_text='Name to use in URLs for this version: its latest tag, or its SHA if untagged', max_length=255),
+        ),
+        migrations.RunPython(fill_labels, migrations.RunPython.noop),
+    ]
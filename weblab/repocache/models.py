@@ -1,10 +1,23 @@
+from collections import defaultdict
+
 from django.core.exceptions import ObjectDoesNotExist
 from django.db import models
-from guardian.shortcuts import get_objects_for_user
-
+from django.db.models import (
+    Case,
+    OuterRef,
+    Subquery,
+    Value,
+    When,
+)
+from django.db.models.functions import Coalesce
+
+from core.filetypes import get_file_type
 from core.models import VisibilityModelMixin
+from core.permissions import shared_pks
+from core.visibility import CHOICES as VISIBILITY_CHOICES
 from core.visibility import Visibility
 
+from . import identitymap, versioncache
 from .exceptions import RepoCacheMiss
 
 
@@ -23,11 +36,24 @@ class CachedEntity(models.Model):
     Concrete cache types should inherit from this and define a suitable ``entity`` column, e.g.
         entity = models.OneToOneField(ModelEntity, on_delete=models.CASCADE, related_name='cachedentity')
 
-    Once a trio of (entity, version, tag) concrete cache classes are defined, the method
+    Once a set of (entity, version, tag, file) concrete cache classes are defined, the method
     _set_class_links() should be called to let them know about each other, setting the
-    CachedModelClass, CachedVersionClass and CachedTagClass properties on each class.
+    CachedModelClass, CachedVersionClass, CachedTagClass and CachedFileClass properties on each class.
     """
 
+    # `Repository.ref_fingerprint` of the repository when this cache was last populated
+    ref_fingerprint = models.CharField(max_length=64, blank=True)
+
+    # Summaries of the versions, kept up to date by `update_summaries`. Concrete cache types
+    # also define a ``latest_version`` column, the version with the latest timestamp (or None).
+    aggregate_visibility = models.CharField(
+        max_length=16,
+        choices=VISIBILITY_CHOICES,
+        default=Visibility.PRIVATE,
+        db_index=True,
+        help_text='Visibility of the most visible version',
+    )
+
     class Meta:
         abstract = True
 
@@ -38,15 +64,43 @@ class CachedEntity(models.Model):
 
         :return: string representing visibility, or PRIVATE if no versions found
         """
-        if self.versions.filter(visibility=Visibility.MODERATED).exists():
-            return Visibility.MODERATED
-        if self.versions.filter(visibility=Visibility.PUBLIC).exists():
-            return Visibility.PUBLIC
-        return Visibility.PRIVATE
+        return self.aggregate_visibility
 
-    @property
-    def latest_version(self):
-        return self.versions.latest()
+    @classmethod
+    def update_summaries(cls, pks):
+        """
+        Recalculate the stored visibility and latest version of some cached entities
+
+        This is done by a single UPDATE statement, so is consistent with the versions even if
+        they are being changed concurrently. It must be called whenever versions are added or
+        deleted, or change their timestamp or visibility. `CachedEntity.add_version`,
+        `CachedEntityVersion.set_visibility` and `populate_entity_cache` do this themselves.
+
+        :param pks: primary keys of the cached entities to update
+        """
+        versions = cls.CachedVersionClass.objects.filter(entity=OuterRef('pk'))
+        rank = Case(
+            When(visibility=Visibility.MODERATED, then=2),
+            When(visibility=Visibility.PUBLIC, then=1),
+            default=0,
+            output_field=models.IntegerField(),
+        )
+        cls.objects.filter(pk__in=pks).update(
+            latest_version=Subquery(versions.order_by('-timestamp', '-pk').values('pk')[:1]),
+            aggregate_visibility=Coalesce(
+                Subquery(versions.annotate(rank=rank).order_by('-rank').values('visibility')[:1]),
+                Value(Visibility.PRIVATE),
+            ),
+        )
+
+    def update_summary(self):
+        """
+        Recalculate the stored visibility and latest version of this entity
+
+        See `update_summaries`.
+        """
+        type(self).update_summaries([self.pk])
+        self.refresh_from_db(fields=['aggregate_visibility', 'latest_version'])
 
     def get_version(self, sha):
         """
@@ -58,11 +112,19 @@ class CachedEntity(models.Model):
         :return: CachedVersionClass object
         :raise: RepoCacheMiss if entity does not exist in cache, or has no versions
         """
+        identity_map = identitymap.current()
+        if identity_map is not None:
+            return identity_map.get_version(self, sha, self._lookup_version)
+        return self._lookup_version(sha)
+
+    def _lookup_version(self, sha):
         try:
             if sha == 'latest':
+                if self.latest_version is None:
+                    raise self.CachedVersionClass.DoesNotExist
                 return self.latest_version
             else:
-                return self.versions.get(sha=sha)
+                return versioncache.get_version(self, sha)
         except ObjectDoesNotExist:
             try:
                 return self.tags.get(tag=sha).version
@@ -76,9 +138,10 @@ class CachedEntity(models.Model):
         :return: first cached tag for this version, if any, or sha if not
         """
         version = self.get_version(sha)
-        if sha == 'latest' and version.tags.count() == 0:
+        name = version.get_name()
+        if sha == 'latest' and name == version.sha:
             return 'latest'
-        return version.get_name()
+        return name
 
     def add_version(self, sha):
         """
@@ -89,7 +152,7 @@ class CachedEntity(models.Model):
         """
         commit = self.entity.repo.get_commit(sha)
         visibility = self.entity.get_visibility_from_repo(commit)
-        return self.CachedVersionClass.objects.create(
+        version = self.CachedVersionClass.objects.create(
             entity=self,
             sha=commit.sha,
             message=commit.message,
@@ -99,7 +162,12 @@ class CachedEntity(models.Model):
             timestamp=commit.timestamp,
             visibility=visibility,
             has_readme=self.CachedVersionClass.README_NAME in commit.filenames,
+            display_name=commit.sha,
+            url_label=commit.sha,
         )
+        version.store_files(commit)
+        self.update_summary()
+        return version
 
 
 class CachedEntityVersion(VisibilityModelMixin):
@@ -109,8 +177,9 @@ class CachedEntityVersion(VisibilityModelMixin):
     Concrete cache types should inherit from this and define a suitable ``entity`` column, e.g.
         entity = models.ForeignKey(CachedModel, on_delete=models.CASCADE, related_name='versions')
 
-    They should also define the property:
+    They should also define the properties:
     - ``CachedTagClass`` referring to the concrete ``CachedEntityTagMixin`` they use
+    - ``CachedFileClass`` referring to the concrete ``CachedEntityFile`` they use
     """
     sha = models.CharField(max_length=40)
     timestamp = models.DateTimeField(help_text='When this commit was made')
@@ -127,6 +196,15 @@ class CachedEntityVersion(VisibilityModelMixin):
         default=False,
         help_text='Whether this entity version has a README file'
     )
+    # Labels derived from the version's tags, kept up to date by `update_labels`
+    display_name = models.CharField(
+        max_length=255, blank=True,
+        help_text='Name to show for this version: its first tag, or its SHA if untagged'
+    )
+    url_label = models.CharField(
+        max_length=255, blank=True,
+        help_text='Name to use in URLs for this version: its latest tag, or its SHA if untagged'
+    )
 
     # The name of a (possibly ephemeral) file containing documentation for the entity version
     README_NAME = 'readme.md'
@@ -149,6 +227,7 @@ class CachedEntityVersion(VisibilityModelMixin):
         """
         self.visibility = visibility
         self.save()
+        self.entity.update_summary()
 
     def tag(self, tagname):
         """
@@ -156,20 +235,94 @@ class CachedEntityVersion(VisibilityModelMixin):
 
         :param tagname: Tag name
         """
-        return self.CachedTagClass.objects.create(
+        tag = self.CachedTagClass.objects.create(
             entity=self.entity,
             version=self,
             tag=tagname,
         )
+        type(self).update_labels([self.pk], instances=[self])
+        return tag
+
+    @staticmethod
+    def get_labels(sha, tag_names):
+        """
+        Work out the labels for a version
+
+        :param sha: the version's SHA
+        :param tag_names: names of the version's tags, in the order they were added
+        :return: (display_name, url_label) tuple
+        """
+        display_name = tag_names[0] if tag_names else sha
+        # Tags that look like special version names aren't used in URLs
+        if tag_names and tag_names[-1] not in ['new', 'latest']:
+            url_label = tag_names[-1]
+        else:
+            url_label = sha
+        return display_name, url_label
+
+    @classmethod
+    def update_labels(cls, pks, instances=()):
+        """
+        Recalculate the stored labels of some versions from their tags
+
+        This must be called whenever tags are added or removed; `tag` does this automatically,
+        but bulk operations need to call it explicitly. Other objects for these versions
+        already in memory keep their old labels, so callers holding them should re-fetch them.
+
+        :param pks: primary keys of the versions to update
+        :param instances: version objects in memory whose labels should also be updated
+        """
+        tag_names = defaultdict(list)
+        tags = cls.CachedTagClass.objects.filter(version__in=pks).order_by('pk')
+        for version_pk, tag in tags.values_list('version_id', 'tag'):
+            tag_names[version_pk].append(tag)
+        changed = []
+        for version in cls.objects.filter(pk__in=pks).only('entity', 'sha', 'display_name', 'url_label'):
+            labels = cls.get_labels(version.sha, tag_names[version.pk])
+            if labels != (version.display_name, version.url_label):
+                version.display_name, version.url_label = labels
+                changed.append(version)
+        cls.objects.bulk_update(changed, ['display_name', 'url_label'])
+        for instance in instances:
+            instance.display_name, instance.url_label = cls.get_labels(instance.sha, tag_names[instance.pk])
+        # Bulk updates don't send signals, so forget any shared copies of these versions here
+        for version in changed:
+            versioncache.forget_state(cls.CachedEntityClass, version.entity_id, [version.sha])
+
+    def store_files(self, commit):
+        """
+        Record the files in this version, replacing any recorded previously
+
+        :param commit: the `repository.Commit` for this version
+        """
+        self.files.all().delete()
+        self.CachedFileClass.objects.bulk_create(self.CachedFileClass.for_commit(commit, version=self))
+
+    def get_files(self):
+        """
+        Get the files in this version
+
+        Versions cached before their files were recorded have them recorded now.
+
+        :return: list of ``CachedFileClass`` objects, in the order they were recorded
+        """
+        files = list(self.files.all())
+        if not files and self.numfiles:
+            self.store_files(self.entity.entity.repo.get_commit(self.sha))
+            files = list(self.files.all())
+        return files
 
     def get_name(self):
         """
         Get name for this version
         """
-        first_tag = self.tags.first()
-        if first_tag is not None:
-            return first_tag.tag
-        return self.sha
+        return self.display_name or self.sha
+
+    def get_url_label(self):
+        """
+        Get the label to use for this version in URLs
+        """
+        return self.url_label or self.sha
 
     def nice_version(self):
         """
@@ -199,17 +352,66 @@ class CachedEntityTag(models.Model):
         unique_together = ['entity', 'tag']
 
 
-def _set_class_links(entity_cache_type, version_cache_type, tag_cache_type):
-    """Set the CachedModelClass, CachedVersionClass and CachedTagClass property on each relevant class."""
+class CachedEntityFile(models.Model):
+    """
+    Abstract class representing a cache for a file (possibly ephemeral) in a version of any entity type.
+
+    Concrete cache types should inherit from this and define a suitable ``version`` column, e.g.
+        version = models.ForeignKey(CachedModelVersion, on_delete=models.CASCADE, related_name='files')
+    """
+    name = models.TextField(help_text='Path of the file within the commit')
+    size = models.BigIntegerField(help_text='Size of the file in bytes')
+    blob_sha = models.CharField(max_length=40, help_text='SHA of the git blob holding the file contents')
+    filetype = models.CharField(max_length=32, help_text='File type, as given by core.filetypes')
+    ephemeral = models.BooleanField(default=False, help_text='Whether this is an ephemeral file stored as a git note')
+
+    class Meta:
+        abstract = True
+        unique_together = ['version', 'name']
+        ordering = ['pk']
+
+    def __str__(self):
+        return self.name
+
+    @classmethod
+    def for_commit(cls, commit, **kwargs):
+        """
+        Make (unsaved) cache entries for all files in a commit
+
+        :param commit: `repository.Commit` object
+        :param kwargs: further field values for each entry, typically ``version`` or ``version_id``
+        :return: list of ``cls`` objects
+        """
+        ephemeral_names = commit.ephemeral_file_names
+        return [
+            cls(
+                name=blob.path,
+                size=blob.size,
+                blob_sha=blob.hexsha,
+                filetype=get_file_type(blob.path),
+                ephemeral=blob.path in ephemeral_names,
+                **kwargs
+            )
+            for blob in commit.files
+        ]
+
+
+def _set_class_links(entity_cache_type, version_cache_type, tag_cache_type, file_cache_type):
+    """Set the CachedEntityClass, CachedVersionClass, CachedTagClass and CachedFileClass property on each class."""
     entity_cache_type.CachedVersionClass = version_cache_type
     entity_cache_type.CachedTagClass = tag_cache_type
+    entity_cache_type.CachedFileClass = file_cache_type
 
     version_cache_type.CachedEntityClass = entity_cache_type
     version_cache_type.CachedTagClass = tag_cache_type
+    version_cache_type.CachedFileClass = file_cache_type
 
     tag_cache_type.CachedEntityClass = entity_cache_type
     tag_cache_type.CachedVersionClass = version_cache_type
 
+    file_cache_type.CachedEntityClass = entity_cache_type
+    file_cache_type.CachedVersionClass = version_cache_type
+
 
 class CachedEntityVersionManager(models.Manager):
     def visible_to_user(self, user):
@@ -223,10 +425,7 @@ class CachedEntityVersionManager(models.Manager):
         non_private = self.filter(visibility__in=['public', 'moderated'])
 
         if user.is_authenticated:
-            shared_pks = get_objects_for_user(
-                user, 'entities.edit_entity', with_superuser=False
-            ).values_list('pk', flat=True)
-            shared = self.filter(entity__entity__pk__in=shared_pks)
+            shared = self.filter(entity__entity__pk__in=shared_pks(user, 'entities.edit_entity'))
             owned = self.filter(entity__entity__author=user)
         else:
             shared = self.none()
@@ -243,6 +442,8 @@ class CachedEntityVersionManager(models.Manager):
 class CachedModel(CachedEntity):
     """Cache for a CellML model's repository."""
     entity = models.OneToOneField('entities.ModelEntity', on_delete=models.CASCADE, related_name='cachedmodel')
+    latest_version = models.ForeignKey(
+        'CachedModelVersion', null=True, blank=True, on_delete=models.SET_NULL, related_name='+')
 
 
 class CachedModelVersion(CachedEntityVersion):
@@ -262,12 +463,19 @@ class CachedModelTag(CachedEntityTag):
     version = models.ForeignKey(CachedModelVersion, on_delete=models.CASCADE, related_name='tags')
 
 
-_set_class_links(CachedModel, CachedModelVersion, CachedModelTag)
+class CachedModelFile(CachedEntityFile):
+    """Cache for a file in a version of a CellML model's repository."""
+    version = models.ForeignKey(CachedModelVersion, on_delete=models.CASCADE, related_name='files')
+
+
+_set_class_links(CachedModel, CachedModelVersion, CachedModelTag, CachedModelFile)
 
 
 class CachedProtocol(CachedEntity):
     """Cache for a protocol's repository."""
     entity = models.OneToOneField('entities.ProtocolEntity', on_delete=models.CASCADE, related_name='cachedprotocol')
+    latest_version = models.ForeignKey(
+        'CachedProtocolVersion', null=True, blank=True, on_delete=models.SET_NULL, related_name='+')
 
 
 class CachedProtocolVersion(CachedEntityVersion):
@@ -287,12 +495,19 @@ class CachedProtocolTag(CachedEntityTag):
     version = models.ForeignKey(CachedProtocolVersion, on_delete=models.CASCADE, related_name='tags')
 
 
-_set_class_links(CachedProtocol, CachedProtocolVersion, CachedProtocolTag)
+class CachedProtocolFile(CachedEntityFile):
+    """Cache for a file in a version of a protocol's repository."""
+    version = models.ForeignKey(CachedProtocolVersion, on_delete=models.CASCADE, related_name='files')
+
+
+_set_class_links(CachedProtocol, CachedProtocolVersion, CachedProtocolTag, CachedProtocolFile)
 
 
 class CachedFittingSpec(CachedEntity):
     """Cache for a fitting specifications's repository."""
     entity = models.OneToOneField('fitting.FittingSpec', on_delete=models.CASCADE, related_name='cachedfittingspec')
+    latest_version = models.ForeignKey(
+        'CachedFittingSpecVersion', null=True, blank=True, on_delete=models.SET_NULL, related_name='+')
 
 
 class CachedFittingSpecVersion(CachedEntityVersion):
@@ -312,7 +527,12 @@ class CachedFittingSpecTag(CachedEntityTag):
     version = models.ForeignKey(CachedFittingSpecVersion, on_delete=models.CASCADE, related_name='tags')
 
 
-_set_class_links(CachedFittingSpec, CachedFittingSpecVersion, CachedFittingSpecTag)
+class CachedFittingSpecFile(CachedEntityFile):
+    """Cache for a file in a version of a fitting specifications's repository."""
+    version = models.ForeignKey(CachedFittingSpecVersion, on_delete=models.CASCADE, related_name='files')
+
+
+_set_class_links(CachedFittingSpec, CachedFittingSpecVersion, CachedFittingSpecTag, CachedFittingSpecFile)
 
 
 CACHE_TYPE_MAP = {
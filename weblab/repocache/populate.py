@@ -1,85 +1,236 @@
+from collections import defaultdict
+
 from django.db import transaction
 
+from . import identitymap, signals, versioncache
 from .models import get_or_create_cached_entity
 
 
-@transaction.atomic
-def populate_entity_cache(entity):
-    """
-    Process the repository of the given entity, adding the relevant cache entries,
-    according to entity type.
+# Fields of a cached version that are copied from its commit
+VERSION_FIELDS = ['timestamp', 'message', 'master_filename', 'author', 'numfiles', 'visibility']
 
-    :param entity: entity to process
+
+def _commit_fields(commit):
+    return {
+        'timestamp': commit.timestamp,
+        'message': commit.message,
+        'master_filename': commit.master_filename,
+        'author': commit.author.name,
+        'numfiles': len(commit.filenames),
+    }
+
+
+def _resolve_visibilities(entity, commits):
     """
-    cached, cache_created = get_or_create_cached_entity(entity)
+    Find the visibility of each of a list of commits, newest first
 
-    tag_dict = entity.repo.tag_dict
+    A commit with no visibility in the repo takes that of the nearest earlier commit which has
+    one, and this visibility is then stored in the repo for it.
 
-    visibility = entity.DEFAULT_VISIBILITY
-    commits_without_visibility = []
-    valid_shas = set()
-    for commit in entity.repo.commits:
-        valid_shas.add(commit.sha)
+    :param entity: entity the commits belong to
+    :param commits: list of `repository.Commit` objects, each the parent of the one before
+    :return: (visibilities, pending) tuple, where visibilities is a list giving the visibility of
+        each commit (or None if not yet known), and pending lists the indices of the oldest
+        commits, which have no visibility since no earlier commit had one
+    """
+    visibilities = []
+    pending = []
+    for i, commit in enumerate(commits):
         visibility = entity.get_visibility_from_repo(commit)
-        version = cached.CachedVersionClass.objects.get_or_create(
-            entity=cached,
-            sha=commit.sha,
-            defaults={
-                'timestamp': commit.timestamp,
-                'message': commit.message,
-                'master_filename': commit.master_filename,
-                'author': commit.author.name,
-                'numfiles': len(commit.filenames),
-                'visibility': visibility or entity.DEFAULT_VISIBILITY,
-            }
-        )[0]
-        # Check if any updates are needed to an already-present cached version
-        if commit.message != version.message:
-            version.message = commit.message
-            version.save()
-        if commit.master_filename != version.master_filename:
-            version.master_filename = commit.master_filename
-            version.save()
-        if commit.author.name != version.author:
-            version.author = commit.author.name
-            version.save()
-        if len(commit.filenames) != version.numfiles:
-            version.numfiles = len(commit.filenames)
-            version.save()
-
-        if visibility and visibility != version.visibility:
-            version.visibility = visibility
-            version.save()
-
-        # If the commit has no visibility info in the repo, remember this
-        # and wait until we find visibility on an earlier commit (which
-        # will be encountered later since we are iterating backwards through
-        # commits)
+        visibilities.append(visibility)
         if visibility:
             # Apply this commit's visibility to all those later (previously
             # encountered) commits which have no visibility info
-            for sha in commits_without_visibility:
-                entity.set_version_visibility(sha, visibility)
-            commits_without_visibility = []
+            for j in pending:
+                visibilities[j] = visibility
+                entity.set_visibility_in_repo(commits[j], visibility)
+            pending = []
         else:
-            commits_without_visibility.append(commit.sha)
+            pending.append(i)
+    return visibilities, pending
+
 
-        cached.versions.add(version)
+def _store_versions(cached, commits, visibilities, existing):
+    """
+    Create or update the cached versions for some commits, in bulk
 
-        # Store any tags related to this commit
-        for tag in tag_dict.get(commit.sha, []):
-            cached.tags.add(
-                cached.CachedTagClass.objects.get_or_create(
-                    entity=cached,
-                    tag=tag.name,
-                    defaults={'version': version},
-                )[0])
+    :param cached: `CachedEntity` to store versions in
+    :param commits: list of `repository.Commit` objects
+    :param visibilities: the visibility of each commit, or None to leave an existing version's
+        visibility alone (and give new versions the default)
+    :param existing: dict mapping SHAs to already cached versions
+    """
+    default_visibility = cached.entity.DEFAULT_VISIBILITY
+    to_create = []
+    to_update = []
+    for commit, visibility in zip(commits, visibilities):
+        fields = _commit_fields(commit)
+        version = existing.get(commit.sha)
+        if version is None:
+            to_create.append(cached.CachedVersionClass(
+                entity=cached, sha=commit.sha, visibility=visibility or default_visibility,
+                display_name=commit.sha, url_label=commit.sha, **fields))
+            continue
+        if visibility:
+            fields['visibility'] = visibility
+        if any(getattr(version, name) != value for name, value in fields.items()):
+            for name, value in fields.items():
+                setattr(version, name, value)
+            to_update.append(version)
+    cached.CachedVersionClass.objects.bulk_create(to_create)
+    cached.CachedVersionClass.objects.bulk_update(to_update, VERSION_FIELDS)
+    versioncache.forget_versions(cached, [version.sha for version in to_update])
+
+
+def _store_files(cached, commits):
+    """
+    Make the cached files of the versions for some commits match those commits, in bulk
+
+    :param cached: `CachedEntity` the versions belong to
+    :param commits: list of `repository.Commit` objects, all of which have cached versions
+    """
+    version_pks = dict(cached.versions.filter(sha__in=[commit.sha for commit in commits]).values_list('sha', 'pk'))
+    stored = defaultdict(set)
+    for version_pk, name, blob_sha, ephemeral in cached.CachedFileClass.objects.filter(
+            version_id__in=version_pks.values()).values_list('version_id', 'name', 'blob_sha', 'ephemeral'):
+        stored[version_pk].add((name, blob_sha, ephemeral))
+    stale = []
+    to_create = []
+    for commit in commits:
+        version_pk = version_pks[commit.sha]
+        files = cached.CachedFileClass.for_commit(commit, version_id=version_pk)
+        if {(file_.name, file_.blob_sha, file_.ephemeral) for file_ in files} != stored[version_pk]:
+            stale.append(version_pk)
+            to_create.extend(files)
+    # Nothing refers to cached files, so they can be deleted in one statement
+    stale_files = cached.CachedFileClass.objects.filter(version_id__in=stale)
+    stale_files._raw_delete(stale_files.db)
+    cached.CachedFileClass.objects.bulk_create(to_create)
+
+
+def _store_tags(cached, tag_dict):
+    """
+    Make the cached tags match those in the repo, in bulk
+
+    :param cached: `CachedEntity` to store tags in
+    :param tag_dict: dict mapping commit SHAs to their tags, as from `Repository.tag_dict`
+    """
+    version_pks = dict(cached.versions.filter(sha__in=tag_dict).values_list('sha', 'pk'))
+    wanted = {
+        tag.name: sha
+        for sha, tags in tag_dict.items()
+        if sha in version_pks
+        for tag in tags
+    }
+    stale = []
+    changed_versions = set()
+    for pk, tag, version_pk in cached.tags.values_list('pk', 'tag', 'version_id'):
+        if version_pks.get(wanted.get(tag)) == version_pk:
+            del wanted[tag]  # Already cached
+        else:
+            stale.append(pk)
+            changed_versions.add(version_pk)
+    # Nothing refers to tags either, and the labels of their versions are updated below
+    stale_tags = cached.tags.filter(pk__in=stale)
+    stale_tags._raw_delete(stale_tags.db)
+    cached.CachedTagClass.objects.bulk_create(
+        cached.CachedTagClass(entity=cached, tag=tag, version_id=version_pks[sha])
+        for tag, sha in wanted.items()
+    )
+    changed_versions.update(version_pks[sha] for sha in wanted.values())
+    # This also forgets the shared state of the versions, since bulk changes don't send signals
+    cached.CachedVersionClass.update_labels(changed_versions)
 
-    # Purge cache of stale entries, if any
+
+def _populate_new_commits(entity, cached):
+    """
+    Add to the cache just the commits made since it was last populated
+
+    :return: False if this was not possible because the cache is empty or history was
+        rewritten, True otherwise
+    """
+    cached_shas = set(cached.versions.values_list('sha', flat=True))
+    if not cached_shas:
+        return False
+
+    # Walk back from the latest commit to the first that is already cached
+    new_commits = []
+    for commit in entity.repo.commits:
+        if commit.sha in cached_shas:
+            boundary = commit
+            break
+        new_commits.append(commit)
+    else:
+        return False
+    # The cache must hold exactly the history of that commit
+    if entity.repo.count_commits(boundary.sha) != len(cached_shas):
+        return False
+
+    visibilities, pending = _resolve_visibilities(entity, new_commits)
+    if pending:
+        # New commits inherit the visibility of the latest cached one
+        visibility = cached.versions.get(sha=boundary.sha).visibility
+        store_in_repo = bool(entity.get_visibility_from_repo(boundary))
+        for i in pending:
+            visibilities[i] = visibility
+            if store_in_repo:
+                entity.set_visibility_in_repo(new_commits[i], visibility)
+    _store_versions(cached, new_commits, visibilities, {})
+    _store_files(cached, new_commits)
+    _store_tags(cached, entity.repo.tag_dict)
+    return True
+
+
+def _populate_all_commits(entity, cached, cache_created):
+    """
+    Check every commit in the repository against the cache, removing any stale cache entries
+    """
+    commits = list(entity.repo.commits)
+    visibilities, _ = _resolve_visibilities(entity, commits)
+    existing = {version.sha: version for version in cached.versions.all()}
+    _store_versions(cached, commits, visibilities, existing)
+    _store_files(cached, commits)
+
+    # Purge cache of stale entries, if any. Results of these versions must be deleted with them,
+    # so this can't be a raw delete, but the deleted versions are forgotten all at once.
     if not cache_created:
-        for cached_version in cached.versions.all():
-            if cached_version.sha not in valid_shas:
-                cached_version.delete()
-        for cached_tag in cached.tags.all().select_related('version'):
-            if cached_tag.version.sha not in tag_dict:
-                cached_tag.delete()
+        stale = cached.versions.exclude(sha__in=[commit.sha for commit in commits])
+        stale_shas = list(stale.values_list('sha', flat=True))
+        if stale_shas:
+            with signals.suppressed():
+                stale.delete()
+            versioncache.forget_versions(cached, stale_shas)
+    _store_tags(cached, entity.repo.tag_dict)
+
+
+@transaction.atomic
+def populate_entity_cache(entity, incremental=False):
+    """
+    Process the repository of the given entity, adding the relevant cache entries,
+    according to entity type.
+
+    By default every commit is checked, so that existing cache entries are also brought up
+    to date (e.g. when new properties are added to the cache). In incremental mode only
+    commits made since the latest cached commit are read; if history has been rewritten since
+    the cache was populated, all commits are checked anyway.
+
+    :param entity: entity to process
+    :param incremental: whether to add only new commits to the cache
+    """
+    cached, cache_created = get_or_create_cached_entity(entity)
+    # Update the entity's own copy of the cache, if it has one, rather than leaving it stale
+    cache_field = type(cached)._meta.get_field('entity').remote_field
+    if not cache_created and cache_field.is_cached(entity) and cache_field.get_cached_value(entity) is not None:
+        cached = cache_field.get_cached_value(entity)
+    if not (incremental and not cache_created and _populate_new_commits(entity, cached)):
+        _populate_all_commits(entity, cached, cache_created)
+
+    cached.update_summary()
+    identity_map = identitymap.current()
+    if identity_map is not None:
+        identity_map.versions_changed(type(cached), cached.pk)
+
+    # Taken last, since populating can add visibility notes
+    cached.ref_fingerprint = entity.repo.ref_fingerprint
+    cached.save(update_fields=['ref_fingerprint'])
+
@@ -0,0 +1,51 @@
+import contextlib
+import contextvars
+
+from . import identitymap, versioncache
+
+
+_suppressed = contextvars.ContextVar('repocache_signals_suppressed', default=False)
+
+
+@contextlib.contextmanager
+def suppressed():
+    """
+    Context manager within whose block the callbacks here do nothing
+
+    This is for bulk changes, which must then forget the versions concerned themselves.
+    """
+    token = _suppressed.set(True)
+    try:
+        yield
+    finally:
+        _suppressed.reset(token)
+
+
+def version_changed(sender, instance, **kwargs):
+    """
+    Signal callback when a cached entity version has been saved or deleted.
+
+    Forgets any shared copy of its state. The stored summary of its entity's versions is not
+    updated here, but explicitly by whatever changed it (see `CachedEntity.update_summaries`).
+    """
+    if _suppressed.get():
+        return
+    versioncache.forget_state(sender.CachedEntityClass, instance.entity_id, [instance.sha])
+    identity_map = identitymap.current()
+    if identity_map is not None:
+        identity_map.version_changed(instance)
+
+
+def tag_changed(sender, instance, **kwargs):
+    """
+    Signal callback when a cached entity tag has been saved or deleted.
+
+    Forgets any shared copy of the state of the version it refers to.
+    """
+    if _suppressed.get():
+        return
+    try:
+        sha = instance.version.sha
+    except sender.CachedVersionClass.DoesNotExist:
+        return  # The version is being deleted, and so is forgotten anyway
+    versioncache.forget_state(sender.CachedEntityClass, instance.entity_id, [sha])
@@ -1,9 +1,11 @@
 from unittest.mock import call, patch
 
 import pytest
+from django.core.management.base import CommandError
 
 from core import recipes
 from repocache.management.commands.populate_entity_cache import Command as PopulateCommand
+from repocache.populate import populate_entity_cache
 
 
 @pytest.mark.django_db
@@ -12,17 +14,79 @@ def test_populate_all_entities(mock_populate):
     m1, m2 = recipes.model.make(_quantity=2)
     p1, p2 = recipes.protocol.make(_quantity=2)
 
-    PopulateCommand().handle()
+    PopulateCommand().handle(jobs=1)
 
     assert mock_populate.call_count == 4
     mock_populate.assert_has_calls(
-        [call(m1), call(m2), call(p1), call(p2)],
+        [call(m1, incremental=False), call(m2, incremental=False),
+         call(p1, incremental=False), call(p2, incremental=False)],
         any_order=True
     )
 
     mock_populate.reset_mock()
 
-    PopulateCommand().handle(entity_id=[m1.pk, p1.pk])
+    PopulateCommand().handle(entity_id=[m1.pk, p1.pk], jobs=1)
 
     assert mock_populate.call_count == 2
-    mock_populate.assert_has_calls([call(m1), call(p1)], any_order=True)
+    mock_populate.assert_has_calls([call(m1, incremental=False), call(p1, incremental=False)], any_order=True)
+
+    mock_populate.reset_mock()
+
+    PopulateCommand().handle(entity_id=[m1.pk], incremental=True, jobs=1)
+
+    mock_populate.assert_called_once_with(m1, incremental=True)
+
+
+@pytest.mark.django_db
+def test_skips_unchanged_repositories(helpers, capsys):
+    model = recipes.model.make()
+    helpers.add_version(model)
+    assert model.repocache.ref_fingerprint == model.repo.ref_fingerprint
+
+    with patch('repocache.management.commands.populate_entity_cache.populate_entity_cache') as mock_populate:
+        PopulateCommand().handle(jobs=1)
+        mock_populate.assert_not_called()
+        assert 'unchanged' in capsys.readouterr().out
+
+        PopulateCommand().handle(jobs=1, force=True)
+        mock_populate.assert_called_once_with(model, incremental=False)
+
+        # Tags and notes change the fingerprint, as well as commits
+        mock_populate.reset_mock()
+        model.repo.tag('v1')
+        PopulateCommand().handle(jobs=1)
+        mock_populate.assert_called_once_with(model, incremental=False)
+
+        mock_populate.reset_mock()
+        populate_entity_cache(model)
+        model.set_visibility_in_repo(model.repo.latest_commit, 'public')
+        PopulateCommand().handle(jobs=1)
+        mock_populate.assert_called_once_with(model, incremental=False)
+
+
+@pytest.mark.django_db
+def test_reports_failures(helpers, capsys):
+    model = recipes.model.make()
+    helpers.add_version(model)
+
+    with patch('repocache.management.commands.populate_entity_cache.populate_entity_cache',
+               side_effect=RuntimeError('broken')):
+        with pytest.raises(CommandError, match='1 of 1 repositories failed'):
+            PopulateCommand().handle(jobs=1, force=True)
+
+    output = capsys.readouterr()
+    assert '[1/1] model {}: failed: RuntimeError: broken'.format(model.name) in output.err
+    assert 'Traceback (most recent call last)' in output.err
+    assert 'Processed 0 of 1 repositories (0 unchanged, 1 failed)' in output.out
+
+
+@pytest.mark.django_db(transaction=True)
+def test_populates_in_worker_processes(helpers, capsys):
+    models = recipes.model.make(_quantity=3)
+    commits = [helpers.add_version(model, cache=False) for model in models]
+
+    PopulateCommand().handle(jobs=2)
+
+    assert 'Processed 3 of 3 repositories (0 unchanged, 0 failed)' in capsys.readouterr().out
+    for model, commit in zip(models, commits):
+        assert model.repocache.latest_version.sha == commit.sha
@@ -0,0 +1,69 @@
+import logging
+
+import pytest
+
+from core import recipes
+from repocache import identitymap
+from repocache.exceptions import RepoCacheMiss
+
+
+@pytest.mark.django_db
+class TestIdentityMap:
+    def test_inactive_by_default(self, model_with_version):
+        assert identitymap.current() is None
+        assert model_with_version.repocache is not model_with_version.repocache
+
+    def test_fetches_each_entity_once(self, model_with_version, django_assert_num_queries):
+        with identitymap.activate() as identity_map:
+            cached = model_with_version.repocache
+            with django_assert_num_queries(0):
+                assert model_with_version.repocache is cached
+                assert model_with_version.repocache is cached
+
+        assert (identity_map.hits, identity_map.misses) == (2, 1)
+        assert identitymap.current() is None
+
+    def test_fetches_each_version_once(self, model_with_version, django_assert_num_queries):
+        sha = model_with_version.repo.latest_commit.sha
+        with identitymap.activate() as identity_map:
+            cached = model_with_version.repocache
+            version = cached.get_version(sha)
+            with django_assert_num_queries(0):
+                assert cached.get_version(sha) is version
+                assert model_with_version.get_version_visibility(sha) == version.visibility
+
+            # Misses aren't remembered
+            with pytest.raises(RepoCacheMiss):
+                cached.get_version('v1')
+            model_with_version.add_tag('v1', sha)
+            assert cached.get_version('v1') == version
+
+        assert identity_map.hits == 5
+
+    def test_forgets_changed_versions(self, helpers):
+        model = recipes.model.make()
+        v1 = helpers.add_version(model, visibility='private')
+        with identitymap.activate():
+            cached = model.repocache
+            assert cached.get_version('latest').sha == v1.sha
+            assert cached.visibility == 'private'
+
+            version = cached.get_version(v1.sha)
+            version.set_visibility('public')
+            assert cached.visibility == 'public'
+            assert cached.get_version(v1.sha) is not version
+
+            v2 = cached.CachedVersionClass.objects.create(
+                entity=cached, sha='0' * 40, timestamp=version.timestamp.replace(year=2100), visibility='private')
+            cached.update_summary()
+            assert cached.get_version('latest') == v2
+            assert cached.latest_version == v2
+
+    def test_middleware_logs_hits(self, client, public_model, caplog):
+        with caplog.at_level(logging.DEBUG, logger='repocache.middleware'):
+            client.get('/entities/models/%d' % public_model.pk)
+
+        assert identitymap.current() is None
+        message = caplog.records[-1].getMessage()
+        assert message.startswith('GET /entities/models/%d: repocache identity map had ' % public_model.pk)
+        assert not message.endswith('had 0 hits and 0 misses')
@@ -1,6 +1,9 @@
-import pytest
 import time
+from datetime import timedelta
+
+import pytest
 from django.db.utils import IntegrityError
+from django.utils.timezone import now
 
 from core import recipes
 from repocache.exceptions import RepoCacheMiss
@@ -138,6 +141,14 @@ class TestEntityCacheModelsVisibility:
         assert version.author == commit.author.name
         assert version.numfiles == len(commit.filenames)
         assert version.visibility == 'public'
+        assert [f.name for f in version.files.all()] == ['file1.txt']
+
+    def test_get_files_fills_in_missing_files(self, model_with_version):
+        version = model_with_version.repocache.latest_version
+        version.files.all().delete()
+
+        assert [f.name for f in version.get_files()] == ['file1.txt']
+        assert version.files.count() == 1
 
     def test_get_name_for_version(self, helpers):
         model = recipes.model.make()
@@ -155,12 +166,35 @@ class TestEntityCacheModelsVisibility:
         with pytest.raises(RepoCacheMiss):
             model.repocache.get_name_for_version('random value')
 
+    def test_labels(self, helpers, django_assert_num_queries):
+        model = recipes.model.make()
+        commit = helpers.add_version(model, visibility='public')
+        version = model.repocache.get_version(commit.sha)
+        assert (version.get_name(), version.get_url_label()) == (commit.sha, commit.sha)
+
+        # Tags added through other objects are seen when the version is fetched again
+        model.add_tag('v1', commit.sha)
+        model.add_tag('v2', commit.sha)
+        version = model.repocache.get_version(commit.sha)
+        assert (version.display_name, version.url_label) == ('v1', 'v2')
+
+        # Tagging a version updates its labels in memory too
+        version.tag('latest')
+        with django_assert_num_queries(0):
+            assert (version.get_name(), version.get_url_label()) == ('v1', commit.sha)
+
+        # Repopulating removes the tag which isn't in the repository
+        populate_entity_cache(model)
+        version.refresh_from_db()
+        assert (version.get_name(), version.get_url_label()) == ('v1', 'v2')
+
     def test_nice_version(self, model_with_version):
         version = model_with_version.cachedentity.latest_version
         assert version.nice_version() == '%s...' % version.sha[:8]
 
         model_with_version.repo.tag('v1')
         populate_entity_cache(model_with_version)
+        version.refresh_from_db()  # The name is stored in the version
         assert version.nice_version() == 'v1'
 
 
@@ -219,3 +253,57 @@ class TestCachedEntityVersionVisibleToUser:
             own_moderated_version, own_public_version,
             other_moderated_version, other_public_version,
         }
+
+
+@pytest.mark.django_db
+class TestCachedEntitySummary:
+    def test_no_versions(self):
+        cached = recipes.cached_model.make()
+
+        assert cached.aggregate_visibility == 'private'
+        assert cached.latest_version is None
+        with pytest.raises(RepoCacheMiss):
+            cached.get_version('latest')
+
+    def test_follows_version_changes(self):
+        cached = recipes.cached_model.make()
+        v1 = recipes.cached_model_version.make(entity=cached, visibility='public', timestamp=now())
+        v2 = recipes.cached_model_version.make(
+            entity=cached, visibility='private', timestamp=now() + timedelta(seconds=1))
+
+        cached.refresh_from_db()
+        assert cached.aggregate_visibility == 'public'
+        assert cached.latest_version == v2
+
+        v2.entity.refresh_from_db()
+        v2.set_visibility('moderated')
+        assert v2.entity.aggregate_visibility == 'moderated'
+
+        # Deleting versions needs the summary updating explicitly
+        v2.delete()
+        cached.update_summary()
+        assert cached.aggregate_visibility == 'public'
+        assert cached.latest_version == v1
+
+        v1.delete()
+        cached.update_summary()
+        assert cached.aggregate_visibility == 'private'
+        assert cached.latest_version is None
+
+    def test_update_summaries_after_bulk_changes(self):
+        cached = recipes.cached_model.make()
+        version = recipes.cached_model_version.make(entity=cached, visibility='private')
+        CachedModelVersion.objects.filter(pk=version.pk).update(visibility='public')
+        cached.refresh_from_db()
+        assert cached.aggregate_visibility == 'private'
+
+        CachedModel.update_summaries([cached.pk])
+        cached.refresh_from_db()
+        assert cached.aggregate_visibility == 'public'
+
+    def test_usable_in_querysets(self):
+        public = recipes.cached_model_version.make(visibility='public').entity
+        recipes.cached_model_version.make(visibility='private')
+
+        assert list(CachedModel.objects.filter(aggregate_visibility='public')) == [public]
+        assert CachedModel.objects.filter(latest_version__visibility='public').get() == public
@@ -1,8 +1,14 @@
-import pytest
 import time
+from unittest.mock import patch
+
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 
 from accounts.models import User
 from core import recipes
+from experiments.models import Experiment
+from repocache.models import CachedModelFile
 from repocache.populate import populate_entity_cache
 
 
@@ -56,6 +62,27 @@ class TestPopulate:
         assert not cached.versions.exists()
         assert not cached.tags.exists()
 
+    def test_purges_stale_versions_in_bulk(self, helpers):
+        model = recipes.model.make()
+        commit = helpers.add_version(model, visibility='public', tag_name='v1')
+        cached = model.repocache
+        stale = recipes.cached_model_version.make(entity=cached, visibility='moderated', _quantity=5)
+        for i, version in enumerate(stale):
+            recipes.cached_model_tag.make(entity=cached, version=version, tag='stale%d' % i)
+        experiment = recipes.experiment.make(model=model, model_version=stale[0])
+        assert cached.aggregate_visibility == 'moderated'
+
+        # Signals aren't handled for each version or tag deleted
+        with patch('repocache.versioncache.forget_state') as forget_state:
+            populate_entity_cache(model)
+        forget_state.assert_not_called()
+
+        assert list(cached.versions.values_list('sha', flat=True)) == [commit.sha]
+        assert list(cached.tags.values_list('tag', flat=True)) == ['v1']
+        assert not Experiment.objects.filter(pk=experiment.pk).exists()
+        cached.refresh_from_db()
+        assert cached.aggregate_visibility == 'public'
+
     def test_migration_adds_new_properties(self, model_with_version):
         # Make sure that deploying after adding new commit properties to the cache will update
         # existing cache entries. We can't (easily) create old-style cache entries, but we can
@@ -120,3 +147,130 @@ class TestPopulate:
         assert v1.get_note() == 'Visibility: public'
         assert v2.get_note() == 'Visibility: public'
         assert v3.get_note() == 'Visibility: public'
+
+    def test_moves_tags(self, helpers):
+        model = recipes.model.make()
+        v1 = helpers.add_version(model, cache=False)
+        model.repo.tag('v1')
+        v2 = helpers.add_version(model, cache=False)
+        populate_entity_cache(model)
+        assert model.repocache.get_version('v1').sha == v1.sha
+
+        model.repo._repo.git.tag('-f', 'v1', v2.sha)
+        model.repo.tag('v2')
+        populate_entity_cache(model)
+
+        assert model.repocache.get_version('v1').sha == v2.sha
+        assert model.repocache.get_version('v2').sha == v2.sha
+        assert model.repocache.tags.count() == 2
+
+    def test_stores_files(self, helpers):
+        model = recipes.model.make()
+        v1 = helpers.add_version(model, cache=False)
+        v1.add_ephemeral_file('errors.txt', b'oops')
+        v2 = helpers.add_version(model, filename='file2.txt', contents='more contents', cache=False)
+        populate_entity_cache(model)
+
+        files = model.repocache.get_version(v1.sha).get_files()
+        assert [(f.name, f.size, f.blob_sha, f.filetype, f.ephemeral) for f in files] == [
+            ('file1.txt', 15, v1.get_blob('file1.txt').hexsha, 'TXTPROTOCOL', False),
+            ('errors.txt', 4, v1.get_blob('errors.txt').hexsha, 'TXTPROTOCOL', True),
+        ]
+        files = model.repocache.get_version(v2.sha).get_files()
+        assert [(f.name, f.size) for f in files] == [('file1.txt', 15), ('file2.txt', 13)]
+
+        # Files are only re-stored if they change
+        v1_file_pks = set(model.repocache.get_version(v1.sha).files.values_list('pk', flat=True))
+        v2.add_ephemeral_file('readme.md', b'docs')
+        populate_entity_cache(model)
+        assert set(model.repocache.get_version(v1.sha).files.values_list('pk', flat=True)) == v1_file_pks
+        files = model.repocache.get_version(v2.sha).get_files()
+        assert [(f.name, f.ephemeral) for f in files] == [
+            ('file1.txt', False), ('file2.txt', False), ('readme.md', True)]
+
+
+@pytest.mark.django_db
+class TestPopulateIncremental:
+    def test_adds_new_commits_only(self, helpers):
+        model = recipes.model.make()
+        v1 = helpers.add_version(model, visibility='public', cache=False)
+        populate_entity_cache(model)
+        cached_v1 = model.repocache.get_version(v1.sha)
+        cached_v1.message = 'edited'
+        cached_v1.save()
+
+        v2 = helpers.add_version(model, message='v2', cache=False)
+        model.repo.tag('v2')
+        v3 = helpers.add_version(model, message='v3', cache=False)
+        populate_entity_cache(model, incremental=True)
+
+        cached = model.repocache
+        assert {v.sha for v in cached.versions.all()} == {v1.sha, v2.sha, v3.sha}
+        assert cached.get_version(v1.sha).message == 'edited'  # Existing versions aren't re-read
+        assert cached.get_version(v3.sha).message == 'v3'
+        assert cached.get_version(v3.sha).numfiles == len(v3.filenames)
+        assert cached.get_version(v3.sha).files.count() == len(v3.filenames)
+        assert cached.get_version('v2').sha == v2.sha
+
+        # New commits inherit the latest cached visibility, which is stored in the repo
+        assert cached.get_version(v2.sha).visibility == 'public'
+        assert cached.get_version(v3.sha).visibility == 'public'
+        assert v3.get_note() == 'Visibility: public'
+
+    def test_reads_files_of_new_commits_only(self, helpers):
+        model = recipes.model.make()
+        helpers.add_version(model)
+        v2 = helpers.add_version(model, filename='file2.txt', cache=False)
+
+        with CaptureQueriesContext(connection) as queries:
+            populate_entity_cache(model, incremental=True)
+
+        version_pk = model.repocache.get_version(v2.sha).pk
+        file_selects = [
+            query['sql'] for query in queries.captured_queries
+            if query['sql'].startswith('SELECT') and 'FROM "%s"' % CachedModelFile._meta.db_table in query['sql']
+        ]
+        assert file_selects
+        assert all('"version_id" IN (%d)' % version_pk in sql for sql in file_selects)
+
+    def test_nothing_new(self, model_with_version):
+        populate_entity_cache(model_with_version)
+        model_with_version.repo.tag('v1')
+
+        with patch('repocache.populate._store_versions') as store_versions:
+            populate_entity_cache(model_with_version, incremental=True)
+            store_versions.assert_called_once_with(model_with_version.repocache, [], [], {})
+        assert model_with_version.repocache.get_version('v1').sha == model_with_version.repo.latest_commit.sha
+
+    def test_first_population_is_full(self, helpers):
+        model = recipes.model.make()
+        v1 = helpers.add_version(model, cache=False)
+        v2 = helpers.add_version(model, cache=False)
+
+        populate_entity_cache(model, incremental=True)
+
+        assert {v.sha for v in model.repocache.versions.all()} == {v1.sha, v2.sha}
+
+    def test_rewritten_history_falls_back_to_full(self, helpers):
+        model = recipes.model.make()
+        v1 = helpers.add_version(model, cache=False)
+        v2 = helpers.add_version(model, cache=False)
+        populate_entity_cache(model)
+
+        model.repo.rollback()
+        v3 = helpers.add_version(model, message='v3', cache=False)
+        populate_entity_cache(model, incremental=True)
+
+        assert {v.sha for v in model.repocache.versions.all()} == {v1.sha, v3.sha}
+        assert v2.sha != v3.sha
+
+    def test_missing_history_falls_back_to_full(self, helpers):
+        model = recipes.model.make()
+        v1 = helpers.add_version(model, cache=False)
+        v2 = helpers.add_version(model, cache=False)
+        populate_entity_cache(model)
+        model.repocache.get_version(v1.sha).delete()
+
+        populate_entity_cache(model, incremental=True)
+
+        assert {v.sha for v in model.repocache.versions.all()} == {v1.sha, v2.sha}
@@ -0,0 +1,118 @@
+from unittest.mock import patch
+
+import pytest
+
+from core import recipes
+from entities.processing import process_check_protocol_callback
+from entities.repository import Commit
+from repocache import signals, versioncache
+from repocache.models import CachedModelVersion
+from repocache.populate import populate_entity_cache
+
+
+@pytest.mark.django_db
+class TestVersionCache:
+    def test_shares_versions_between_lookups(self, helpers, django_assert_num_queries):
+        model = recipes.model.make()
+        commit = helpers.add_version(model, visibility='public', tag_name='v1')
+        cached = model.repocache
+        stored = cached.versions.get(sha=commit.sha)
+        assert cached.get_version(commit.sha) == stored
+
+        with django_assert_num_queries(0):
+            version = cached.get_version(commit.sha)
+            assert version.pk == stored.pk
+            assert version.entity is cached
+            assert version.get_name() == 'v1'
+            assert version.visibility == 'public'
+            for field in versioncache.METADATA_FIELDS + versioncache.STATE_FIELDS:
+                assert getattr(version, field) == getattr(stored, field)
+
+        # The version can be changed like any other
+        version.set_visibility('private')
+        stored.refresh_from_db()
+        assert stored.visibility == 'private'
+
+    def test_missing_versions_not_stored(self, helpers):
+        model = recipes.model.make()
+        cached = model.repocache
+        with pytest.raises(CachedModelVersion.DoesNotExist):
+            versioncache.get_version(cached, '0' * 40)
+
+        commit = helpers.add_version(model, visibility='public')
+        assert cached.get_version(commit.sha).sha == commit.sha
+
+    def test_forgets_state_explicitly(self, helpers, protocol_with_version):
+        # Even without the signal callbacks, changes made through the usual methods are seen
+        model = recipes.model.make()
+        commit = helpers.add_version(model, visibility='private')
+        assert model.get_version_visibility(commit.sha) == 'private'
+        assert model.repocache.get_name_for_version(commit.sha) == commit.sha
+
+        with signals.suppressed():
+            model.set_version_visibility(commit.sha, 'public')
+            model.add_tag('v1', commit.sha)
+        assert model.get_version_visibility(commit.sha) == 'public'
+        assert model.repocache.get_name_for_version(commit.sha) == 'v1'
+
+        protocol = protocol_with_version
+        analysis_task = recipes.analysis_task.make(entity=protocol, version=protocol.repocache.latest_version.sha)
+        assert not protocol.is_parsed_ok(analysis_task.version)
+        with signals.suppressed():
+            process_check_protocol_callback({
+                'signature': str(analysis_task.id),
+                'returntype': 'success',
+                'required': [],
+                'optional': [],
+                'ioputs': [],
+            })
+        assert protocol.is_parsed_ok(analysis_task.version)
+
+    def test_shares_commit_details(self, helpers):
+        model = recipes.model.make()
+        commit = helpers.add_version(model)
+        timestamp, master_filename = commit.timestamp, commit.master_filename
+
+        # Another object for the same commit doesn't read them from git
+        other = model.repo.get_commit(commit.sha)
+        with patch.object(Commit, 'get_blob', side_effect=AssertionError):
+            assert other.master_filename == master_filename
+        assert other.timestamp == timestamp
+        assert versioncache.get_commit_field(commit.sha, 'master_filename', None) == master_filename
+
+    def test_forgets_visibility_when_changed(self, helpers):
+        model = recipes.model.make()
+        commit = helpers.add_version(model, visibility='private')
+        assert model.get_version_visibility(commit.sha) == 'private'
+
+        model.set_version_visibility(commit.sha, 'public')
+        assert model.get_version_visibility(commit.sha) == 'public'
+
+    def test_forgets_tags_when_changed(self, helpers):
+        model = recipes.model.make()
+        commit = helpers.add_version(model, visibility='private')
+        assert model.repocache.get_name_for_version(commit.sha) == commit.sha
+
+        model.add_tag('v1', commit.sha)
+        assert model.repocache.get_name_for_version(commit.sha) == 'v1'
+
+        # Tags found when populating the cache are seen too
+        commit2 = helpers.add_version(model, visibility='private')
+        assert model.repocache.get_name_for_version(commit2.sha) == commit2.sha
+        model.repo.tag('v2', ref=commit2.sha)
+        populate_entity_cache(model)
+        assert model.repocache.get_name_for_version(commit2.sha) == 'v2'
+
+    def test_forgets_parse_results(self, protocol_with_version):
+        protocol = protocol_with_version
+        analysis_task = recipes.analysis_task.make(entity=protocol, version=protocol.repocache.latest_version.sha)
+        assert not protocol.is_parsed_ok(analysis_task.version)
+
+        process_check_protocol_callback({
+            'signature': str(analysis_task.id),
+            'returntype': 'success',
+            'required': [],
+            'optional': [],
+            'ioputs': [],
+        })
+        assert protocol.is_parsed_ok(analysis_task.version)
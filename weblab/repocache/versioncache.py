@@ -0,0 +1,139 @@
+"""
+A cache of cached entity versions and commit details shared between requests and server processes
+
+Versions looked up by SHA are stored in the Django cache named by the ``REPOCACHE_CACHE``
+setting, so that they can usually be built without querying the database. Each version is
+stored under two keys, made from the cached entity's class and primary key and the SHA:
+
+- the commit metadata (timestamp, message, author, master filename and number of files), which
+  is fixed by the SHA, is kept for ``REPOCACHE_VERSION_METADATA_TIMEOUT`` seconds (by default,
+  until the cache evicts it), and forgotten if the entity is repopulated
+- the state which may change (database id, visibility, parsed_ok, has_readme and the labels
+  derived from its tags) expires after ``REPOCACHE_VERSION_STATE_TIMEOUT`` seconds. It is
+  forgotten by `forget_version` wherever it is changed: by `Entity.set_version_visibility`,
+  `Entity.add_tag` and the protocol check callback, and also whenever a version or tag is saved
+  or deleted (see `repocache.signals`)
+
+Details read from git for a commit (see `get_commit_field`) depend only on its SHA, so are
+shared between all repositories holding the commit, and are kept like commit metadata.
+"""
+import re
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import router, transaction
+
+
+# Fields of a cached version that are determined by its commit
+METADATA_FIELDS = ['timestamp', 'message', 'author', 'master_filename', 'numfiles']
+
+# Fields of a cached version that may change
+STATE_FIELDS = ['id', 'visibility', 'parsed_ok', 'has_readme', 'display_name', 'url_label']
+
+SHA_PATTERN = re.compile(r'[0-9a-f]{40}')
+
+
+def get_cache():
+    """
+    :return: the Django cache in which versions are stored
+    """
+    return caches[settings.REPOCACHE_CACHE]
+
+
+def _keys(cache_cls, cached_pk, sha):
+    prefix = 'repocache:{}:{}:{}:'.format(cache_cls._meta.model_name, cached_pk, sha)
+    return prefix + 'metadata', prefix + 'state'
+
+
+def get_version(cached, sha):
+    """
+    Get a version of a cached entity by its SHA, from the shared cache if possible
+
+    :param cached: `CachedEntity` object
+    :param sha: hex string of the commit SHA of the version
+    :return: `CachedEntityVersion` object
+    :raise: CachedVersionClass.DoesNotExist if the version is not in the cache tables
+    """
+    if not SHA_PATTERN.fullmatch(sha):
+        return cached.versions.get(sha=sha)
+
+    cache = get_cache()
+    metadata_key, state_key = _keys(type(cached), cached.pk, sha)
+    stored = cache.get_many([metadata_key, state_key])
+    metadata = stored.get(metadata_key)
+    state = stored.get(state_key)
+    if metadata is None or state is None:
+        version = cached.versions.get(sha=sha)
+        if metadata is None:
+            metadata = {name: getattr(version, name) for name in METADATA_FIELDS}
+            cache.set(metadata_key, metadata, settings.REPOCACHE_VERSION_METADATA_TIMEOUT)
+        if state is None:
+            state = {name: getattr(version, name) for name in STATE_FIELDS}
+            cache.set(state_key, state, settings.REPOCACHE_VERSION_STATE_TIMEOUT)
+        return version
+
+    version = cached.CachedVersionClass(entity=cached, sha=sha, **metadata, **state)
+    version._state.adding = False
+    version._state.db = router.db_for_read(cached.CachedVersionClass)
+    return version
+
+
+def forget_state(cache_cls, cached_pk, shas):
+    """
+    Forget the stored state of some versions of a cached entity, after it has changed
+
+    This is done both immediately and when the current transaction is committed, so that the
+    state can't be stored again from a concurrent request's view of the database before the
+    change is visible to it.
+
+    :param cache_cls: `CachedEntity` subclass
+    :param cached_pk: primary key of the cached entity
+    :param shas: SHAs of the versions
+    """
+    keys = [_keys(cache_cls, cached_pk, sha)[1] for sha in shas]
+    get_cache().delete_many(keys)
+    transaction.on_commit(lambda: get_cache().delete_many(keys))
+
+
+def forget_version(version):
+    """
+    Forget the stored state of a version, after changing it
+
+    :param version: `CachedEntityVersion` object
+    """
+    forget_state(version.CachedEntityClass, version.entity_id, [version.sha])
+
+
+def forget_versions(cached, shas):
+    """
+    Forget everything stored about some versions of a cached entity
+
+    :param cached: `CachedEntity` object
+    :param shas: SHAs of the versions
+    """
+    keys = [key for sha in shas for key in _keys(type(cached), cached.pk, sha)]
+    get_cache().delete_many(keys)
+    transaction.on_commit(lambda: get_cache().delete_many(keys))
+
+
+_MISSING = object()
+
+
+def get_commit_field(sha, name, compute):
+    """
+    Get a detail of a commit read from git, from the shared cache if possible
+
+    :param sha: hex string of the commit SHA
+    :param name: name of the detail
+    :param compute: function of no arguments that reads the detail from git
+    :return: the value of the detail
+    """
+    cache = get_cache()
+    key = 'repocache:commit:{}:{}'.format(sha, name)
+    # Stored in a tuple so that None can be cached
+    stored = cache.get(key, _MISSING)
+    if stored is not _MISSING:
+        return stored[0]
+    value = compute()
+    cache.set(key, (value,), settings.REPOCACHE_VERSION_METADATA_TIMEOUT)
+    return value
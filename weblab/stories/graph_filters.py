@@ -33,7 +33,8 @@ def get_model_version_pks(mk):
             assert model_or_group.startswith('model'), f'{model_or_group} should start with model or modelgroup'
             model_or_group = int(model_or_group.replace('model', ''))
             models |= ModelEntity.objects.filter(pk=model_or_group)
-    return (m.repocache.latest_version.pk for m in models if m.repocache.versions.exists())
+    latest_version_pks = (m.repocache.latest_version_id for m in models)
+    return (pk for pk in latest_version_pks if pk is not None)
 
 
 def get_versions_for_model_and_protocol(user, mk, pk):